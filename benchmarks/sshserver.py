@@ -0,0 +1,210 @@
+"""
+In-process SSH/SFTP server on localhost for benchmarks
+Exec requests run in a local bash and SFTP serves the local file system, so
+"remote" paths are plain local paths. Any user name and password is accepted.
+Only for benchmarks and experiments: never expose it beyond 127.0.0.1.
+"""
+import logging
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+from paramiko import (AUTH_SUCCESSFUL, OPEN_SUCCEEDED, SFTP_OK, SFTPAttributes, SFTPHandle,
+                      SFTPServer, SFTPServerInterface, ServerInterface)
+
+from cybergis.connection import SSHConnection
+
+
+class _Server(ServerInterface):
+
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_run_exec, args=(channel, command.decode("utf-8")), daemon=True).start()
+        return True
+
+
+def _run_exec(channel, command):
+    proc = subprocess.Popen(["bash", "-c", command],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump_stdin():
+        try:
+            for data in iter(lambda: channel.recv(65536), b""):
+                proc.stdin.write(data)
+                proc.stdin.flush()
+        except Exception:
+            pass
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+
+    def pump_stderr():
+        for data in iter(lambda: proc.stderr.read1(65536), b""):
+            channel.sendall_stderr(data)
+
+    threading.Thread(target=pump_stdin, daemon=True).start()
+    stderr_thread = threading.Thread(target=pump_stderr, daemon=True)
+    stderr_thread.start()
+    try:
+        for data in iter(lambda: proc.stdout.read1(65536), b""):
+            channel.sendall(data)
+        stderr_thread.join()
+        channel.send_exit_status(proc.wait())
+    except Exception:
+        # client went away
+        proc.kill()
+    finally:
+        channel.close()
+
+
+class _Handle(SFTPHandle):
+
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SFTP(SFTPServerInterface):
+
+    def list_folder(self, path):
+        try:
+            out = []
+            for fname in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, fname)))
+                attr.filename = fname
+                out.append(attr)
+            return out
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o666)
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+        return SFTP_OK
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        # mode and times, so transfers that keep mtimes can be checked
+        return self._call(SFTPServer.set_file_attr, path, attr)
+
+
+logging.getLogger("cybergis.benchmarks.sshserver").setLevel(logging.CRITICAL)
+
+
+class LocalSSHServer(object):
+    """
+    Threaded paramiko SSH/SFTP server bound to 127.0.0.1
+        with LocalSSHServer() as server:
+            conn = server.connection()
+            conn.login()
+    """
+    host = "127.0.0.1"
+
+    def __init__(self, port=0):
+        """
+        :param port: port to listen on; default(0): any free port
+        """
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = None
+        self._transports = []
+        self.port = port
+
+    def start(self):
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(100)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                client, address = self._socket.accept()
+            except OSError:
+                # socket closed by stop()
+                return
+            transport = paramiko.Transport(client)
+            # clients hanging up are expected; keep their resets out of the client's paramiko log
+            transport.set_log_channel("cybergis.benchmarks.sshserver")
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, _SFTP)
+            transport.start_server(server=_Server())
+            self._transports.append(transport)
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def connection(self, **kwargs):
+        """
+        :param kwargs: passed to SSHConnection (folder_transfer_mode, max_sessions, ...)
+        :return: SSHConnection to this server, not logged in yet
+        """
+        kwargs.setdefault("host_metadata_cache", False)
+        return SSHConnection(self.host, user_name="benchmark", user_pw="benchmark", port=self.port, **kwargs)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,261 @@
+"""
+Folder transfer benchmark: SSHConnection.upload/download throughput per transfer mode and folder shape,
+plus command round-trip latency, against an in-process SSH/SFTP server on localhost
+    python -m benchmarks.transfer_benchmark --output results.json
+    python -m benchmarks.transfer_benchmark --shapes many_small --modes zip,parallel --repeat 5
+Localhost has no network latency or bandwidth limit, so absolute numbers show CPU and
+protocol overhead (compression, SFTP request pipelining, per-file round trips); compare
+results of the same machine over time, or add --latency-ms to emulate a WAN link.
+"""
+import argparse
+import array
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import paramiko
+
+from cybergis.instrumentation import get_instrumentation
+from .sshserver import LocalSSHServer
+
+UPLOAD_MODES = ["zip", "stream", "parallel", "resumable", "delta", "delta_rerun"]
+DOWNLOAD_MODES = ["zip", "stream", "parallel", "resumable"]
+
+
+def _write_random(fpath, size):
+    with open(fpath, "wb") as f:
+        f.write(os.urandom(size))
+
+
+def make_few_large(folder_path, scale=1.0):
+    # incompressible model inputs/outputs: 4 x 16 MB
+    for i in range(4):
+        _write_random(os.path.join(folder_path, "large_{}.bin".format(i)), int(16 * 1024 * 1024 * scale))
+
+
+def make_many_small(folder_path, scale=1.0):
+    # configuration/forcing trees: 1000 text files of ~2 KB in 10 sub folders
+    rnd = random.Random(0)
+    for i in range(max(int(1000 * scale), 1)):
+        sub = os.path.join(folder_path, "sub_{}".format(i % 10))
+        os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, "param_{}.txt".format(i)), "w") as f:
+            for j in range(64):
+                f.write("param_{} {:.6f}\n".format(j, rnd.random()))
+
+
+def make_netcdf_like(folder_path, scale=1.0):
+    # gridded time series: header + smooth float32 fields, compressible like real netCDF/HDF5 output
+    n_values = int(4 * 1024 * 1024 * scale)
+    for i in range(4):
+        values = array.array("f", (math.sin(k / 5000.0 + i) * 100 + (k % 7) * 0.01 for k in range(n_values)))
+        with open(os.path.join(folder_path, "timestep_{}.nc".format(i)), "wb") as f:
+            f.write(b"CDF\x02" + b"\x00" * 1020)
+            f.write(values.tobytes())
+
+
+SHAPES = {"few_large": make_few_large,
+          "many_small": make_many_small,
+          "netcdf_like": make_netcdf_like}
+
+
+def folder_stats(folder_path):
+    n_files, n_bytes = 0, 0
+    for root, dirs, files in os.walk(folder_path):
+        for fname in files:
+            n_files += 1
+            n_bytes += os.path.getsize(os.path.join(root, fname))
+    return n_files, n_bytes
+
+
+def _delay_transport(latency_ms):
+    # emulate a WAN round trip by delaying every packet the client sends
+    delay = latency_ms / 1000.0
+    original = paramiko.Packetizer.send_message
+
+    def send_message(self, data):
+        time.sleep(delay)
+        return original(self, data)
+    paramiko.Packetizer.send_message = send_message
+    return original
+
+
+def _measure(func, repeat, setup=None):
+    seconds = []
+    for i in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.time()
+        func(*args)
+        seconds.append(time.time() - start)
+    return seconds
+
+
+def _summary(shape, mode, direction, seconds, n_files, n_bytes):
+    median = statistics.median(seconds)
+    return {"shape": shape,
+            "mode": mode,
+            "direction": direction,
+            "files": n_files,
+            "bytes": n_bytes,
+            "seconds": seconds,
+            "median_seconds": median,
+            "min_seconds": min(seconds),
+            "mb_per_s": n_bytes / 1e6 / median if median > 0 else None}
+
+
+def benchmark_latency(conn, repeat):
+    seconds = _measure(lambda: conn.run_command("true"), repeat)
+    batched = _measure(lambda: conn.run_commands(["true"] * 10), max(repeat // 10, 1))
+    return {"run_command_median_seconds": statistics.median(seconds),
+            "run_command_p95_seconds": sorted(seconds)[int(0.95 * (len(seconds) - 1))],
+            "run_commands_10_median_seconds": statistics.median(batched)}
+
+
+def benchmark_shape(server, work_dir, shape, upload_modes, download_modes, repeat, scale):
+    local_path = os.path.join(work_dir, "local", shape)  # uploaded as <remote folder>/<shape>
+    os.makedirs(local_path)
+    SHAPES[shape](local_path, scale)
+    n_files, n_bytes = folder_stats(local_path)
+    results = []
+    counter = [0]
+
+    def new_folder(prefix):
+        counter[0] += 1
+        path = os.path.join(work_dir, "{}_{}".format(prefix, counter[0]))
+        os.makedirs(path)
+        return path
+
+    def check(direction, mode):
+        # the last transferred copy must be complete, or the timing means nothing
+        copied = os.path.join(work_dir, "{}_{}".format("remote" if direction == "upload" else "download",
+                                                       counter[0]), shape)
+        if folder_stats(copied) != (n_files, n_bytes):
+            raise Exception("{} {} of {} is incomplete: {} files, {} bytes".format(
+                mode, direction, shape, *folder_stats(copied)))
+
+    for mode in upload_modes:
+        conn = server.connection()
+        conn.login()
+        try:
+            if mode == "delta_rerun":
+                # sync an unchanged folder again: the cost of the manifest comparison alone
+                target = new_folder("remote")
+                conn.upload(local_path, target, remote_is_folder=True, mode="delta")
+                seconds = _measure(lambda: conn.upload(local_path, target, remote_is_folder=True, mode="delta"),
+                                   repeat)
+            else:
+                if mode == "delta":
+                    # cold: no cached remote folder to seed from
+                    shutil.rmtree(os.path.join(os.environ["CYBERGIS_CACHE_DIR"], "manifests"), ignore_errors=True)
+                seconds = _measure(lambda target: conn.upload(local_path, target, remote_is_folder=True, mode=mode),
+                                   repeat, setup=lambda: (new_folder("remote"),))
+        finally:
+            conn.logout()
+        check("upload", mode)
+        results.append(_summary(shape, mode, "upload", seconds, n_files, n_bytes))
+        print("{:12s} upload   {:12s} {:8.3f}s {:8.1f} MB/s".format(
+            shape, mode, results[-1]["median_seconds"], results[-1]["mb_per_s"] or 0))
+
+    remote_path = os.path.join(new_folder("remote"), shape)
+    shutil.copytree(local_path, remote_path)
+    for mode in download_modes:
+        conn = server.connection()
+        conn.login()
+        try:
+            seconds = _measure(lambda target: conn.download(remote_path, target, remote_is_folder=True, mode=mode),
+                               repeat, setup=lambda: (new_folder("download"),))
+        finally:
+            conn.logout()
+        check("download", mode)
+        results.append(_summary(shape, mode, "download", seconds, n_files, n_bytes))
+        print("{:12s} download {:12s} {:8.3f}s {:8.1f} MB/s".format(
+            shape, mode, results[-1]["median_seconds"], results[-1]["mb_per_s"] or 0))
+    return results
+
+
+def run(shapes=None, upload_modes=None, download_modes=None, repeat=3, scale=1.0, latency_ms=0, work_dir=None):
+    """
+    :param shapes: folder shapes to benchmark; default(None): all of SHAPES
+    :param upload_modes: default(None): UPLOAD_MODES
+    :param download_modes: default(None): DOWNLOAD_MODES
+    :param repeat: runs per measurement, the median is reported
+    :param scale: multiplies the size of every generated folder
+    :param latency_ms: emulated delay per client packet; 0: plain localhost
+    :param work_dir: scratch folder for generated and transferred data; default(None): a temp folder
+    :return: results dict, as saved by main()
+    """
+    shapes = shapes if shapes is not None else list(SHAPES)
+    upload_modes = upload_modes if upload_modes is not None else UPLOAD_MODES
+    download_modes = download_modes if download_modes is not None else DOWNLOAD_MODES
+    own_work_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix="cybergis_benchmark_") if own_work_dir else work_dir
+    # keep checkpoints and manifest caches of the benchmark away from the user's cache
+    os.environ["CYBERGIS_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    original_send = _delay_transport(latency_ms) if latency_ms > 0 else None
+    get_instrumentation().reset()
+    try:
+        with LocalSSHServer() as server:
+            conn = server.connection()
+            conn.login()
+            try:
+                latency = benchmark_latency(conn, repeat * 10)
+            finally:
+                conn.logout()
+            results = []
+            for shape in shapes:
+                results.extend(benchmark_shape(server, os.path.join(work_dir, shape),
+                                               shape, upload_modes, download_modes, repeat, scale))
+    finally:
+        if original_send is not None:
+            paramiko.Packetizer.send_message = original_send
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {"created": time.time(),
+            "python": platform.python_version(),
+            "paramiko": paramiko.__version__,
+            "platform": platform.platform(),
+            "config": {"shapes": shapes,
+                       "upload_modes": upload_modes,
+                       "download_modes": download_modes,
+                       "repeat": repeat,
+                       "scale": scale,
+                       "latency_ms": latency_ms},
+            "latency": latency,
+            "results": results,
+            "instrumentation": get_instrumentation().snapshot()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="comma separated, from: " + ", ".join(SHAPES))
+    parser.add_argument("--modes", default=None,
+                        help="comma separated transfer modes; default: " + ", ".join(UPLOAD_MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="size multiplier of the generated folders")
+    parser.add_argument("--latency-ms", type=float, default=0, help="emulated delay per client packet")
+    parser.add_argument("--output", default="transfer_benchmark.json", help="json file to write results to")
+    args = parser.parse_args(argv)
+    shapes = args.shapes.split(",")
+    for shape in shapes:
+        if shape not in SHAPES:
+            parser.error("unknown shape {}".format(shape))
+    upload_modes, download_modes = None, None
+    if args.modes is not None:
+        modes = args.modes.split(",")
+        upload_modes = [m for m in modes if m in UPLOAD_MODES]
+        download_modes = [m for m in modes if m in DOWNLOAD_MODES]
+    results = run(shapes, upload_modes, download_modes, args.repeat, args.scale, args.latency_ms)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,25 @@
 from .base import *
 from .connection import *
+from .pool import *
+from .transfer import *
+from .manifest import *
+from .compression import *
+from .follow import *
+from .hostinfo import *
+from .agent import *
+from .remotefile import *
+from .instrumentation import *
+from .ratelimit import *
+from .local import *
+from .asyncconnection import *
 from .keeling import *
 from .comet import *
 from .summa import *
 from .rhessys import *
 from .utils import *
 from .job import *
+from .monitor import *
+from .polling import *
 from .summaUI import *
 from .floret import *
 from .shapefile import *
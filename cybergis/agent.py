@@ -0,0 +1,287 @@
+import base64
+import itertools
+import json
+import shlex
+import threading
+
+from .utils import get_logger
+
+logger = get_logger()
+
+# runs on the login node with the python found there (3.5+, standard library only);
+# one JSON-RPC 2.0 request per stdin line, one response per stdout line
+AGENT_SCRIPT = r'''
+import base64, hashlib, json, os, platform, stat, subprocess, sys
+
+
+def _expand(path):
+    return os.path.expanduser(path)
+
+
+def _entry(st):
+    return {"size": st.st_size, "mtime": st.st_mtime, "mode": st.st_mode, "is_dir": stat.S_ISDIR(st.st_mode)}
+
+
+def _sha1(fpath):
+    h = hashlib.sha1()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _run(argv):
+    proc = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise Exception("{} exited with {}: {}".format(argv[0], proc.returncode, err.strip()))
+    return out.splitlines()
+
+
+def ping():
+    return {"pid": os.getpid(), "python": platform.python_version(), "home": os.path.expanduser("~"),
+            "cwd": os.getcwd()}
+
+
+def stat_(path):
+    try:
+        return _entry(os.stat(_expand(path)))
+    except OSError:
+        return None
+
+
+def list_(path):
+    path = _expand(path)
+    out = {}
+    for name in os.listdir(path):
+        try:
+            out[name] = _entry(os.stat(os.path.join(path, name)))
+        except OSError:
+            # broken symlink
+            pass
+    return out
+
+
+def hash_(paths):
+    return {p: _sha1(_expand(p)) if os.path.isfile(_expand(p)) else None for p in paths}
+
+
+def manifest(path, hash_files=False):
+    path = _expand(path)
+    out = {}
+    for root, dirs, files in os.walk(path, followlinks=True):
+        for name in files:
+            fpath = os.path.join(root, name)
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            out[os.path.relpath(fpath, path)] = {"size": st.st_size, "mtime": st.st_mtime,
+                                                 "sha1": _sha1(fpath) if hash_files else None}
+    return out
+
+
+def tail(path, offset=0, max_bytes=1024 * 1024):
+    path = _expand(path)
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        return {"size": None, "offset": offset, "data": "", "reset": False}
+    reset = size < offset
+    if reset:
+        offset = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(min(size - offset, max_bytes))
+    return {"size": size, "offset": offset + len(data), "data": base64.b64encode(data).decode("ascii"),
+            "reset": reset}
+
+
+def sacct(job_ids):
+    out = {}
+    for line in _run(["sacct", "-j", ",".join(str(j) for j in job_ids), "-X", "--parsable2", "--noheader",
+                      "--format=JobID,State"]):
+        job_id, state = line.split("|", 1)
+        out[job_id] = state
+    return out
+
+
+def squeue(user=None, job_ids=None):
+    argv = ["squeue", "-h", "-o", "%i|%T"]
+    if user is not None:
+        argv += ["-u", user]
+    if job_ids is not None:
+        argv += ["-j", ",".join(str(j) for j in job_ids)]
+    out = {}
+    for line in _run(argv):
+        job_id, state = line.split("|", 1)
+        out[job_id] = state
+    return out
+
+
+METHODS = {"ping": ping, "stat": stat_, "list": list_, "hash": hash_, "manifest": manifest, "tail": tail,
+           "sacct": sacct, "squeue": squeue}
+
+for line in iter(sys.stdin.readline, ""):
+    request = json.loads(line)
+    response = {"jsonrpc": "2.0", "id": request.get("id")}
+    try:
+        response["result"] = METHODS[request["method"]](**request.get("params", {}))
+    except Exception as ex:
+        response["error"] = {"code": -32000, "message": "{}: {}".format(type(ex).__name__, ex)}
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+'''
+
+AGENT_COMMAND = 'PY=$(command -v python3 || command -v python) && exec "$PY" -u -c {}'.format(
+    shlex.quote(AGENT_SCRIPT))
+
+
+class RemoteAgent(object):
+    """
+    Client of a small Python agent started once on the login node, speaking JSON-RPC over one exec channel
+    stat, list, hash, manifest, tail and sacct/squeue queries become one request line each
+    instead of a new channel and remote shell per call, and files are hashed server-side:
+        agent = connection.get_agent()
+        agent.manifest("/path/to/job/folder", hash_files=True)
+    Calls are serialized; the agent exits when its channel closes.
+    """
+    # seconds to wait for one response; hashing a big folder can take a while
+    timeout = 600
+
+    def __init__(self, connection, timeout=None):
+        """
+        :param connection: logged-in SSHConnection
+        :param timeout: seconds to wait for a response; default(None): self.timeout
+        """
+        self.connection = connection
+        if timeout is not None:
+            self.timeout = timeout
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._channel = None
+        self._reader = None
+
+    def start(self):
+        """
+        Launch the agent and check it answers
+        :return: result of ping (pid, python version, home, cwd)
+        """
+        self._channel = self.connection.open_channel(AGENT_COMMAND)
+        self._channel.settimeout(self.timeout)
+        self._reader = self._channel.makefile("rb")
+        try:
+            info = self.call("ping")
+        except Exception:
+            self.close()
+            raise
+        logger.debug("Remote agent on {} running with python {}".format(self.connection.server, info["python"]))
+        return info
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def alive(self):
+        return self._channel is not None and not self._channel.closed and not self._channel.exit_status_ready()
+
+    def call(self, method, **params):
+        """
+        :return: result of the method on remote
+        The agent is closed (and restarted by connection.get_agent on next use) if the call times out
+        or the channel fails, so a late response can never be read as the answer to a later call.
+        """
+        with self._lock:
+            if self._channel is None:
+                raise Exception("Remote agent is not running")
+            request_id = next(self._ids)
+            request = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+            self.connection.touch()
+            try:
+                self._channel.sendall((json.dumps(request) + "\n").encode("utf-8"))
+                response = self._read_response(request_id)
+            except Exception:
+                self.close()
+                raise
+        if "error" in response:
+            raise Exception("Remote agent {} failed: {}".format(method, response["error"]["message"]))
+        return response["result"]
+
+    def _read_response(self, request_id):
+        while True:
+            line = self._reader.readline()
+            if not line:
+                err = self._channel.recv_stderr(65536).decode("utf-8", errors="replace") \
+                    if self._channel.recv_stderr_ready() else ""
+                raise Exception("Remote agent on {} exited: {}".format(self.connection.server, err.strip()))
+            response = json.loads(line.decode("utf-8"))
+            response_id = response.get("id")
+            if response_id == request_id:
+                return response
+            if isinstance(response_id, int) and response_id < request_id:
+                logger.debug("Dropping stale remote agent response {}".format(response_id))
+                continue
+            raise Exception("Remote agent on {} answered request {} with {}".format(self.connection.server,
+                                                                                   request_id, response_id))
+
+    def ping(self):
+        return self.call("ping")
+
+    def stat(self, path):
+        """
+        :return: {"size", "mtime", "mode", "is_dir"}, None if path does not exist
+        """
+        return self.call("stat", path=path)
+
+    def list(self, path):
+        """
+        :return: {name: {"size", "mtime", "mode", "is_dir"}}
+        """
+        return self.call("list", path=path)
+
+    def hash(self, paths):
+        """
+        :return: {path: sha1 hex}, None for paths that are not files
+        """
+        return self.call("hash", paths=list(paths))
+
+    def manifest(self, path, hash_files=False):
+        """
+        Same result as manifest.remote_manifest
+        :return: {relative path: {"size": int, "mtime": float, "sha1": str}}; empty if folder does not exist
+        """
+        return self.call("manifest", path=path, hash_files=hash_files)
+
+    def tail(self, path, offset=0, max_bytes=1024 * 1024):
+        """
+        Bytes of a file past offset; a file shorter than offset is read from the start
+        :return: (data bytes, new offset)
+        """
+        result = self.call("tail", path=path, offset=offset, max_bytes=max_bytes)
+        return base64.b64decode(result["data"]), result["offset"]
+
+    def sacct(self, job_ids):
+        """
+        :return: {job id: sacct State}
+        """
+        return self.call("sacct", job_ids=list(job_ids))
+
+    def squeue(self, user=None, job_ids=None):
+        """
+        :return: {job id: squeue state}
+        """
+        return self.call("squeue", user=user, job_ids=list(job_ids) if job_ids is not None else None)
+
+    def close(self):
+        if self._channel is not None:
+            channel, self._channel = self._channel, None
+            self.connection.close_channel(channel)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,204 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import BaseConnection
+from .connection import SSHConnection
+from .monitor import get_job_status_monitor, normalize_job_state
+from .polling import JobWaiter, squeue_status
+from .utils import UtilsMixin
+
+
+class AsyncSSHConnection(UtilsMixin, BaseConnection):
+    """
+    asyncio counterpart of SSHConnection; every operation is a coroutine
+    Commands run on non-blocking channels of one shared SSH transport and are
+    awaited through the event loop's reader callbacks, so one loop can drive
+    hundreds of commands and status polls without a thread each. SFTP
+    transfers, which paramiko only offers as blocking calls, run on a small
+    bounded thread pool.
+
+    conn = AsyncSSHConnection("keeling.earth.illinois.edu", user_name="cigi-gisolve", key_path="/path/to/key")
+    async with conn:
+        await asyncio.gather(conn.upload(...), conn.run_command("squeue -u cigi-gisolve"))
+    """
+    connection_type = "ssh_async"
+    # threads running blocking SFTP transfers
+    transfer_workers = 4
+
+    def __init__(self, server, user_name=None, user_pw=None, key_path=None,
+                 connection=None, transfer_workers=None, **kargs):
+        """
+        :param connection: SSHConnection to drive; default(None): create one from the other arguments
+        :param transfer_workers: threads running uploads/downloads; default(None): self.transfer_workers
+        :param kargs: passed to SSHConnection
+        """
+        super().__init__()
+        if connection is None:
+            connection = SSHConnection(server, user_name=user_name, user_pw=user_pw, key_path=key_path, **kargs)
+        self.connection = connection
+        self.server = connection.server
+        if transfer_workers is not None:
+            self.transfer_workers = transfer_workers
+        self._transfer_executor = ThreadPoolExecutor(max_workers=self.transfer_workers)
+        self._sessions = None
+
+    @property
+    def logged_in(self):
+        return self.connection.logged_in
+
+    async def _run_blocking(self, func, *args, executor=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.logout()
+
+    async def login(self, *args, **kwargs):
+        await self._run_blocking(self.connection.login)
+
+    async def logout(self, *args, **kwargs):
+        await self._run_blocking(self.connection.logout)
+        self._transfer_executor.shutdown(wait=False)
+        self._transfer_executor = ThreadPoolExecutor(max_workers=self.transfer_workers)
+
+    async def upload(self, local_fpath, remote_fpath, *args, **kwargs):
+        """
+        Awaitable SSHConnection.upload, same arguments
+        """
+        return await self._run_blocking(self.connection.upload, local_fpath, remote_fpath, *args,
+                                        executor=self._transfer_executor, **kwargs)
+
+    async def download(self, remote_fpath, local_fpath, *args, **kwargs):
+        """
+        Awaitable SSHConnection.download, same arguments
+        """
+        return await self._run_blocking(self.connection.download, remote_fpath, local_fpath, *args,
+                                        executor=self._transfer_executor, **kwargs)
+
+    def _open_channel(self, command, priority):
+        # admitted by the login node's RateLimiter like SSHConnection commands
+        with self.connection.rate_limit(priority):
+            return self.connection.open_channel(command)
+
+    async def exec_command(self, command, priority="command"):
+        """
+        Run a command on its own channel without blocking the event loop
+        :param priority: admission priority on a busy login node: "submit", "command", "transfer" or "poll"
+        :return: (stdout text, stderr text, exit status)
+        """
+        if self._sessions is None:
+            # queue commands here rather than in threads blocked on the connection's session cap;
+            # one session is held by the main SFTP channel
+            self._sessions = asyncio.Semaphore(max(1, self.connection.max_sessions - 1))
+        async with self._sessions:
+            self.connection.touch()
+            channel = await self._run_blocking(self._open_channel, command, priority)
+            try:
+                return await self._read_channel(channel)
+            finally:
+                self.connection.close_channel(channel)
+
+    @staticmethod
+    async def _read_channel(channel, poll_seconds=1.0):
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = channel.fileno()
+        loop.add_reader(fd, readable.set)
+        out, err = [], []
+        try:
+            while True:
+                readable.clear()
+                while channel.recv_ready():
+                    out.append(channel.recv(32768))
+                while channel.recv_stderr_ready():
+                    err.append(channel.recv_stderr(32768))
+                # exit-status is sent after all data
+                if channel.exit_status_ready() or channel.closed:
+                    if not channel.recv_ready() and not channel.recv_stderr_ready():
+                        break
+                    continue
+                try:
+                    # the exit status does not wake the reader, so poll for it as well
+                    await asyncio.wait_for(readable.wait(), poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            loop.remove_reader(fd)
+        return (b"".join(out).decode("utf-8", errors="replace"),
+                b"".join(err).decode("utf-8", errors="replace"),
+                channel.recv_exit_status())
+
+    async def run_command(self, command, line_delimiter='', raise_on_error=False, priority="command",
+                          *args, **kwargs):
+        """
+        Awaitable SSHConnection.run_command, same arguments and return value
+        """
+        self.logger.debug("run_command (async) on remote: " + command)
+        out, err, _ = await self.exec_command(command, priority=priority)
+        out = list(map(self.remove_newlines, out.splitlines()))
+        err = list(map(self.remove_newlines, err.splitlines()))
+        self.logger.debug("out: " + str(out))
+        self.logger.debug("err: " + str(err))
+        if len(err) > 0:
+            self.logger.debug("run_command {} got error {}".format(command, ';'.join(err)))
+            if raise_on_error:
+                raise Exception(';'.join(err))
+        if len(out) == 0:
+            return None
+        if type(line_delimiter) is not str:
+            return out
+        return line_delimiter.join(out)
+
+    async def job_statuses(self, remote_ids):
+        """
+        Status of several Slurm jobs with one sacct call
+        :param remote_ids: list of Slurm job ids
+        :return: {remote_id: status}, "UNKNOWN" for jobs sacct does not list (yet)
+        """
+        remote_ids = [str(i) for i in remote_ids]
+        statuses = dict.fromkeys(remote_ids, "UNKNOWN")
+        if len(remote_ids) == 0:
+            return statuses
+        out = await self.run_command("sacct -j {} -X --noheader --parsable2 --format=JobID,State".format(
+            ",".join(remote_ids)), line_delimiter=None, raise_on_error=True, priority="poll")
+        for line in out or []:
+            job_id, state = line.split("|", 1)
+            if job_id in statuses:
+                statuses[job_id] = normalize_job_state(state)
+        return statuses
+
+    async def job_status(self, remote_id):
+        statuses = await self.job_statuses([remote_id])
+        return statuses[str(remote_id)]
+
+    async def wait_for_job(self, remote_id, walltime_seconds=None, timeout=None, on_status=None, **kwargs):
+        """
+        Wait for a Slurm job to reach a final status
+        Polls through the connection's shared JobStatusMonitor with JobWaiter's backoff, like
+        polling.wait_for_job; the event loop only sleeps between polls.
+        :param walltime_seconds: job time limit, polls faster near the expected end; default(None): unknown
+        :param timeout: give up after this many seconds; default(None): never
+        :param on_status: callback(remote_id, status) called whenever the status changes
+        :param kwargs: JobWaiter options, eg: pending_max_seconds=600
+        :return: final status
+        """
+        monitor = get_job_status_monitor(self.connection)
+        waiter = JobWaiter(lambda: monitor.status(remote_id), walltime_seconds=walltime_seconds, timeout=timeout,
+                           recheck_func=lambda: squeue_status(self.connection, remote_id), **kwargs)
+        status = None
+        while True:
+            # the poll runs sacct (or squeue), blocking
+            interval = await self._run_blocking(waiter.poll)
+            if waiter.status != status:
+                status = waiter.status
+                self.logger.info("Job {} status: {}".format(remote_id, status))
+                if on_status is not None:
+                    on_status(remote_id, status)
+            if interval is None:
+                return status
+            await asyncio.sleep(interval)
@@ -1,4 +1,5 @@
 import os
+from contextlib import contextmanager
 from string import Template
 
 from .utils import get_logger
@@ -26,6 +27,23 @@ class BaseConnection(object):
     def run_command(self, command, *args, **kwargs):
         raise NotImplementedError()
 
+    def call_idempotent(self, func, *args, **kwargs):
+        # connections that can drop override this to reconnect and retry
+        return func(*args, **kwargs)
+
+    def close_idle(self):
+        # connections holding a transport override this to close it until their next operation
+        pass
+
+    def get_agent(self):
+        # remote agent answering file and scheduler queries in-process, None: use shell commands
+        return None
+
+    @contextmanager
+    def rate_limit(self, kind="command"):
+        # connections to shared login nodes override this to queue operations, see ratelimit.RateLimiter
+        yield
+
 
 class BaseScript(object):
     file_name = "script.sh"
@@ -71,6 +89,8 @@ class BaseJob(object):
 
 class SBatchScript(BaseScript):
     file_name = "job.sbatch"
+    # content-addressed store of job inputs shared by all jobs on a backend (see manifest.BlobStore)
+    remote_blob_store_folder_path = None
 
     SCRIPT_TEMPLATE = \
         '''#!/bin/bash
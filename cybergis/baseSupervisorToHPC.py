@@ -1,7 +1,8 @@
-from .base import SBatchScript, BaseJob
-from .connection import SSHConnection
+from .base import SBatchScript
+from .pool import get_connection_pool
 from .job import SlurmJob
 from .keeling import KeelingSBatchScript, KeelingJob
+from .monitor import get_job_status_monitor
 from .utils import get_logger
 
 
@@ -69,26 +70,26 @@ class BaseSupervisorToHPC(object):
 
         if self.machine.lower() == "keeling":
             if self.username == "cigi-gisolve":
-                self.connection = SSHConnection(
+                self.connection = get_connection_pool().get_connection(
                     "keeling.earth.illinois.edu",
                     user_name="cigi-gisolve",
                     key_path=self.private_key_path,
                 )
             else:
-                self.connection = SSHConnection(
+                self.connection = get_connection_pool().get_connection(
                     "keeling.earth.illinois.edu",
                     user_name=self.username,
                     user_pw=self.user_pw,
                 )
         elif self.machine.lower() == "comet" or self.machine.lower() == "expanse":
             if self.username == "cybergis":
-                self.connection = SSHConnection(
+                self.connection = get_connection_pool().get_connection(
                     "login.expanse.sdsc.edu",
                     user_name="cybergis",
                     key_path=self.private_key_path,
                 )
             else:
-                self.connection = SSHConnection(
+                self.connection = get_connection_pool().get_connection(
                     "login.expanse.sdsc.edu", user_name=self.username, user_pw=self.user_pw
                 )
         self.connection.login()
@@ -131,7 +132,8 @@ class BaseSupervisorToHPC(object):
         return return_dict
 
     def job_status(self, remote_id):
-        return SlurmJob.job_status_sacct(BaseJob(), remote_id, self.connection)
+        # cached, shared by every supervisor polling jobs on this connection
+        return get_job_status_monitor(self.connection).status(remote_id)
 
     def download(
             self,
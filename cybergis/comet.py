@@ -22,6 +22,7 @@ class CometSBatchScript(SBatchScript):
 
         # expanse: https://www.sdsc.edu/support/user_guides/expanse.html
         self.remote_workspace_folder_path = "/expanse/lustre/scratch/cybergis/temp_project"
+        self.remote_blob_store_folder_path = os.path.join(self.remote_workspace_folder_path, "blob_store")
         if self.partition is None:
             self.partition = "shared"  # compute, shared
         # Expanse has 128 cpu/node
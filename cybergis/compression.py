@@ -0,0 +1,184 @@
+import os
+import time
+import zlib
+
+from .utils import get_logger
+
+logger = get_logger()
+
+STORE = "store"
+FAST = "fast"
+STRONG = "strong"
+
+
+class CompressionPolicy(object):
+    """
+    Choose per file or per stream whether to store, compress fast or compress hard,
+    so a transfer ends up bound by whichever of network and CPU is cheaper.
+
+    Files with an already-compressed extension are stored. Other files are sampled
+    (head, middle and tail) and deflated at level 1 to estimate how compressible
+    they are; near-incompressible data (eg: deflated netCDF4/HDF5) is stored.
+    For the rest, measured compression speeds and ratios are weighed against the
+    network throughput, which is re-estimated from completed transfers.
+    zlib/gzip levels stand in for fast/strong codecs because they need nothing
+    beyond the standard library locally and gzip/unzip on the login nodes.
+    """
+    levels = {STORE: 0, FAST: 1, STRONG: 9}
+    compressed_extensions = (".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".7z", ".rar",
+                             ".jpg", ".jpeg", ".png", ".gif", ".mp4", ".pdf",
+                             ".simg", ".sif", ".npz")
+    sample_size = 64 * 1024
+    # files smaller than this are not worth sampling
+    min_sample_file_size = 256 * 1024
+    # samples used to measure level 9 against level 1
+    calibration_samples = 8
+
+    def __init__(self, network_mbps=100.0, incompressible_ratio=0.9):
+        """
+        :param network_mbps: initial guess of network throughput in Mbit/s
+        :param incompressible_ratio: compressed/raw ratio at level 1 above which data is stored
+        """
+        self.network_mbps = float(network_mbps)
+        self.incompressible_ratio = incompressible_ratio
+        # running estimates per zlib level: MB/s of input and compressed/raw ratio
+        self.speeds = {1: 60.0, 9: 8.0}
+        self.ratios = {1: 0.6, 9: 0.5}
+        self._calibrated = 0
+        self.last_report = None
+
+    def _read_sample(self, fpath, size):
+        with open(fpath, "rb") as f:
+            if size <= 3 * self.sample_size:
+                return f.read()
+            data = f.read(self.sample_size)
+            f.seek(size // 2)
+            data += f.read(self.sample_size)
+            f.seek(size - self.sample_size)
+            data += f.read(self.sample_size)
+        return data
+
+    @staticmethod
+    def _average(old, new, weight=0.2):
+        return old * (1 - weight) + new * weight
+
+    def measure(self, data):
+        """
+        Compress a sample, update speed/ratio estimates
+        :return: {level: compressed/raw ratio}
+        """
+        measured = {}
+        levels = (1, 9) if self._calibrated < self.calibration_samples else (1,)
+        for level in levels:
+            start = time.perf_counter()
+            ratio = len(zlib.compress(data, level)) / max(len(data), 1)
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            self.speeds[level] = self._average(self.speeds[level], len(data) / 1e6 / elapsed)
+            self.ratios[level] = self._average(self.ratios[level], ratio)
+            measured[level] = ratio
+        if 9 in measured:
+            self._calibrated += 1
+        else:
+            # scale the level 1 ratio by the calibrated gain of level 9
+            measured[9] = measured[1] * self.ratios[9] / max(self.ratios[1], 1e-6)
+        return measured
+
+    def choose(self, ratios=None):
+        """
+        Pick store/fast/strong for data with the given ratios; compression and
+        sending overlap, so each choice costs the slower of the two per MB of input
+        :param ratios: {level: compressed/raw ratio}; default(None): running averages
+        :return: STORE, FAST or STRONG
+        """
+        ratios = ratios if ratios is not None else self.ratios
+        network_mb_per_s = self.network_mbps / 8
+        best, best_cost = STORE, 1.0 / network_mb_per_s
+        for name in (FAST, STRONG):
+            level = self.levels[name]
+            cost = max(ratios[level] / network_mb_per_s, 1.0 / self.speeds[level])
+            if cost < best_cost * 0.95:
+                best, best_cost = name, cost
+        return best
+
+    def classify(self, fpath, size=None):
+        """
+        :param fpath: full path to local file
+        :param size: file size, if already known
+        :return: STORE, FAST or STRONG
+        """
+        if fpath.lower().endswith(self.compressed_extensions):
+            return STORE
+        size = size if size is not None else os.path.getsize(fpath)
+        if size < self.min_sample_file_size:
+            return FAST
+        ratios = self.measure(self._read_sample(fpath, size))
+        if ratios[1] > self.incompressible_ratio:
+            return STORE
+        return self.choose(ratios)
+
+    def classify_folder(self, folder_path, max_samples=16):
+        """
+        One choice for a whole stream, from size-weighted samples of the largest files
+        :return: STORE, FAST or STRONG
+        """
+        files = []
+        for root, dirs, fnames in os.walk(folder_path, followlinks=True):
+            for f in fnames:
+                fpath = os.path.join(root, f)
+                files.append((os.path.getsize(fpath), fpath))
+        files.sort(reverse=True)
+        total = sum(s for s, _ in files[:max_samples])
+        if total == 0:
+            return FAST
+        ratios = {1: 0.0, 9: 0.0}
+        for size, fpath in files[:max_samples]:
+            if fpath.lower().endswith(self.compressed_extensions):
+                sample = {1: 1.0, 9: 1.0}
+            else:
+                sample = self.measure(self._read_sample(fpath, size))
+            for level in ratios:
+                ratios[level] += sample[level] * size / total
+        if ratios[1] > self.incompressible_ratio:
+            return STORE
+        return self.choose(ratios)
+
+    def level(self, choice):
+        return self.levels[choice]
+
+    def remote_level(self):
+        """
+        Level for data compressed on the login node, which cannot be sampled locally
+        """
+        return self.levels[self.choose()]
+
+    def zip_args(self):
+        # zip options for remote_zip: level plus suffixes to store as-is
+        return "-{} -n {}".format(self.remote_level(), ":".join(self.compressed_extensions))
+
+    def update_network_throughput(self, nbytes, seconds):
+        """
+        Feed the throughput of a network-bound transfer back into the estimate
+        """
+        if nbytes < 1024 * 1024 or seconds <= 0:
+            return
+        self.network_mbps = self._average(self.network_mbps, nbytes * 8 / 1e6 / seconds, weight=0.3)
+
+    def report(self, action, raw_bytes, sent_bytes, seconds, level):
+        """
+        Log and keep measured throughput of a compressed transfer
+        :return: report dict
+        """
+        seconds = max(seconds, 1e-6)
+        self.last_report = {"action": action,
+                            "level": level,
+                            "raw_bytes": raw_bytes,
+                            "sent_bytes": sent_bytes,
+                            "ratio": sent_bytes / max(raw_bytes, 1),
+                            "seconds": seconds,
+                            "raw_mb_per_s": raw_bytes / 1e6 / seconds,
+                            "wire_mb_per_s": sent_bytes / 1e6 / seconds}
+        logger.info("{}: {:.1f} MB as {:.1f} MB (level {}) in {:.1f}s, {:.1f} MB/s effective, "
+                    "{:.1f} MB/s on the wire".format(action, raw_bytes / 1e6, sent_bytes / 1e6, level, seconds,
+                                                     self.last_report["raw_mb_per_s"],
+                                                     self.last_report["wire_mb_per_s"]))
+        return self.last_report
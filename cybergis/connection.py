@@ -1,11 +1,94 @@
+import gzip
 import os
+import re
+import select
+import shlex
+import shutil
+import tarfile
+import threading
+import time
+import uuid
 import zipfile
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 
 import paramiko
 
 from .utils import UtilsMixin
 from .base import BaseConnection
+from .transfer import ParallelSFTPTransfer, ResumableTransfer
+from .manifest import DeltaSync, BlobStore, SelectiveDownload
+from .compression import CompressionPolicy
+from .follow import RemoteFileFollower
+from .hostinfo import HostMetadataCache, discover_host_metadata
+from .agent import RemoteAgent
+from .ratelimit import get_rate_limiter, current_rate_limit_user, rate_limited
+from .remotefile import RemoteFile
+from .instrumentation import instrumented, get_instrumentation
+
+
+class _ChannelWriter(object):
+    # minimal file-like wrapper so tarfile can stream into an exec channel's stdin
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, data):
+        self.channel.sendall(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _CountingFile(object):
+    # counts bytes read from / written to a file-like object
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.nbytes += len(data)
+        return data
+
+    def write(self, data):
+        self.nbytes += len(data)
+        return self.fileobj.write(data)
+
+
+class CommandResult(object):
+    """
+    Outcome of one command run by SSHConnection.run_commands
+    exit_code is None if the command did not run (an earlier command failed with stop_on_error)
+    """
+
+    def __init__(self, command, exit_code=None, stdout=None, stderr=None):
+        self.command = command
+        self.exit_code = exit_code
+        self.stdout = stdout if stdout is not None else []
+        self.stderr = stderr if stderr is not None else []
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def output(self, line_delimiter=''):
+        """
+        stdout shaped like the return value of run_command
+        :param line_delimiter: join lines with this; not a str: return a list
+        """
+        if len(self.stdout) == 0:
+            return None
+        if type(line_delimiter) is not str:
+            return self.stdout
+        return line_delimiter.join(self.stdout)
+
+    def __repr__(self):
+        return "CommandResult({!r}, exit_code={})".format(self.command, self.exit_code)
 
 
 class SSHConnection(UtilsMixin, BaseConnection):
@@ -13,16 +96,55 @@ class SSHConnection(UtilsMixin, BaseConnection):
     _client = None
     _sftp = None
     server = None
+    port = 22
     user_name = None
     user_pw = None
     key_path = None
     remote_user_name = None
     remote_user_home = None
+    # home, user, scratch, partitions, module/singularity availability, see hostinfo.discover_host_metadata
+    host_metadata = None
     _logged_in = False
+    # set when the transport of a logged-in connection died; the next remote operation reconnects
+    _disconnected = False
+    # timestamp of the last remote operation, used by the connection pool for idle eviction
+    last_activity = 0
+    # how folders are moved: "zip" (zip --> sftp --> unzip), "stream" (tar over an exec channel),
+    # "parallel" (several SFTP channels, one file per request),
+    # "resumable" (chunked, checkpointed transfers that survive dropped sessions; also valid for single files),
+    # "delta" (upload only: send files changed since the last upload, see manifest.DeltaSync)
+    # or "blob" (upload only: link files from a content-addressed store on remote, see manifest.BlobStore)
+    folder_transfer_mode = "zip"
+    stream_buffer_size = 1024 * 1024
+    # threads writing files extracted from a streaming download; 0: extract inline
+    stream_extract_workers = 0
+    # SFTP channels used by the "parallel" folder transfer mode
+    transfer_workers = 4
+    # channels (exec and SFTP, including the main SFTP session) open at once on the transport;
+    # keep at or below the login node's sshd MaxSessions (OpenSSH default: 10)
+    max_sessions = 10
+    # seconds between SSH keepalive packets, so idle sessions are not dropped by the login node; 0: off
+    keepalive_interval = 30
+    # reconnect attempts made by idempotent operations whose connection died, and the first wait (doubled)
+    max_reconnects = 3
+    reconnect_wait = 5
+    # serve stat/list/hash/manifest/tail/sacct queries from a python agent on the login node (see agent.RemoteAgent)
+    use_agent = False
+    # queue operations through the login node's RateLimiter; default(None): only for login nodes set up
+    # with ratelimit.configure_rate_limit, True: always (default limits), False: never
+    rate_limiting = None
+    _agent = None
+    _agent_failed = False
 
-    def __init__(self, server, user_name=None, user_pw=None, key_path=None, **kargs):
+    def __init__(self, server, user_name=None, user_pw=None, key_path=None,
+                 folder_transfer_mode=None, compression_policy=None, max_sessions=None,
+                 host_metadata_cache=None, port=None, use_agent=None, **kargs):
         super().__init__()
         self.server = server
+        if port is not None:
+            self.port = port
+        if use_agent is not None:
+            self.use_agent = use_agent
         self._client = paramiko.SSHClient()
         self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self.user_name = user_name
@@ -30,11 +152,37 @@ class SSHConnection(UtilsMixin, BaseConnection):
         if (key_path != None):
             self._check_abs_path(key_path, raise_on_false=True)
         self.key_path = key_path
+        if folder_transfer_mode is not None:
+            self.folder_transfer_mode = folder_transfer_mode
+        # decides zip/gzip levels of folder transfers, see compression.CompressionPolicy
+        self.compression_policy = compression_policy if compression_policy is not None else CompressionPolicy()
+        if max_sessions is not None:
+            self.max_sessions = max_sessions
+        # HostMetadataCache letting login skip discovery; False: discover on every login
+        self.host_metadata_cache = host_metadata_cache if host_metadata_cache is not None else HostMetadataCache()
+        # login/logout, channel bookkeeping and the shared SFTP session are guarded
+        # so pollers, uploaders and tailers in several threads can share one transport
+        self._lock = threading.RLock()
+        self._sftp_lock = threading.Lock()
+        self._channels_lock = threading.Lock()
+        # open channel --> the semaphore its slot was taken from
+        self._open_channels = {}
+        # one counter for the connection's lifetime, so threads waiting for a slot survive reconnects;
+        # the main SFTP session always has the remaining slot, so login never waits for one
+        self._session_slots = threading.BoundedSemaphore(max(1, self.max_sessions - 1))
 
     @property
     def logged_in(self):
+        if self._logged_in and not self._transport_active():
+            self.logger.warning("SSH connection to {} as {} was lost".format(self.server, self.remote_user_name))
+            self._logged_in = False
+            self._disconnected = True
         return self._logged_in
 
+    def _transport_active(self):
+        transport = self._client.get_transport()
+        return transport is not None and transport.is_active()
+
     @property
     def client(self):
         return self._client
@@ -43,55 +191,229 @@ class SSHConnection(UtilsMixin, BaseConnection):
     def sftp(self):
         return self._sftp
 
+    def is_alive(self, probe=False):
+        """
+        Check whether the underlying SSH transport is still usable
+        :param probe: also push an SSH_MSG_IGNORE packet through the transport
+        :return: True if logged in and the transport is active
+        """
+        if not self.logged_in:
+            return False
+        if probe:
+            try:
+                self._client.get_transport().send_ignore()
+            except Exception as ex:
+                self.logger.debug("SSH transport to {} failed probe: {}".format(self.server, ex))
+                return False
+        return True
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    @property
+    def in_use(self):
+        """
+        True while an operation has a channel or the main SFTP session open (eg: a long transfer)
+        """
+        agent = self._agent
+        # the agent keeps its channel open between calls
+        idle_channels = {agent.channel} if agent is not None else set()
+        with self._channels_lock:
+            busy = len(set(self._open_channels) - idle_channels) > 0
+        return busy or self._sftp_lock.locked()
+
     def _login_with_password(self, *args, **kwargs):
         self._client.connect(self.server,
+                             port=self.port,
                              username=self.user_name,
                              password=self.user_pw)
 
     def _login_with_key(self, *args, **kwargs):
 
         self._client.connect(self.server,
+                             port=self.port,
                              username=self.user_name,
                              key_filename=self.key_path)
 
+    # admitted before taking _lock: a thread holding a slot may be waiting for _lock to reconnect
+    @rate_limited("command")
     def login(self, *args, **kwargs):
-        if not self.logged_in:
-            if self.key_path is not None:
-                self._login_with_key()
-            elif self.user_pw is None:
-                raise NotImplementedError()
-                # print("input password for {}".format(self.user_name))
-                # self.user_pw = getpass.getpass()
-                # self._login_with_password()
-            elif self.user_pw is not None:
-                self._login_with_password()
-
-            self.remote_user_home = self.remote_home_directory()
-            self.remote_user_name = self.remote_whoami()
-
-            self._sftp = self.client.open_sftp()
-            self._logged_in = True
+        with self._lock:
+            if not self.logged_in:
+                if self._client.get_transport() is not None:
+                    # dead transport and SFTP session of an earlier login
+                    self._close()
+                if self.key_path is not None:
+                    self._login_with_key()
+                elif self.user_pw is None:
+                    raise NotImplementedError()
+                    # print("input password for {}".format(self.user_name))
+                    # self.user_pw = getpass.getpass()
+                    # self._login_with_password()
+                elif self.user_pw is not None:
+                    self._login_with_password()
+                self._disconnected = False
+                if self.keepalive_interval:
+                    self._client.get_transport().set_keepalive(self.keepalive_interval)
+
+                metadata = None
+                if self.host_metadata_cache:
+                    metadata = self.host_metadata_cache.load(self.server, self.user_name)
+                if metadata is None:
+                    metadata = self.refresh_host_metadata()
+                self.host_metadata = metadata
+                self.remote_user_home = metadata["home"]
+                self.remote_user_name = metadata["user"]
+
+                # the main SFTP session takes the slot kept out of _session_slots
+                self._sftp = self.client.open_sftp()
+                self._logged_in = True
+                self.touch()
         self.logger.info("SSH logged into {} as user {}".format(self.server,
                                                                 self.remote_user_name))
 
     def logout(self, *args, **kwargs):
-        self._sftp.close()
+        with self._lock:
+            self._close()
+            self._disconnected = False
+            self.logger.info("SSH logged off {} as user {}".format(self.server,
+                                                                   self.remote_user_name))
+
+    def close_idle(self):
+        """
+        Close the transport of an idle connection (see pool.SSHConnectionPool.evict_idle) while callers still
+        hold it; the next operation logs in again
+        """
+        with self._lock:
+            self._close()
+            self._disconnected = True
+            self.logger.info("SSH closed idle connection to {} as user {}".format(self.server,
+                                                                                   self.remote_user_name))
+
+    def _close(self):
+        if self._agent is not None:
+            try:
+                self._agent.close()
+            except Exception as ex:
+                self.logger.debug("Error closing remote agent on {}: {}".format(self.server, ex))
+            self._agent = None
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception as ex:
+                self.logger.debug("Error closing SFTP session to {}: {}".format(self.server, ex))
+            self._sftp = None
         self._client.close()
-        self.logger.info("SSH logged off {} as user {}".format(self.server,
-                                                               self.remote_user_name))
+        # closing the transport closed every channel: free their slots, close_channel will not find them anymore
+        with self._channels_lock:
+            dead = list(self._open_channels.values())
+            self._open_channels = {}
+        for slots in dead:
+            slots.release()
         self._logged_in = False
 
+    def rate_limit(self, kind="command"):
+        """
+        Context manager running a block as one operation admitted by the login node's RateLimiter
+        :param kind: "submit", "command", "transfer" or "poll"
+        """
+        if self.rate_limiting is False:
+            return super().rate_limit(kind)
+        limiter = get_rate_limiter(self.server, create=self.rate_limiting is True)
+        if limiter is None:
+            return super().rate_limit(kind)
+        return limiter.slot(kind, user=current_rate_limit_user() or self.user_name)
+
+    def get_agent(self):
+        """
+        Remote agent of this session, started on first use; it holds one of the max_sessions channels
+        :return: RemoteAgent, None if use_agent is off or the login node has no usable python
+        """
+        if not self.use_agent or self._agent_failed:
+            return None
+        with self._lock:
+            if self._agent is None or not self._agent.alive:
+                agent = RemoteAgent(self)
+                try:
+                    agent.start()
+                except Exception as ex:
+                    self.logger.warning("Remote agent unavailable on {}, using shell commands: {}".format(
+                        self.server, ex))
+                    self._agent_failed = True
+                    return None
+                self._agent = agent
+            return self._agent
+
+    def refresh_host_metadata(self):
+        """
+        Discover home, user, scratch folders, partitions and module/singularity availability
+        on the login node, and update the host metadata cache
+        :return: metadata dict
+        """
+        metadata = discover_host_metadata(self)
+        if self.host_metadata_cache:
+            self.host_metadata_cache.save(self.server, self.user_name, metadata)
+        self.host_metadata = metadata
+        return metadata
+
+    @rate_limited("command")
+    @instrumented("reconnect")
+    def reconnect(self):
+        """
+        Replace a dead transport with a new login and SFTP session; no-op if the connection still works
+        Channels and SFTP files opened on the old transport are gone and must be reopened by their users.
+        """
+        with self._lock:
+            if self.is_alive(probe=True):
+                return
+            self.logger.warning("Reconnecting to {} as {}".format(self.server, self.user_name))
+            self._close()
+            self.login()
+
+    def _ensure_transport(self):
+        # nothing was sent yet, so reconnecting a dropped (or idle-closed) connection here is safe for any operation
+        if self._disconnected or (self._logged_in and not self.logged_in):
+            self.reconnect()
+
+    def call_idempotent(self, func, *args, **kwargs):
+        """
+        Call func, reconnecting and calling it again if it failed because the connection died
+        Only for operations that are safe to repeat (status queries, reads, whole-file transfers).
+        Each retry counts in the retries of the instrumented operation running it, and each
+        reconnect is recorded as a "reconnect" operation.
+        """
+        wait = self.reconnect_wait
+        for attempt in range(self.max_reconnects + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as ex:
+                if attempt == self.max_reconnects or self.is_alive(probe=True):
+                    # out of attempts, or the connection is fine and the error is genuine
+                    raise
+                self.logger.warning("Connection to {} lost ({}); reconnecting in {}s".format(self.server, ex, wait))
+                get_instrumentation().add_retry()
+                time.sleep(wait)
+                wait *= 2
+                try:
+                    self.reconnect()
+                except Exception as rex:
+                    self.logger.warning("Reconnecting to {} failed: {}".format(self.server, rex))
+
+    @rate_limited("transfer")
+    @instrumented("upload")
     def upload(self, local_fpath, remote_fpath,
-               remote_is_folder=False, unzip=False, *args, **kwargs):
+               remote_is_folder=False, unzip=False, mode=None, blob_store_path=None, *args, **kwargs):
         """
         Upload a file or a folder to remote
         local file --> remote file
         local file --> remote folder
-        local folder --> remote_fpath/folder (zip and unzip)
+        local folder --> remote_fpath/folder (zip and unzip, or tar stream)
         :param local_fpath: full path to local file or folder
         :param remote_fpath: full path to remote file or folder
         :param remote_is_folder: whether remote_is_folder is a folder path
         :param unzip: whether to unzip on remote
+        :param mode: folder transfer mode; default(None): use self.folder_transfer_mode
+        :param blob_store_path: remote blob store folder used by mode "blob"
         :param args:
         :param kwargs:
         :return:
@@ -107,22 +429,59 @@ class SSHConnection(UtilsMixin, BaseConnection):
             cleanup = True
             if not remote_is_folder:
                 raise Exception("if remote must be a folder when local is folder")
-            zip_fpath = self.zip_local_folder(local_fpath)
+            mode = mode if mode is not None else self.folder_transfer_mode
+            if mode == "resumable":
+                return ResumableTransfer(self).upload_folder(local_fpath, remote_fpath)
+            if mode == "stream":
+                return self._upload_folder_stream(local_fpath, remote_fpath)
+            if mode == "parallel":
+                return ParallelSFTPTransfer(self, self.transfer_workers).upload_folder(local_fpath, remote_fpath)
+            if mode == "delta":
+                return DeltaSync(self).upload_folder(local_fpath, remote_fpath)
+            if mode == "blob":
+                if blob_store_path is None:
+                    raise Exception("blob_store_path is required by the blob transfer mode")
+                return BlobStore(self, blob_store_path).upload_folder(local_fpath, remote_fpath)
+            zip_fpath = self.zip_local_folder(local_fpath, compression_policy=self.compression_policy)
             local_fpath = zip_fpath
             unzip = True
         local_fname = os.path.basename(local_fpath)
         if remote_is_folder:
             remote_fpath = os.path.join(remote_fpath, local_fname)
+        if mode == "resumable":
+            return ResumableTransfer(self).upload_file(local_fpath, remote_fpath)
         self._sftp_push(local_fpath, remote_fpath)
         if unzip and remote_fpath.lower().endswith(".zip"):
-            self.remote_unzip(remote_fpath, os.path.dirname(remote_fpath))
-            self.remote_rm(remote_fpath)
+            self.logger.debug("remote unzipping and removing {}".format(remote_fpath))
+            # unzip and rm in one round trip, recorded like a remote_unzip call;
+            # the zip is removed even if unzip fails, the exit code is still unzip's
+            with get_instrumentation().measure("remote_unzip", self.server, target=remote_fpath):
+                result = self.run_commands(["{}; rc=$?; rm -rf {}; exit $rc".format(
+                    self._unzip_command(remote_fpath, os.path.dirname(remote_fpath)), remote_fpath)])[0]
+            if not result.ok:
+                self.logger.debug("remote unzip {} got error ({}) {}".format(remote_fpath, result.exit_code,
+                                                                             ';'.join(result.stderr)))
         if cleanup:
             os.remove(local_fpath)
             self.logger.debug("Removing {}".format(local_fpath))
 
+    @rate_limited("transfer")
+    @instrumented("download")
     def download(self, remote_fpath, local_fpath,
-                 remote_is_folder=False, unzip=False, *args, **kwargs):
+                 remote_is_folder=False, unzip=False, mode=None, extract_workers=None, *args, **kwargs):
+        """
+        Download a file or a folder from remote
+        remote file --> local file
+        remote file --> local folder
+        remote folder --> local_fpath/folder (zip and unzip, or tar stream)
+        :param remote_fpath: full path to remote file or folder
+        :param local_fpath: full path to local file or folder
+        :param remote_is_folder: whether remote_fpath is a folder
+        :param unzip: whether to unzip downloaded zip file
+        :param mode: folder transfer mode; default(None): use self.folder_transfer_mode
+        :param extract_workers: threads writing streamed files; default(None): self.stream_extract_workers
+        :return:
+        """
         remote_fpath = remote_fpath.strip()
         local_fpath = local_fpath.strip()
         self.logger.info("Downloading {} to {}".format(remote_fpath, local_fpath))
@@ -133,6 +492,15 @@ class SSHConnection(UtilsMixin, BaseConnection):
         if remote_is_folder:
             if not os.path.isdir(local_fpath):
                 raise Exception("local must be folder when remote is folder")
+            mode = mode if mode is not None else self.folder_transfer_mode
+            if mode == "resumable":
+                return ResumableTransfer(self).download_folder(remote_fpath, local_fpath)
+            if mode == "stream":
+                if extract_workers is None:
+                    extract_workers = self.stream_extract_workers
+                return self._download_folder_stream(remote_fpath, local_fpath, extract_workers)
+            if mode == "parallel":
+                return ParallelSFTPTransfer(self, self.transfer_workers).download_folder(remote_fpath, local_fpath)
             unzip = True
             cleanup = True
             remote_folder_name = os.path.basename(remote_fpath)
@@ -145,6 +513,8 @@ class SSHConnection(UtilsMixin, BaseConnection):
         remote_fname = os.path.basename(remote_fpath)
         if os.path.isdir(local_fpath):
             local_fpath = os.path.join(local_fpath, remote_fname)
+        if mode == "resumable":
+            return ResumableTransfer(self).download_file(remote_fpath, local_fpath)
         self._sftp_get(remote_fpath, local_fpath)
         if cleanup:
             self.run_command("rm -f {}".format(remote_fpath))
@@ -155,37 +525,241 @@ class SSHConnection(UtilsMixin, BaseConnection):
             if cleanup:
                 os.remove(local_fpath)
 
-    def run_command(self, command, line_delimiter='', raise_on_error=False, *args, **kwargs):
+    @rate_limited("transfer")
+    @instrumented("download_selected")
+    def download_selected(self, remote_folder_path, local_folder_path, include=None, exclude=None,
+                          max_file_size=None, max_total_size=None, newest_first=False, limit=None,
+                          dry_run=False, workers=None):
+        """
+        Download the files of a remote folder that match the filters
+        remote /A/B/C --> local_folder_path/C/<selected files>
+        :param include: glob or list of globs relative to the remote folder (eg: "*.nc"); default(None): all files
+        :param exclude: glob or list of globs to leave out
+        :param max_file_size: skip files larger than this many bytes
+        :param max_total_size: download at most this many bytes in total, stopping at the first file that does not fit
+        :param newest_first: prefer the most recently modified files under max_total_size/limit
+        :param limit: download at most this many files, counted after the size filters
+        :param dry_run: report what would be downloaded without downloading
+        :param workers: SFTP channels; default(None): self.transfer_workers
+        :return: dict with selected "files", "selected_bytes", "total_bytes", "downloaded_bytes", ...
+        """
+        remote_folder_path = self._check_abs_path(remote_folder_path.strip())
+        local_folder_path = self._check_abs_path(local_folder_path.strip())
+        if not os.path.isdir(local_folder_path):
+            raise Exception("local must be folder when remote is folder")
+        self.logger.info("Downloading selected files of {} to {}".format(remote_folder_path, local_folder_path))
+        return SelectiveDownload(self, workers).download_folder(remote_folder_path, local_folder_path,
+                                                                dry_run=dry_run,
+                                                                include=include,
+                                                                exclude=exclude,
+                                                                max_file_size=max_file_size,
+                                                                max_total_size=max_total_size,
+                                                                newest_first=newest_first,
+                                                                limit=limit)
+
+    @rate_limited("command")
+    @instrumented("run_command")
+    def run_command(self, command, line_delimiter='', raise_on_error=False, idempotent=False, *args, **kwargs):
+        """
+        :param idempotent: the command is safe to run twice (eg: status queries); reconnect and rerun it
+                           if the connection dies while it runs
+        :param priority: admission priority on a busy login node: "submit", "command" (default), "transfer" or "poll"
+        """
+        if idempotent:
+            return self.call_idempotent(self._run_command, command, line_delimiter, raise_on_error)
+        return self._run_command(command, line_delimiter, raise_on_error)
+
+    def _run_command(self, command, line_delimiter='', raise_on_error=False):
         self.logger.debug("run_commnad on remote: " + command)
+        self.touch()
         try:
-            stdin, stdout, stderr = self._client.exec_command(command)
+            channel = self.open_channel(command)
         except Exception as e:
             self.logger.warning("Got error running command " + command + " : " + str(e))
             raise e
-        out = list(map(self.remove_newlines, stdout.readlines()))
-        err = list(map(self.remove_newlines, stderr.readlines()))
+        try:
+            out, err, _ = self.drain_channel(channel)
+        finally:
+            self.close_channel(channel)
+        get_instrumentation().add_bytes(len(out) + len(err))
+        out = list(map(self.remove_newlines, out.splitlines()))
+        err = list(map(self.remove_newlines, err.splitlines()))
         self.logger.debug("out: " + str(out))
         self.logger.debug("err: " + str(err))
         if len(err) > 0:
             self.logger.debug("run_command {} got error {}".format(command, ';'.join(err)))
             if raise_on_error:
-                raise Exception(message=';'.join(err))
+                raise Exception(';'.join(err))
         if len(out) == 0:
             return None
         if type(line_delimiter) is not str:
             return out
         return line_delimiter.join(out)
 
+    @rate_limited("command")
+    @instrumented("run_commands")
+    def run_commands(self, commands, raise_on_error=False, stop_on_error=False):
+        """
+        Run several commands over a single exec channel (one round trip)
+        Each command runs in its own subshell with stdin from /dev/null, so 'cd' or
+        'export' do not leak into the next one; the remote login shell must be POSIX compatible.
+        :param commands: list of command strings
+        :param raise_on_error: raise if any command exits non-zero
+        :param stop_on_error: skip the remaining commands after the first non-zero exit
+        :return: list of CommandResult, in the order of commands
+        """
+        commands = list(commands)
+        results = [CommandResult(c) for c in commands]
+        if len(commands) == 0:
+            return results
+        marker = "__cybergis_{}".format(uuid.uuid4().hex)
+        lines = []
+        for i, command in enumerate(commands):
+            lines.append("printf '%s\\n' {m}:begin:{i}; printf '%s\\n' {m}:begin:{i} >&2".format(m=marker, i=i))
+            lines.append("( {}\n) < /dev/null".format(command))
+            lines.append("rc=$?; printf '\\n%s:%d\\n' {m}:end:{i} $rc; printf '\\n%s\\n' {m}:end:{i} >&2".format(
+                m=marker, i=i))
+            if stop_on_error:
+                lines.append("[ $rc -eq 0 ] || exit $rc")
+        script = "\n".join(lines) + "\n"
+        self.logger.debug("run_commands on remote: " + "; ".join(commands))
+        self.touch()
+        channel = self.open_channel(script)
+        try:
+            out, err, exit_status = self.drain_channel(channel)
+        finally:
+            self.close_channel(channel)
+        get_instrumentation().add_bytes(len(out) + len(err))
+
+        out_pattern = re.compile(r"{m}:begin:(\d+)\n(.*?)\n{m}:end:\1:(\d+)\n".format(m=marker), re.S)
+        for match in out_pattern.finditer(out):
+            result = results[int(match.group(1))]
+            result.stdout = list(map(self.remove_newlines, match.group(2).splitlines()))
+            result.exit_code = int(match.group(3))
+        err_pattern = re.compile(r"{m}:begin:(\d+)\n(.*?)\n{m}:end:\1\n".format(m=marker), re.S)
+        for match in err_pattern.finditer(err):
+            results[int(match.group(1))].stderr = list(map(self.remove_newlines, match.group(2).splitlines()))
+
+        for result in results:
+            self.logger.debug("{!r} out: {} err: {}".format(result, result.stdout, result.stderr))
+        failed = [r for r in results if r.exit_code is not None and not r.ok]
+        if exit_status != 0 and len(failed) == 0:
+            # the wrapper itself failed, eg: a syntax error in one of the commands
+            raise Exception("run_commands failed ({}): {}".format(exit_status, err.strip()))
+        if raise_on_error and len(failed) > 0:
+            raise Exception(";".join("{} ({}): {}".format(r.command, r.exit_code, ";".join(r.stderr))
+                                     for r in failed))
+        return results
+
+    def follow(self, remote_fpath, offset=0, max_read_size=None):
+        """
+        Follow a growing remote file (eg: a job's slurm-XXXXXX.out) by offset
+        follower.read_new() / read_new_lines() return only what was written since the previous call;
+        follower.follow() yields lines as they come
+        :param remote_fpath: full path to remote file
+        :param offset: byte offset to start from; 0: whole file, None: only bytes written from now on
+        :param max_read_size: max bytes fetched per call
+        :return: follow.RemoteFileFollower
+        """
+        return RemoteFileFollower(self, remote_fpath, offset=offset, max_read_size=max_read_size)
+
+    def open_remote(self, remote_fpath, block_size=None, cache_blocks=None):
+        """
+        Open a remote file for lazy random-access reads; only the byte ranges touched are transferred
+        :param remote_fpath: full path to remote file
+        :param block_size: bytes per cached block
+        :param cache_blocks: blocks kept in memory (LRU)
+        :return: remotefile.RemoteFile, a read-only binary file object; close it to free its SFTP channel
+        """
+        return RemoteFile(self, remote_fpath, block_size=block_size, cache_blocks=cache_blocks)
+
+    def iter_command(self, command, lines=True, raise_on_error=False, buffer_size=256 * 1024,
+                     chunk_size=32768, poll_seconds=1.0, priority=None):
+        """
+        Run a command and yield its stdout as it arrives instead of collecting it all
+        At most about buffer_size bytes are held unread: the SSH window stops the
+        remote command until the caller takes more. Closing the generator early (or
+        breaking out of a for loop over it) closes the channel, which stops the command.
+        :param command: command to run
+        :param lines: yield str lines without newlines; False: yield bytes chunks as received
+        :param raise_on_error: raise after the output if the command exits non-zero
+        :param buffer_size: SSH window size of the channel
+        :param chunk_size: max bytes read from the channel at once
+        :param poll_seconds: seconds between checks for the exit status while no output arrives
+        :param priority: admission priority on a busy login node, see run_command
+        """
+        self.logger.debug("iter_command on remote: " + command)
+        self.touch()
+        # admitted for starting the command only: the caller may take its time consuming the output
+        with self.rate_limit(priority or "command"):
+            channel = self.open_channel(command, window_size=buffer_size)
+        # only the tail of stderr is kept for error messages
+        err = b""
+        partial = b""
+        try:
+            while True:
+                if channel.recv_ready():
+                    data = channel.recv(chunk_size)
+                    if not lines:
+                        yield data
+                        continue
+                    partial += data
+                    *complete, partial = partial.split(b"\n")
+                    for line in complete:
+                        yield self.remove_newlines(line.decode("utf-8", errors="replace"))
+                elif channel.recv_stderr_ready():
+                    err = (err + channel.recv_stderr(chunk_size))[-8192:]
+                elif (channel.exit_status_ready() or channel.closed) and not channel.recv_ready():
+                    break
+                else:
+                    select.select([channel], [], [], poll_seconds)
+            if lines and len(partial) > 0:
+                yield self.remove_newlines(partial.decode("utf-8", errors="replace"))
+            exit_status = channel.recv_exit_status()
+        finally:
+            self.close_channel(channel)
+            self.touch()
+        if exit_status != 0:
+            err = ";".join(err.decode("utf-8", errors="replace").splitlines())
+            self.logger.debug("iter_command {} exited with {}: {}".format(command, exit_status, err))
+            if raise_on_error:
+                raise Exception(err or "{} exited with {}".format(command, exit_status))
+
+    @staticmethod
+    def drain_channel(channel, poll_seconds=1.0):
+        """
+        Read stdout and stderr of an exec channel together, so neither can stall the other
+        :return: (stdout text, stderr text, exit status)
+        """
+        out, err = [], []
+        while True:
+            if channel.recv_ready():
+                out.append(channel.recv(32768))
+            elif channel.recv_stderr_ready():
+                err.append(channel.recv_stderr(32768))
+            elif channel.exit_status_ready() or channel.closed:
+                # exit-status is sent after all data; pick up anything that raced in
+                while channel.recv_ready():
+                    out.append(channel.recv(32768))
+                while channel.recv_stderr_ready():
+                    err.append(channel.recv_stderr(32768))
+                break
+            else:
+                select.select([channel], [], [], poll_seconds)
+        return (b"".join(out).decode("utf-8", errors="replace"),
+                b"".join(err).decode("utf-8", errors="replace"),
+                channel.recv_exit_status())
+
     def remote_home_directory(self):
-        out = self.run_command("echo ~")
+        out = self.run_command("echo ~", idempotent=True)
         return out
 
     def remote_whoami(self, *args, **kwargs):
-        out = self.run_command("whoami")
+        out = self.run_command("whoami", idempotent=True)
         return out
 
     def remote_pwd(self, *args, **kwargs):
-        out = self.run_command("pwd")
+        out = self.run_command("pwd", idempotent=True)
         return out
 
     def remote_ls(self, remote_path="./", line_delimiter=None, **kwargs):
@@ -196,30 +770,280 @@ class SSHConnection(UtilsMixin, BaseConnection):
         :param kwargs:
         :return:
         """
-        out = self.run_command("ls {}".format(remote_path if remote_path is not None else "./"),
-                               line_delimiter=line_delimiter)
+        remote_path = remote_path if remote_path is not None else "./"
+        agent = self.get_agent()
+        if agent is not None and not remote_path.startswith("-") \
+                and not re.search(r"[\s*?\[\]{}$`'\"\\;|&<>]", remote_path):
+            # plain folder paths only; globs and ls options go to the shell
+            entry = agent.stat(remote_path)
+            if entry is not None and entry["is_dir"]:
+                out = sorted(name for name in agent.list(remote_path) if not name.startswith("."))
+                if len(out) == 0:
+                    return None
+                return out if type(line_delimiter) is not str else line_delimiter.join(out)
+        out = self.run_command("ls {}".format(remote_path),
+                               line_delimiter=line_delimiter,
+                               idempotent=True)
         return out
 
+    @instrumented("remote_unzip")
     def remote_unzip(self, zip_fpath, output_folder=None):
         if output_folder is None:
             output_folder = self.remote_pwd()
         self.logger.debug("remote unzipping {} to {}".format(zip_fpath, output_folder))
-        self.run_command("unzip -o {} -d {}".format(zip_fpath, output_folder))
+        self.run_command(self._unzip_command(zip_fpath, output_folder))
+
+    @staticmethod
+    def _unzip_command(zip_fpath, output_folder):
+        return "unzip -o {} -d {}".format(zip_fpath, output_folder)
 
     def remote_rm(self, target_path):
         self.logger.debug("remote rm: {}".format(target_path))
         self.run_command("rm -rf {}".format(target_path))
 
+    @instrumented("remote_zip")
     def remote_zip(self, target_path, output_fpath):
         self.logger.debug("remote zip: {} to {}".format(target_path, output_fpath))
-        self.run_command("cd {} && zip -r {} {}".format(os.path.dirname(target_path),
-                                                        output_fpath,
-                                                        os.path.basename(target_path)))
+        self.run_command("cd {} && zip -r {} {} {}".format(os.path.dirname(target_path),
+                                                           self.compression_policy.zip_args(),
+                                                           output_fpath,
+                                                           os.path.basename(target_path)))
+
+    def _acquire_session_slot(self, timeout=None):
+        with self._channels_lock:
+            slots = self._session_slots
+        if timeout is None:
+            slots.acquire()
+        elif not slots.acquire(timeout=timeout):
+            raise Exception("All {} sessions to {} are in use".format(self.max_sessions, self.server))
+        return slots
+
+    def open_channel(self, command=None, timeout=None, window_size=None):
+        """
+        Open a session channel on the shared transport, waiting while max_sessions channels are open
+        Safe to call from several threads; release it with close_channel
+        :param command: command to exec on the channel; default(None): leave the session unstarted
+        :param timeout: seconds to wait for a free session slot; default(None): wait forever
+        :param window_size: bytes the remote may send before we read them; default(None): paramiko default
+        :return: paramiko.Channel
+        """
+        while True:
+            self._ensure_transport()
+            slots = self._acquire_session_slot(timeout)
+            if self._transport_active():
+                break
+            # freed by a reconnect still logging in, which needs slots itself: wait for it without this one
+            slots.release()
+            with self._lock:
+                if not self._transport_active() and not self._disconnected:
+                    raise Exception("Not logged in to {}".format(self.server))
+        try:
+            channel = self._client.get_transport().open_session(window_size=window_size)
+            if command is not None:
+                channel.exec_command(command)
+        except Exception:
+            slots.release()
+            raise
+        with self._channels_lock:
+            # released by close_channel, to the semaphore it was taken from
+            self._open_channels[channel] = slots
+        return channel
+
+    def close_channel(self, channel):
+        """
+        Close a channel from open_channel or open_sftp_channel and free its slot
+        """
+        try:
+            channel.close()
+        finally:
+            with self._channels_lock:
+                slots = self._open_channels.pop(channel, None)
+            if slots is not None:
+                slots.release()
+
+    def open_sftp_channel(self, timeout=None):
+        """
+        Open an extra SFTP session counted against max_sessions; release it with close_channel
+        :param timeout: seconds to wait for a free session slot; default(None): wait forever
+        :return: paramiko.SFTPClient
+        """
+        channel = self.open_channel(timeout=timeout)
+        try:
+            channel.invoke_subsystem("sftp")
+            return paramiko.SFTPClient(channel)
+        except Exception:
+            self.close_channel(channel)
+            raise
+
+    @contextmanager
+    def sftp_session(self):
+        """
+        Use the main SFTP session if no other thread is using it, else a temporary one
+        (paramiko.SFTPClient cannot serve requests from several threads at once)
+        """
+        self._ensure_transport()
+        if self._sftp_lock.acquire(blocking=False):
+            try:
+                yield self.sftp
+            finally:
+                self._sftp_lock.release()
+            return
+        sftp = self.open_sftp_channel()
+        try:
+            yield sftp
+        finally:
+            self.close_channel(sftp.get_channel())
+
+    def _upload_folder_stream(self, local_folder_path, remote_folder_path):
+        """
+        Pipe a tar stream of a local folder straight into 'tar -x' on remote;
+        no archive is written on either side
+        local /A/B/C --> remote_folder_path/C
+        :param local_folder_path: full path to local folder
+        :param remote_folder_path: full path to remote parent folder
+        :return:
+        """
+        folder_name = os.path.basename(local_folder_path)
+        level = self.compression_policy.level(self.compression_policy.classify_folder(local_folder_path))
+        self.logger.debug("tar streaming {} to remote @ {} (gzip level {})".format(local_folder_path,
+                                                                                 remote_folder_path, level))
+        self.touch()
+        start = time.time()
+        cmd = "mkdir -p {dst} && tar -x {z} -C {dst} -f -".format(dst=shlex.quote(remote_folder_path),
+                                                                 z="-z" if level > 0 else "")
+        channel = self.open_channel(cmd)
+        wire = _CountingFile(_ChannelWriter(channel))
+        write_error = None
+        try:
+            try:
+                compressor = gzip.GzipFile(fileobj=wire, mode="wb", compresslevel=level) if level > 0 else None
+                raw = _CountingFile(compressor if compressor is not None else wire)
+                with tarfile.open(fileobj=raw, mode="w|",
+                                  bufsize=self.stream_buffer_size, dereference=True) as tar:
+                    tar.add(local_folder_path, arcname=folder_name)
+                if compressor is not None:
+                    compressor.close()
+                channel.shutdown_write()
+            except (OSError, EOFError) as ex:
+                # remote tar went away; its exit status and stderr tell why
+                write_error = ex
+            exit_status = channel.recv_exit_status()
+            err = ";".join(channel.makefile_stderr("rb").read().decode(errors="replace").splitlines())
+        finally:
+            self.close_channel(channel)
+        if exit_status != 0 or write_error is not None:
+            raise Exception("Streaming upload of {} to {} failed ({}): {}".format(local_folder_path,
+                                                                                  remote_folder_path,
+                                                                                  exit_status,
+                                                                                  err or write_error))
+        get_instrumentation().add_bytes(wire.nbytes)
+        return self.compression_policy.report("Stream upload of {}".format(local_folder_path),
+                                              raw.nbytes, wire.nbytes, time.time() - start, level)
+
+    def _download_folder_stream(self, remote_folder_path, local_folder_path, extract_workers=0):
+        """
+        Read a 'tar -c' stream of a remote folder from an exec channel and extract
+        entries as they arrive; nothing is archived on remote
+        remote /A/B/C --> local_folder_path/C
+        :param remote_folder_path: full path to remote folder
+        :param local_folder_path: full path to local parent folder
+        :param extract_workers: threads writing extracted files; 0: write inline
+        :return:
+        """
+        level = self.compression_policy.remote_level()
+        self.logger.debug("tar streaming remote {} to {} (gzip level {})".format(remote_folder_path,
+                                                                               local_folder_path, level))
+        self.touch()
+        start = time.time()
+        raw_bytes = 0
+        # -h: store symlink targets like 'zip -r' does
+        cmd = "tar -c -h {} -C {} -f - {}".format("-I 'gzip -{}'".format(level) if level > 0 else "",
+                                                  shlex.quote(os.path.dirname(remote_folder_path)),
+                                                  shlex.quote(os.path.basename(remote_folder_path)))
+        channel = self.open_channel(cmd)
+        executor = None
+        futures = []
+        if extract_workers > 0:
+            executor = ThreadPoolExecutor(max_workers=extract_workers)
+            # bound the number of extracted files held in memory
+            in_flight = threading.BoundedSemaphore(extract_workers * 4)
+        local_root = os.path.realpath(local_folder_path)
+        stream_error = None
+        try:
+            wire = _CountingFile(channel.makefile("rb", self.stream_buffer_size))
+            try:
+                with tarfile.open(fileobj=wire, mode="r|gz" if level > 0 else "r|",
+                                  bufsize=self.stream_buffer_size) as tar:
+                    for member in tar:
+                        target = os.path.realpath(os.path.join(local_root, member.name))
+                        if os.path.commonpath([local_root, target]) != local_root:
+                            raise Exception("Refusing to extract {} outside of {}".format(member.name,
+                                                                                          local_folder_path))
+                        if member.isdir():
+                            os.makedirs(target, exist_ok=True)
+                            continue
+                        if not member.isfile():
+                            self.logger.debug("Skipping non-regular tar member {}".format(member.name))
+                            continue
+                        raw_bytes += member.size
+                        source = tar.extractfile(member)
+                        if executor is not None and member.size <= self.stream_buffer_size * 16:
+                            data = source.read()
+                            in_flight.acquire()
+                            future = executor.submit(self._write_extracted, target, data, member)
+                            future.add_done_callback(lambda f: in_flight.release())
+                            futures.append(future)
+                        else:
+                            self._write_extracted(target, source, member)
+            except (tarfile.ReadError, EOFError, zlib.error) as ex:
+                # remote tar failed before sending a valid archive
+                stream_error = ex
+            exit_status = channel.recv_exit_status()
+            err = ";".join(channel.makefile_stderr("rb").read().decode(errors="replace").splitlines())
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self.close_channel(channel)
+        for future in futures:
+            # re-raise errors from extraction threads
+            future.result()
+        if exit_status != 0 or stream_error is not None:
+            raise Exception("Streaming download of {} failed ({}): {}".format(remote_folder_path,
+                                                                              exit_status,
+                                                                              err or stream_error))
+        get_instrumentation().add_bytes(wire.nbytes)
+        return self.compression_policy.report("Stream download of {}".format(remote_folder_path),
+                                              raw_bytes, wire.nbytes, time.time() - start, level)
+
+    @staticmethod
+    def _write_extracted(target, source, member):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            if isinstance(source, bytes):
+                f.write(source)
+            else:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+        os.chmod(target, member.mode & 0o777)
+        os.utime(target, (member.mtime, member.mtime))
+
+    def _sftp_call(self, method, *args):
+        with self.sftp_session() as sftp:
+            return getattr(sftp, method)(*args)
 
     def _sftp_get(self, remote_fpath, local_fpath):
         self.logger.debug("sftp getting {} to {}".format(remote_fpath, local_fpath))
-        self.sftp.get(remote_fpath, local_fpath)
+        self.touch()
+        start = time.time()
+        self.call_idempotent(self._sftp_call, "get", remote_fpath, local_fpath)
+        nbytes = os.path.getsize(local_fpath)
+        get_instrumentation().add_bytes(nbytes)
+        self.compression_policy.update_network_throughput(nbytes, time.time() - start)
 
     def _sftp_push(self, local_fpath, remote_fpath):
         self.logger.debug("sftp pushing {} to remote @ {}".format(local_fpath, remote_fpath))
-        self.sftp.put(local_fpath, remote_fpath)
+        self.touch()
+        start = time.time()
+        self.call_idempotent(self._sftp_call, "put", local_fpath, remote_fpath)
+        nbytes = os.path.getsize(local_fpath)
+        get_instrumentation().add_bytes(nbytes)
+        self.compression_policy.update_network_throughput(nbytes, time.time() - start)
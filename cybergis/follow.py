@@ -0,0 +1,112 @@
+import errno
+import time
+
+from .utils import get_logger
+
+logger = get_logger()
+
+
+class RemoteFileFollower(object):
+    """
+    'tail -f' for a remote file (eg: slurm-XXXXXX.out of a running job)
+    Each read stats the file over SFTP and fetches only the bytes past the
+    last offset, so following a log costs one small round trip per poll. A file
+    that does not exist yet (job still pending) reads as empty; a file that
+    shrank (truncated or rewritten) is read again from the start. With the
+    connection's remote agent running, each read is one agent request instead.
+    """
+    # max bytes fetched per read_new call
+    max_read_size = 1024 * 1024
+
+    def __init__(self, connection, remote_fpath, offset=0, max_read_size=None):
+        """
+        :param connection: logged-in SSHConnection
+        :param remote_fpath: full path to remote file
+        :param offset: byte offset to start from; 0: whole file, None: only bytes written from now on
+        :param max_read_size: max bytes fetched per call; default(None): self.max_read_size
+        """
+        self.connection = connection
+        self.remote_fpath = remote_fpath
+        if max_read_size is not None:
+            self.max_read_size = max_read_size
+        self.offset = offset if offset is not None else self._size() or 0
+        self._partial = b""
+
+    def _size(self):
+        try:
+            with self.connection.sftp_session() as sftp:
+                return sftp.stat(self.remote_fpath).st_size
+        except IOError as ex:
+            if getattr(ex, "errno", None) == errno.ENOENT:
+                return None
+            raise
+
+    def read_new(self):
+        """
+        :return: bytes appended since the last call (at most max_read_size), b"" if none
+        """
+        # survives the connection dropping between polls
+        with self.connection.rate_limit("poll"):
+            return self.connection.call_idempotent(self._read_new)
+
+    def _read_new(self):
+        agent = self.connection.get_agent()
+        if agent is not None:
+            return self._read_new_agent(agent)
+        size = self._size()
+        if size is None:
+            return b""
+        if size < self.offset:
+            logger.info("{} shrank from {} to {} bytes, reading from start".format(self.remote_fpath,
+                                                                                 self.offset, size))
+            self.offset = 0
+            self._partial = b""
+        if size == self.offset:
+            return b""
+        self.connection.touch()
+        with self.connection.sftp_session() as sftp:
+            with sftp.open(self.remote_fpath, "rb") as f:
+                f.seek(self.offset)
+                data = f.read(min(size - self.offset, self.max_read_size))
+        self.offset += len(data)
+        return data
+
+    def _read_new_agent(self, agent):
+        self.connection.touch()
+        data, offset = agent.tail(self.remote_fpath, offset=self.offset, max_bytes=self.max_read_size)
+        if offset - len(data) != self.offset:
+            # the agent read from the start
+            logger.info("{} shrank below {} bytes, reading from start".format(self.remote_fpath, self.offset))
+            self._partial = b""
+        self.offset = offset
+        return data
+
+    def read_new_lines(self):
+        """
+        :return: complete lines appended since the last call; a trailing partial line waits for the next call
+        """
+        # read first: a truncated file resets the partial line
+        data = self.read_new()
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        return [line.decode("utf-8", errors="replace").rstrip("\r") for line in lines]
+
+    def follow(self, poll_seconds=5, stop=None):
+        """
+        Yield new lines as they are written
+        :param poll_seconds: seconds between polls while nothing new was written
+        :param stop: callable returning True to stop following; default(None): follow until the generator is closed
+        """
+        while True:
+            lines = self.read_new_lines()
+            for line in lines:
+                yield line
+            if stop is not None and stop():
+                # the file may have grown between the last read and stop() turning True
+                for line in self.read_new_lines():
+                    yield line
+                if len(self._partial) > 0:
+                    yield self._partial.decode("utf-8", errors="replace").rstrip("\r")
+                    self._partial = b""
+                return
+            if len(lines) == 0:
+                time.sleep(poll_seconds)
@@ -99,8 +99,8 @@ class HelloWorldCometJob(HelloWorldKeelingJob):
     sbatch_script_class = HelloWorldCometSBatchScript
 
 
-from .connection import SSHConnection
-import time
+from .pool import get_connection_pool
+from .polling import wait_for_job
 
 
 # test 2-layer job submission
@@ -120,10 +120,10 @@ def submit(workspace, mode_source_folder_path, nodes, wtime,
     if user is not None:
         user_name = user
 
-    con = SSHConnection(server_url,
-                        user_name=user_name,
-                        key_path=key,
-                        user_pw=passwd)
+    con = get_connection_pool().get_connection(server_url,
+                                               user_name=user_name,
+                                               key_path=key,
+                                               user_pw=passwd)
 
     sbatch = SBatchScriptClass(wtime, nodes)
 
@@ -133,17 +133,6 @@ def submit(workspace, mode_source_folder_path, nodes, wtime,
                    con, sbatch)
     job.go()
 
-    for i in range(600):
-        time.sleep(3)
-        status = job.job_status()
-        if status == "ERROR":
-            logger.info("Job status ERROR")
-            break
-        elif status == "C" or status == "UNKNOWN":
-            logger.info("Job completed: {}; {}".format(job.local_id, job.remote_id))
-            job.download()
-            break
-        else:
-            logger.info(status)
+    wait_for_job(job, download=True, unknown_is_done=True)
     logger.info("Done")
     return job.local_job_folder_path
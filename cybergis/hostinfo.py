@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import time
+
+from .utils import get_logger, get_cache_dir
+
+logger = get_logger()
+
+
+# one discovery command per metadata key, all run on a single exec channel
+DISCOVERY_COMMANDS = [
+    ("home", "echo ~"),
+    ("user", "whoami"),
+    ("scratch", 'for d in "$SCRATCH" "/scratch/$USER" "/expanse/lustre/scratch/$USER" '
+                '"/oasis/scratch/comet/$USER" "/data/cigi/scratch/$USER"; '
+                'do [ -n "$d" ] && [ -d "$d" ] && echo "$d"; done; true'),
+    ("partitions", "sinfo -h -o %P 2>/dev/null | sort -u; true"),
+    ("module", 'type module >/dev/null 2>&1 || command -v modulecmd >/dev/null 2>&1 '
+               '|| [ -n "$MODULESHOME" ] && echo yes; true'),
+    ("singularity", "command -v singularity || command -v apptainer; true"),
+]
+
+
+def discover_host_metadata(connection):
+    """
+    Ask the login node who and where we are, in one round trip
+    :param connection: SSHConnection with a connected transport
+    :return: {"home", "user", "scratch": [paths], "partitions": [names], "default_partition",
+              "module": bool, "singularity": path or None, "discovered": timestamp}
+    """
+    results = connection.run_commands([command for key, command in DISCOVERY_COMMANDS])
+    out = dict(zip([key for key, command in DISCOVERY_COMMANDS], results))
+    partitions, default_partition = [], None
+    for name in out["partitions"].stdout:
+        # sinfo marks the default partition with a trailing *
+        if name.endswith("*"):
+            name = name[:-1]
+            default_partition = name
+        if name not in partitions:
+            partitions.append(name)
+    singularity = out["singularity"].stdout
+    return {"home": out["home"].output(),
+            "user": out["user"].output(),
+            "scratch": list(dict.fromkeys(out["scratch"].stdout)),
+            "partitions": partitions,
+            "default_partition": default_partition,
+            "module": "yes" in out["module"].stdout,
+            "singularity": singularity[0] if len(singularity) > 0 else None,
+            "discovered": time.time()}
+
+
+class HostMetadataCache(object):
+    """
+    On-disk cache of discover_host_metadata results, one json file per (server, user name)
+    A fresh entry lets SSHConnection.login skip discovery: login becomes just the SSH handshake.
+    """
+    # seconds an entry is trusted; partitions and modules change rarely, home and user never
+    ttl = 7 * 24 * 3600
+
+    def __init__(self, cache_dir=None, ttl=None):
+        """
+        :param cache_dir: folder of cache files; default(None): get_cache_dir("hosts")
+        :param ttl: seconds an entry stays valid; default(None): self.ttl
+        """
+        self.cache_dir = cache_dir if cache_dir is not None else get_cache_dir("hosts")
+        if ttl is not None:
+            self.ttl = ttl
+
+    def _path(self, server, user_name):
+        key = hashlib.sha1("{}:{}".format(server, user_name).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "{}.json".format(key))
+
+    def load(self, server, user_name):
+        """
+        :return: metadata dict, None if not cached or older than ttl
+        """
+        fpath = self._path(server, user_name)
+        if not os.path.isfile(fpath):
+            return None
+        try:
+            with open(fpath) as f:
+                metadata = json.load(f)["metadata"]
+        except (ValueError, KeyError, OSError) as ex:
+            logger.warning("Ignoring broken host metadata cache {}: {}".format(fpath, ex))
+            return None
+        if time.time() - metadata.get("discovered", 0) > self.ttl:
+            return None
+        return metadata
+
+    def save(self, server, user_name, metadata):
+        record = {"server": server,
+                  "user_name": user_name,
+                  "metadata": metadata}
+        fpath = self._path(server, user_name)
+        tmp_fpath = fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_fpath, fpath)
+
+    def remove(self, server, user_name):
+        fpath = self._path(server, user_name)
+        if os.path.isfile(fpath):
+            os.remove(fpath)
@@ -0,0 +1,249 @@
+import bisect
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .utils import get_logger
+
+logger = get_logger()
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram (Prometheus style: each bucket counts observations <= its bound)
+    """
+    # seconds
+    duration_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+    # MB/s
+    throughput_buckets = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile (0-100); max for the overflow bucket
+        """
+        if self.count == 0:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "min": self.min,
+                "max": self.max,
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+
+class OperationRecord(object):
+    """
+    Measurements of one instrumented operation; code running inside the operation adds
+    bytes, channels and retries through Instrumentation.current()
+    """
+
+    def __init__(self, operation, server, target=None):
+        self.operation = operation
+        self.server = server
+        self.target = target
+        self.started = time.time()
+        self.seconds = None
+        self.bytes = 0
+        self.channels = 1
+        self.retries = 0
+        self.ok = None
+        self.error = None
+
+    def add_bytes(self, nbytes):
+        self.bytes += nbytes
+
+    @property
+    def throughput_mb_per_s(self):
+        if not self.seconds or self.bytes == 0:
+            return None
+        return self.bytes / 1e6 / self.seconds
+
+    def to_dict(self):
+        return {"operation": self.operation,
+                "server": self.server,
+                "target": self.target,
+                "started": self.started,
+                "seconds": self.seconds,
+                "bytes": self.bytes,
+                "throughput_mb_per_s": self.throughput_mb_per_s,
+                "channels": self.channels,
+                "retries": self.retries,
+                "ok": self.ok,
+                "error": self.error}
+
+
+class Instrumentation(object):
+    """
+    Collects an OperationRecord for every instrumented SSHConnection operation
+    (upload, download, run_command, remote_zip, remote_unzip, ...), passes it to
+    subscribers as a dict and aggregates durations and throughput into histograms
+    per (server, operation):
+        get_instrumentation().subscribe(lambda event: dashboard.send(event))
+        get_instrumentation().snapshot()
+    """
+    max_events = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._subscribers = []
+        self.events = deque(maxlen=self.max_events)
+        self.durations = {}
+        self.throughputs = {}
+        self.totals = {}
+
+    def subscribe(self, callback):
+        """
+        :param callback: function(event dict) called after every operation, in the thread that ran it
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        """
+        :return: innermost OperationRecord running in this thread, None outside instrumented operations
+        """
+        stack = self._stack()
+        return stack[-1] if len(stack) > 0 else None
+
+    def add_bytes(self, nbytes):
+        record = self.current()
+        if record is not None:
+            record.add_bytes(nbytes)
+
+    def add_retry(self):
+        record = self.current()
+        if record is not None:
+            record.retries += 1
+
+    def set_channels(self, channels):
+        record = self.current()
+        if record is not None:
+            record.channels = channels
+
+    def start(self, operation, server, target=None):
+        record = OperationRecord(operation, server, target=target)
+        self._stack().append(record)
+        return record
+
+    def finish(self, record, error=None):
+        stack = self._stack()
+        if record in stack:
+            stack.remove(record)
+        record.seconds = time.time() - record.started
+        record.ok = error is None
+        record.error = str(error) if error is not None else None
+        key = (record.server, record.operation)
+        event = record.to_dict()
+        with self._lock:
+            self.events.append(event)
+            if key not in self.durations:
+                self.durations[key] = Histogram(Histogram.duration_buckets)
+                self.throughputs[key] = Histogram(Histogram.throughput_buckets)
+                self.totals[key] = {"count": 0, "errors": 0, "bytes": 0, "retries": 0}
+            self.durations[key].observe(record.seconds)
+            if record.throughput_mb_per_s is not None:
+                self.throughputs[key].observe(record.throughput_mb_per_s)
+            totals = self.totals[key]
+            totals["count"] += 1
+            totals["errors"] += 0 if record.ok else 1
+            totals["bytes"] += record.bytes
+            totals["retries"] += record.retries
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as ex:
+                logger.warning("Instrumentation subscriber {} failed: {}".format(callback, ex))
+        return record
+
+    @contextmanager
+    def measure(self, operation, server, target=None):
+        """
+        Record a block as one operation, for steps that are not a method call of their own:
+            with get_instrumentation().measure("remote_unzip", connection.server, target=zip_fpath):
+                ...
+        """
+        record = self.start(operation, server, target=target)
+        try:
+            yield record
+        except BaseException as ex:
+            self.finish(record, error=ex)
+            raise
+        self.finish(record)
+
+    def snapshot(self):
+        """
+        :return: {"server operation": {"count", "errors", "bytes", "retries", "seconds": {...}, "mb_per_s": {...}}}
+        """
+        with self._lock:
+            return {"{} {}".format(server, operation): dict(self.totals[(server, operation)],
+                                                            seconds=self.durations[(server, operation)].snapshot(),
+                                                            mb_per_s=self.throughputs[(server, operation)].snapshot())
+                    for server, operation in self.totals}
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+            self.durations = {}
+            self.throughputs = {}
+            self.totals = {}
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation():
+    return _instrumentation
+
+
+def instrumented(operation):
+    """
+    Decorator recording every call of a connection method as an operation; the first
+    positional argument (a path or command) is kept as the event's target
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(connection, *args, **kwargs):
+            with _instrumentation.measure(operation, connection.server, target=args[0] if args else None):
+                return func(connection, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,8 +1,9 @@
 import uuid
 import os
+import shlex
 import time
-from .base import SBatchScript, BaseJob
-from .connection import SSHConnection
+from .base import SBatchScript, BaseJob, BaseConnection
+from .monitor import sacct_state_to_status, get_job_status_monitor
 from .utils import UtilsMixin
 
 
@@ -34,11 +35,20 @@ class SlurmJob(UtilsMixin, BaseJob):
     user_script = None
     # ssh_connection obj
     connection = None
-    # Class type of connection obj
-    connection_class = SSHConnection
+    # Class type of connection obj (SSHConnection, or LocalConnection to run against a local stand-in)
+    connection_class = BaseConnection
     # Class type of sbatch script obj
     sbatch_script_class = SBatchScript
 
+    # submit right after uploading the generated scripts and upload the model folder while the job
+    # waits in queue; the batch script holds until the upload is complete (see go)
+    staged_submission = False
+    # seconds a started job waits for the staged upload before giving up, and between its checks
+    stage_timeout = 3600
+    stage_poll_seconds = 10
+    stage_ready_file_name = ".cybergis_stage_ready"
+    stage_failed_file_name = ".cybergis_stage_failed"
+
     def __init__(self,
                  local_workspace_path,
                  local_model_source_folder_path,
@@ -48,6 +58,7 @@ class SlurmJob(UtilsMixin, BaseJob):
                  name=None,
                  description=None,
                  move_source=False,
+                 staged_submission=None,
                  **kwargs):
         super().__init__()
 
@@ -86,6 +97,8 @@ class SlurmJob(UtilsMixin, BaseJob):
         self.job_name = name if name is not None else self.job_name
         self.sbatch_script.job_name = self.job_name
         self.description = description
+        if staged_submission is not None:
+            self.staged_submission = staged_submission
 
     def _prepare_local_model_folder(self, move_source):
         if move_source:
@@ -112,8 +125,14 @@ class SlurmJob(UtilsMixin, BaseJob):
     def go(self):
         self.prepare()
         self.connection.login()
-        self.upload()
-        self.submit()
+        if self.staged_submission:
+            # queue wait overlaps the model folder upload
+            self.upload_scripts()
+            self.submit()
+            self.upload_staged()
+        else:
+            self.upload()
+            self.submit()
         self.post_submission()
 
     @property
@@ -166,7 +185,88 @@ class SlurmJob(UtilsMixin, BaseJob):
         # upload model job folder to remote
         self.connection.upload(self.local_job_folder_path,
                                self.remote_workspace_folder_path,
-                               remote_is_folder=True)
+                               remote_is_folder=True,
+                               blob_store_path=self.sbatch_script.remote_blob_store_folder_path)
+
+    @property
+    def remote_stage_ready_file_path(self):
+        return os.path.join(self.remote_job_folder_path, self.stage_ready_file_name)
+
+    @property
+    def remote_stage_failed_file_path(self):
+        return os.path.join(self.remote_job_folder_path, self.stage_failed_file_name)
+
+    def _add_stage_guard(self):
+        # hold the batch script after its #SBATCH header until the staged upload is complete
+        sbatch_fpath = os.path.join(self.local_job_folder_path, self.sbatch_script.file_name)
+        with open(sbatch_fpath) as f:
+            lines = f.read().splitlines()
+        header_end = 1 if len(lines) > 0 and lines[0].startswith("#!") else 0
+        for i, line in enumerate(lines):
+            if line.strip().startswith("#SBATCH"):
+                header_end = i + 1
+        guard = [
+            "",
+            "## staged submission: wait until the job folder upload is complete",
+            "cybergis_stage_waited=0",
+            "while [ ! -e {} ]; do".format(shlex.quote(self.remote_stage_ready_file_path)),
+            "    if [ -e {} ] || [ $cybergis_stage_waited -ge {} ]; then".format(
+                shlex.quote(self.remote_stage_failed_file_path), int(self.stage_timeout)),
+            '        echo "Job folder upload did not complete, exiting" >&2',
+            "        exit 1",
+            "    fi",
+            "    sleep {}".format(int(self.stage_poll_seconds)),
+            "    cybergis_stage_waited=$((cybergis_stage_waited + {}))".format(int(self.stage_poll_seconds)),
+            "done",
+            "",
+        ]
+        with open(sbatch_fpath, "w") as f:
+            f.write("\n".join(lines[:header_end] + guard + lines[header_end:]) + "\n")
+
+    def upload_scripts(self):
+        """
+        Staged submission, step 1: upload the generated scripts (files directly in the local job folder)
+        with a guard added to the batch script, so it can be submitted before the model folder is uploaded
+        """
+        self._add_stage_guard()
+        self.connection.run_command("mkdir -p {} && rm -f {} {}".format(
+            shlex.quote(self.remote_job_folder_path),
+            shlex.quote(self.remote_stage_ready_file_path),
+            shlex.quote(self.remote_stage_failed_file_path)))
+        for fname in sorted(os.listdir(self.local_job_folder_path)):
+            fpath = os.path.join(self.local_job_folder_path, fname)
+            if os.path.isfile(fpath):
+                self.connection.upload(fpath, self.remote_job_folder_path, remote_is_folder=True)
+
+    def upload_staged(self):
+        """
+        Staged submission, step 3: upload the folders in the job folder (the model folder, ...) while the
+        submitted job waits in queue, then release it; the scripts upload_scripts sent are not uploaded again,
+        as the batch script may already be running
+        A failed upload cancels the job and tells a job that already started to exit
+        """
+        start = time.time()
+        try:
+            for fname in sorted(os.listdir(self.local_job_folder_path)):
+                fpath = os.path.join(self.local_job_folder_path, fname)
+                if os.path.isdir(fpath):
+                    self.connection.upload(fpath,
+                                           self.remote_job_folder_path,
+                                           remote_is_folder=True,
+                                           blob_store_path=self.sbatch_script.remote_blob_store_folder_path)
+        except Exception as ex:
+            self.logger.error("Staged upload of job {} failed, cancelling {}: {}".format(self.local_id,
+                                                                                       self.remote_id, ex))
+            try:
+                self.connection.run_command("touch {}; scancel {}".format(
+                    shlex.quote(self.remote_stage_failed_file_path), self.remote_id), priority="submit")
+            except Exception as cancel_ex:
+                self.logger.error("Cancelling job {} failed: {}".format(self.remote_id, cancel_ex))
+            raise
+        self.connection.run_command("touch {}".format(shlex.quote(self.remote_stage_ready_file_path)),
+                                    priority="submit")
+        self.logger.info("Staged upload of job {} done in {:.1f}s while {} was queued".format(
+            self.local_id, time.time() - start, self.remote_id))
 
     def submit(self, remote_job_submission_folder_path=None, remote_sbatch_folder_path=None):
         if remote_job_submission_folder_path is None:
@@ -180,7 +280,7 @@ class SlurmJob(UtilsMixin, BaseJob):
         cmd = "cd {} && sbatch {}".format(remote_job_submission_folder_path,
                                           self.sbatch_script.file_name)
 
-        out = self.connection.run_command(cmd)
+        out = self.connection.run_command(cmd, priority="submit")
         remote_id = self._save_remote_id(out)
         self.logger.info("Remote Job ID assigned: {}".format(remote_id))
         self.slurm_out_file_name = "slurm-{}.out".format(remote_id)
@@ -190,6 +290,26 @@ class SlurmJob(UtilsMixin, BaseJob):
     def post_submission(self):
         pass
 
+    def open_remote_output(self, rel_path, block_size=None, cache_blocks=None):
+        """
+        Open a file under the remote model folder for lazy reads, eg: xarray.open_dataset(f, engine="h5netcdf")
+        :param rel_path: path relative to remote_model_folder_path, eg: "output/run_timestep.nc"
+        :return: remotefile.RemoteFile
+        """
+        return self.connection.open_remote(os.path.join(self.remote_model_folder_path, rel_path),
+                                           block_size=block_size,
+                                           cache_blocks=cache_blocks)
+
+    def follow_slurm_out(self, offset=0):
+        """
+        Follow slurm-XXXXXX.out of the submitted job while it runs
+        lines = job.follow_slurm_out().follow(stop=lambda: job.job_status() in ("C", "ERROR"))
+        :return: follow.RemoteFileFollower
+        """
+        if not self.remote_slurm_out_file_path:
+            raise Exception("Job {} has not been submitted".format(self.local_id))
+        return self.connection.follow(self.remote_slurm_out_file_path, offset=offset)
+
     def download(self):
         # download job from HPC to local
         pass
@@ -210,7 +330,8 @@ class SlurmJob(UtilsMixin, BaseJob):
         return remote_id
 
     def job_status(self):
-        return self.job_status_pbs(self.remote_id, self.connection)
+        # one sacct call per refresh for all jobs on this connection, see monitor.JobStatusMonitor
+        return get_job_status_monitor(self.connection).status(self.remote_id)
 
     # def job_status_pbs(self):
     #     # Slurm supports both squeue (slurm) and qstat (pbs) for queue management
@@ -267,7 +388,9 @@ class SlurmJob(UtilsMixin, BaseJob):
         def __check_status():
             out = connection.run_command(cmd,
                                          line_delimiter=None,
-                                         raise_on_error=True)
+                                         raise_on_error=True,
+                                         idempotent=True,
+                                         priority="poll")
             # PENDING RUNNING COMPLETED FAILED c+
             # https://slurm.schedmd.com/sacct.html
 
@@ -279,30 +402,18 @@ class SlurmJob(UtilsMixin, BaseJob):
 
             status = out[2].split()[0]
             self.logger.warning("Job {} status: {} ".format(remote_id, status))
-            if "COMPLETED" in status:
-                status = "C"
-            elif "CANCELLED" in status:
-                status = "ERROR"
-            elif "FAILED" in status:
-                status = "ERROR"
-            elif "OUT_OF_MEMORY" in status:
-                status = "ERROR"
-            elif "TIMEOUT" in status:
-                status = "ERROR"
-            elif "REVOKED" in status:
-                status = "ERROR"
-            return status
+            return sacct_state_to_status(status)
 
         try:
             return __check_status()
         except Exception as ex:
-            self.logger.error("Got Error when Checking Job {} status: {} ".format(remote_id, ex.message))
+            self.logger.error("Got Error when Checking Job {} status: {} ".format(remote_id, ex))
             self.logger.error("Trying again... ")
             time.sleep(10)
             try:
                 return __check_status()
             except Exception as ex:
-                self.logger.error("Got Error Again when Checking Job {} status: {} ".format(remote_id, ex.message))
+                self.logger.error("Got Error Again when Checking Job {} status: {} ".format(remote_id, ex))
                 return "ERROR"
 
 
@@ -312,14 +423,16 @@ class SlurmJob(UtilsMixin, BaseJob):
         try:
             out = connection.run_command(cmd,
                                          line_delimiter=None,
-                                         raise_on_error=True)
+                                         raise_on_error=True,
+                                         idempotent=True,
+                                         priority="poll")
             # out[0].split()
             #   ['JOBID', 'PARTITION', 'NAME', 'USER', 'ST', 'TIME', 'NODES', 'NODELIST(REASON)']
             # out[1].split()
             #   ['3142135', 'node', 'singular', 'cigi-gis', 'R', '0:11', '1', 'keeling-b08']
             return out[1].split()[4]
         except Exception as ex:
-            self.logger.error("Job {} status error: {} ".format(remote_id, ex.message))
+            self.logger.error("Job {} status error: {} ".format(remote_id, ex))
             return "ERROR"
 
     def job_status_pbs(self, remote_id, connection):
@@ -334,7 +447,9 @@ class SlurmJob(UtilsMixin, BaseJob):
         try:
             out = connection.run_command(cmd,
                                          line_delimiter=None,
-                                         raise_on_error=True)
+                                         raise_on_error=True,
+                                         idempotent=True,
+                                         priority="poll")
             if out is None:
                 return "UNKNOWN"
             # out = \
@@ -344,5 +459,5 @@ class SlurmJob(UtilsMixin, BaseJob):
 
             return out[2].split()[-2]
         except Exception as ex:
-            self.logger.error("Job {} status error: {} ".format(remote_id, ex.message))
+            self.logger.error("Job {} status error: {} ".format(remote_id, ex))
             return "ERROR"
@@ -1,6 +1,7 @@
-from .base import SBatchScript
+import os
+
+from .base import SBatchScript, BaseConnection
 from .job import SlurmJob
-from .connection import SSHConnection
 
 
 class KeelingSBatchScript(SBatchScript):
@@ -9,6 +10,7 @@ class KeelingSBatchScript(SBatchScript):
                  *args, **kargs):
         super().__init__(walltime, ntasks, *args, **kargs)
         self.remote_workspace_folder_path = "/data/cigi/scratch/cigi-gisolve"
+        self.remote_blob_store_folder_path = os.path.join(self.remote_workspace_folder_path, "blob_store")
         if self.partition is None:
             self.partition = "node"  # node or sesempi
         if self.ntasks > 160:
@@ -26,7 +28,7 @@ class KeelingJob(SlurmJob):
     ## For other machine, please inherit from KeelingJob
     JOB_ID_PREFIX = "Keeling_"
     backend = "keeling"
-    connection_class = SSHConnection
+    connection_class = BaseConnection
     sbatch_script_class = KeelingSBatchScript
 
     def prepare(self):
@@ -0,0 +1,515 @@
+import getpass
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+
+from .base import BaseConnection
+from .connection import CommandResult
+from .follow import RemoteFileFollower
+from .instrumentation import instrumented, get_instrumentation
+from .manifest import select_files
+from .utils import UtilsMixin
+
+# Fake scheduler commands installed by LocalConnection; one script, dispatched on the name it is called by.
+# Job states live in one json file per job; settings come from CYBERGIS_LOCAL_* environment variables.
+SCHEDULER_SHIM = '''#!{python}
+import fcntl
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+STATE_DIR = os.environ["CYBERGIS_LOCAL_STATE_DIR"]
+FIELDS = {{"jobid": "JobID", "jobname": "JobName", "state": "State", "exitcode": "ExitCode",
+          "elapsed": "Elapsed", "start": "Start", "end": "End", "workdir": "WorkDir"}}
+
+
+def state_path(job_id):
+    return os.path.join(STATE_DIR, "{{}}.json".format(job_id))
+
+
+def load(job_id):
+    try:
+        with open(state_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save(job_id, job):
+    tmp = state_path(job_id) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp, state_path(job_id))
+
+
+def all_ids():
+    return sorted(int(f[:-5]) for f in os.listdir(STATE_DIR) if f.endswith(".json"))
+
+
+def next_id():
+    with open(os.path.join(STATE_DIR, "counter"), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        job_id = int(f.read() or 1000) + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(job_id))
+    return job_id
+
+
+def map_paths(text):
+    roots = [r for r in os.environ.get("CYBERGIS_LOCAL_REMOTE_ROOTS", "").split(":") if r]
+    if not roots:
+        return text
+    pattern = r"(?<![\\w./~-])((?:{{}}))(?![\\w.-])".format("|".join(re.escape(r) for r in roots))
+    return re.sub(pattern, lambda m: os.environ["CYBERGIS_LOCAL_ROOT"] + m.group(1), text)
+
+
+def job_ids(args, option_names):
+    ids = []
+    for i, a in enumerate(args):
+        for name in option_names:
+            if a == name and i + 1 < len(args):
+                ids.extend(args[i + 1].split(","))
+            elif a.startswith(name + "="):
+                ids.extend(a.split("=", 1)[1].split(","))
+    return [int(i.split(".")[0]) for i in ids if i.split(".")[0].isdigit()]
+
+
+def elapsed(job):
+    if not job.get("started"):
+        return "00:00:00"
+    seconds = int((job.get("ended") or time.time()) - job["started"])
+    return "{{:02d}}:{{:02d}}:{{:02d}}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def sbatch(args):
+    script = os.path.abspath(args[-1])
+    job_id = next_id()
+    save(job_id, {{"state": "PENDING", "name": os.path.basename(script), "script": script, "cwd": os.getcwd(),
+                  "submitted": time.time(), "exit_code": None}})
+    proc = subprocess.Popen([sys.executable, os.path.realpath(__file__), "__run__", str(job_id)],
+                            start_new_session=True, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    job = load(job_id)
+    job["pid"] = proc.pid
+    save(job_id, job)
+    print("Submitted batch job {{}}".format(job_id))
+
+
+def run(job_id):
+    time.sleep(float(os.environ.get("CYBERGIS_LOCAL_PENDING_SECONDS", "0")))
+    job = load(job_id)
+    if job["state"] == "CANCELLED":
+        return
+    job.update(state="RUNNING", started=time.time())
+    save(job_id, job)
+    out_fpath = os.path.join(job["cwd"], "slurm-{{}}.out".format(job_id))
+    with open(out_fpath, "ab") as out:
+        if os.environ.get("CYBERGIS_LOCAL_RUN_JOBS", "0") == "1":
+            with open(job["script"]) as f:
+                script = map_paths(f.read())
+            rc = subprocess.call(["bash", "-c", script, job["script"]], cwd=job["cwd"], stdout=out,
+                                 stderr=subprocess.STDOUT, env=dict(os.environ, SLURM_JOB_ID=str(job_id)))
+        else:
+            out.write("fake job {{}} running {{}}\\n".format(job_id, job["script"]).encode("utf-8"))
+            out.flush()
+            time.sleep(float(os.environ.get("CYBERGIS_LOCAL_JOB_SECONDS", "1")))
+            rc = 0
+    job = load(job_id)
+    if job["state"] != "CANCELLED":
+        job.update(state="COMPLETED" if rc == 0 else "FAILED", exit_code=rc, ended=time.time())
+        save(job_id, job)
+
+
+def sacct(args):
+    ids = job_ids(args, ("-j", "--jobs")) or all_ids()
+    fields = ["jobid", "jobname", "state", "exitcode"]
+    widths = {{}}
+    for i, a in enumerate(args):
+        value = None
+        if a.startswith("--format="):
+            value = a.split("=", 1)[1]
+        elif a in ("--format", "-o") and i + 1 < len(args):
+            value = args[i + 1]
+        if value is not None:
+            fields = []
+            for spec in value.split(","):
+                name, _, width = spec.partition("%")
+                fields.append(name.lower())
+                if width.lstrip("-").isdigit():
+                    widths[name.lower()] = abs(int(width))
+    parsable = "--parsable2" in args or "-P" in args
+    header = not ("--noheader" in args or "-n" in args)
+    rows = []
+    for job_id in ids:
+        job = load(job_id)
+        if job is None:
+            continue
+        values = {{"jobid": str(job_id), "jobname": job["name"], "state": job["state"],
+                   "exitcode": "{{}}:0".format(job["exit_code"] or 0), "elapsed": elapsed(job),
+                   "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(job.get("started") or 0))
+                   if job.get("started") else "Unknown",
+                   "end": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(job["ended"]))
+                   if job.get("ended") else "Unknown",
+                   "workdir": job["cwd"]}}
+        rows.append([values.get(f, "") for f in fields])
+    if parsable:
+        lines = ["|".join(FIELDS.get(f, f) for f in fields)] if header else []
+        lines += ["|".join(r) for r in rows]
+    else:
+        w = [widths.get(f, 10) for f in fields]
+        lines = [" ".join(FIELDS.get(f, f)[:n].rjust(n) for f, n in zip(fields, w)),
+                 " ".join("-" * n for n in w)] if header else []
+        lines += [" ".join(v[:n].rjust(n) for v, n in zip(r, w)) for r in rows]
+    print("\\n".join(lines))
+
+
+def squeue(args):
+    ids = job_ids(args, ("-j", "--job", "--jobs")) or all_ids()
+    print("JOBID PARTITION NAME USER ST TIME NODES NODELIST(REASON)")
+    for job_id in ids:
+        job = load(job_id)
+        if job is None or job["state"] not in ("PENDING", "RUNNING"):
+            continue
+        running = job["state"] == "RUNNING"
+        print("{{}} local {{}} {{}} {{}} {{}} 1 {{}}".format(job_id, job["name"][:8], os.environ.get("USER", "user"),
+                                                  "R" if running else "PD", elapsed(job),
+                                                  "localhost" if running else "(None)"))
+
+
+def qstat(args):
+    ids = [int(a.split(".")[0]) for a in args if a.split(".")[0].isdigit()] or all_ids()
+    print("Job id              Name             Username        Time Use S Queue          ")
+    print("------------------- ---------------- --------------- -------- - ---------------")
+    for job_id in ids:
+        job = load(job_id)
+        if job is None:
+            sys.stderr.write("qstat: Unknown Job Id {{}}\\n".format(job_id))
+            sys.exit(153)
+        s = {{"PENDING": "Q", "RUNNING": "R"}}.get(job["state"], "C")
+        print("{{:<19}} {{:<16}} {{:<15}} {{}} {{}} local".format(job_id, job["name"][:16],
+                                                         os.environ.get("USER", "user")[:15], elapsed(job), s))
+
+
+def scancel(args):
+    for job_id in [int(a) for a in args if a.isdigit()]:
+        job = load(job_id)
+        if job is None or job["state"] not in ("PENDING", "RUNNING"):
+            continue
+        job.update(state="CANCELLED", ended=time.time())
+        save(job_id, job)
+        try:
+            os.killpg(job["pid"], signal.SIGTERM)
+        except (KeyError, OSError):
+            pass
+
+
+def srun(args):
+    os.execvp(args[0], args)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["__run__"]:
+        run(int(sys.argv[2]))
+    else:
+        {{"sbatch": sbatch, "sacct": sacct, "squeue": squeue, "qstat": qstat,
+         "scancel": scancel, "srun": srun}}[os.path.basename(sys.argv[0])](sys.argv[1:])
+'''
+
+
+class _LocalSFTP(object):
+    # the few SFTP client calls other modules make, served from the local stand-in folder
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def stat(self, remote_fpath):
+        return os.stat(self.connection.local_path(remote_fpath))
+
+    def open(self, remote_fpath, mode="r"):
+        return open(self.connection.local_path(remote_fpath), mode)
+
+
+class LocalConnection(UtilsMixin, BaseConnection):
+    """
+    Stand-in for SSHConnection that runs the HPC pipeline on this machine
+    "Remote" absolute paths under remote_roots (/data, /expanse, /home, ...) are
+    mapped into root_folder_path, commands run through a local shell with those
+    paths rewritten, and fake sbatch/sacct/squeue/qstat/scancel/srun commands come
+    first on PATH. Submitted jobs sleep for job_seconds and complete, or with
+    run_jobs=True actually run their (path-rewritten) batch script with bash.
+    Lets SlurmJob.go()/job_status()/download() run on a laptop or in CI:
+        con = LocalConnection(root_folder_path="/tmp/fake_keeling", user_name="cigi-gisolve")
+        job = SummaKeelingJob(workspace, model_folder, con, SummaKeelingSBatchScript(10, 1))
+    """
+    connection_type = "local"
+    remote_roots = ("/data", "/expanse", "/home", "/oasis", "/projects", "/scratch")
+    # run submitted batch scripts; False: fake jobs that only sleep job_seconds
+    run_jobs = False
+    job_seconds = 1
+    # seconds a submitted job stays PENDING
+    pending_seconds = 0
+    shim_names = ("sbatch", "sacct", "squeue", "qstat", "scancel", "srun")
+    transfer_workers = 1
+    last_activity = 0
+
+    def __init__(self, server="localhost", user_name=None, root_folder_path=None,
+                 run_jobs=None, job_seconds=None, pending_seconds=None, **kargs):
+        """
+        :param server: name reported as the server
+        :param user_name: "remote" user; default(None): the local user
+        :param root_folder_path: local folder standing in for the remote '/'; default(None): a new temp folder
+        :param run_jobs: run submitted batch scripts instead of sleeping job_seconds
+        :param kargs: SSHConnection arguments (user_pw, key_path, ...), ignored
+        """
+        super().__init__()
+        self.server = server
+        self.user_name = user_name if user_name is not None else getpass.getuser()
+        if root_folder_path is None:
+            root_folder_path = tempfile.mkdtemp(prefix="cybergis_local_")
+        self.root_folder_path = os.path.abspath(root_folder_path).rstrip("/")
+        if run_jobs is not None:
+            self.run_jobs = run_jobs
+        if job_seconds is not None:
+            self.job_seconds = job_seconds
+        if pending_seconds is not None:
+            self.pending_seconds = pending_seconds
+        self.remote_user_name = self.user_name
+        self.remote_user_home = "/home/{}".format(self.user_name)
+        self._logged_in = False
+        self._path_pattern = re.compile(r"(?<![\w./~-])((?:{}))(?![\w.-])".format(
+            "|".join(re.escape(r) for r in self.remote_roots)))
+
+    @property
+    def logged_in(self):
+        return self._logged_in
+
+    @property
+    def shim_folder_path(self):
+        return os.path.join(self.root_folder_path, ".cybergis", "bin")
+
+    @property
+    def state_folder_path(self):
+        return os.path.join(self.root_folder_path, ".cybergis", "jobs")
+
+    def local_path(self, remote_path):
+        """
+        :return: local path standing in for remote_path; paths outside remote_roots are returned unchanged
+        """
+        if any(remote_path == r or remote_path.startswith(r + "/") for r in self.remote_roots):
+            return self.root_folder_path + remote_path
+        return remote_path
+
+    def map_command(self, command):
+        return self._path_pattern.sub(lambda m: self.root_folder_path + m.group(1), command)
+
+    def _install_shims(self):
+        os.makedirs(self.shim_folder_path, exist_ok=True)
+        os.makedirs(self.state_folder_path, exist_ok=True)
+        shim_fpath = os.path.join(self.shim_folder_path, "scheduler_shim.py")
+        with open(shim_fpath, "w") as f:
+            f.write(SCHEDULER_SHIM.format(python=sys.executable))
+        os.chmod(shim_fpath, 0o755)
+        for name in self.shim_names:
+            link = os.path.join(self.shim_folder_path, name)
+            if not os.path.lexists(link):
+                os.symlink(shim_fpath, link)
+
+    def _env(self):
+        env = dict(os.environ)
+        env.update(PATH=self.shim_folder_path + os.pathsep + env.get("PATH", ""),
+                   HOME=self.local_path(self.remote_user_home),
+                   USER=self.user_name,
+                   CYBERGIS_LOCAL_ROOT=self.root_folder_path,
+                   CYBERGIS_LOCAL_REMOTE_ROOTS=":".join(self.remote_roots),
+                   CYBERGIS_LOCAL_STATE_DIR=self.state_folder_path,
+                   CYBERGIS_LOCAL_RUN_JOBS="1" if self.run_jobs else "0",
+                   CYBERGIS_LOCAL_JOB_SECONDS=str(self.job_seconds),
+                   CYBERGIS_LOCAL_PENDING_SECONDS=str(self.pending_seconds))
+        return env
+
+    def is_alive(self, probe=False):
+        return self.logged_in
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def login(self, *args, **kwargs):
+        if not self.logged_in:
+            os.makedirs(self.local_path(self.remote_user_home), exist_ok=True)
+            self._install_shims()
+            self._logged_in = True
+            self.touch()
+        self.logger.info("Local connection {} ready at {} as user {}".format(self.server,
+                                                                            self.root_folder_path,
+                                                                            self.remote_user_name))
+
+    def logout(self, *args, **kwargs):
+        self._logged_in = False
+        self.logger.info("Local connection {} closed".format(self.server))
+
+    def _copy(self, source, target):
+        get_instrumentation().add_bytes(os.path.getsize(source))
+        return shutil.copy2(source, target)
+
+    def _copy_folder(self, source, target):
+        shutil.copytree(source, target, copy_function=self._copy, dirs_exist_ok=True)
+
+    @instrumented("upload")
+    def upload(self, local_fpath, remote_fpath, remote_is_folder=False, unzip=False, *args, **kwargs):
+        """
+        Same layout as SSHConnection.upload; transfer mode arguments are ignored
+        local folder --> remote_fpath/folder
+        """
+        local_fpath = self._check_abs_path(local_fpath.strip())
+        remote_fpath = self._check_abs_path(remote_fpath.strip())
+        self.logger.info("Uploading {} to {}".format(local_fpath, remote_fpath))
+        self.touch()
+        target = self.local_path(remote_fpath)
+        if os.path.isdir(local_fpath):
+            if not remote_is_folder:
+                raise Exception("if remote must be a folder when local is folder")
+            self._copy_folder(local_fpath, os.path.join(target, os.path.basename(local_fpath)))
+            return
+        if remote_is_folder:
+            target = os.path.join(target, os.path.basename(local_fpath))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self._copy(local_fpath, target)
+        if unzip and target.lower().endswith(".zip"):
+            with zipfile.ZipFile(target, 'r') as zip_ref:
+                zip_ref.extractall(os.path.dirname(target))
+            os.remove(target)
+
+    @instrumented("download")
+    def download(self, remote_fpath, local_fpath, remote_is_folder=False, unzip=False, *args, **kwargs):
+        """
+        Same layout as SSHConnection.download; transfer mode arguments are ignored
+        remote folder --> local_fpath/folder
+        """
+        remote_fpath = self._check_abs_path(remote_fpath.strip())
+        local_fpath = self._check_abs_path(local_fpath.strip())
+        self.logger.info("Downloading {} to {}".format(remote_fpath, local_fpath))
+        self.touch()
+        source = self.local_path(remote_fpath)
+        if remote_is_folder:
+            if not os.path.isdir(local_fpath):
+                raise Exception("local must be folder when remote is folder")
+            self._copy_folder(source, os.path.join(local_fpath, os.path.basename(remote_fpath)))
+            return
+        if os.path.isdir(local_fpath):
+            local_fpath = os.path.join(local_fpath, os.path.basename(remote_fpath))
+        self._copy(source, local_fpath)
+        if unzip and local_fpath.lower().endswith(".zip"):
+            with zipfile.ZipFile(local_fpath, 'r') as zip_ref:
+                zip_ref.extractall(os.path.dirname(local_fpath))
+
+    @instrumented("download_selected")
+    def download_selected(self, remote_folder_path, local_folder_path, dry_run=False, workers=None, **filters):
+        """
+        Same as SSHConnection.download_selected
+        """
+        remote_folder_path = self._check_abs_path(remote_folder_path.strip())
+        source = self.local_path(remote_folder_path)
+        if not os.path.isdir(source):
+            raise FileNotFoundError(remote_folder_path)
+        manifest = {}
+        for root, dirs, files in os.walk(source, followlinks=True):
+            for f in files:
+                fpath = os.path.join(root, f)
+                st = os.stat(fpath)
+                manifest[os.path.relpath(fpath, source)] = {"size": st.st_size, "mtime": st.st_mtime}
+        selected = select_files(manifest, **filters)
+        plan = {"remote_folder_path": remote_folder_path,
+                "manifest": manifest,
+                "files": selected,
+                "total_files": len(manifest),
+                "total_bytes": sum(e["size"] for e in manifest.values()),
+                "selected_bytes": sum(manifest[r]["size"] for r in selected),
+                "downloaded_bytes": 0}
+        self.logger.info("Selected {} of {} files in {}: {:.1f} MB of {:.1f} MB".format(
+            len(selected), plan["total_files"], remote_folder_path,
+            plan["selected_bytes"] / 1e6, plan["total_bytes"] / 1e6))
+        if not dry_run:
+            local_root = os.path.join(local_folder_path, os.path.basename(remote_folder_path))
+            for rel_path in selected:
+                target = os.path.join(local_root, rel_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                self._copy(os.path.join(source, rel_path), target)
+            plan["downloaded_bytes"] = plan["selected_bytes"]
+        return plan
+
+    def _run(self, command):
+        self.touch()
+        proc = subprocess.run(self.map_command(command), shell=True, cwd=self.local_path(self.remote_user_home),
+                              env=self._env(), stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out = proc.stdout.decode("utf-8", errors="replace")
+        err = proc.stderr.decode("utf-8", errors="replace")
+        get_instrumentation().add_bytes(len(out) + len(err))
+        return proc.returncode, out, err
+
+    @instrumented("run_command")
+    def run_command(self, command, line_delimiter='', raise_on_error=False, *args, **kwargs):
+        """
+        Same as SSHConnection.run_command, run by the local shell with remote paths mapped
+        """
+        self.logger.debug("run_command on local stand-in: " + command)
+        _, out, err = self._run(command)
+        out = list(map(self.remove_newlines, out.splitlines()))
+        err = list(map(self.remove_newlines, err.splitlines()))
+        if len(err) > 0:
+            self.logger.debug("run_command {} got error {}".format(command, ';'.join(err)))
+            if raise_on_error:
+                raise Exception(';'.join(err))
+        if len(out) == 0:
+            return None
+        if type(line_delimiter) is not str:
+            return out
+        return line_delimiter.join(out)
+
+    @instrumented("run_commands")
+    def run_commands(self, commands, raise_on_error=False, stop_on_error=False):
+        """
+        Same as SSHConnection.run_commands
+        """
+        results = []
+        for command in commands:
+            if stop_on_error and len(results) > 0 and not results[-1].ok:
+                results.append(CommandResult(command))
+                continue
+            exit_code, out, err = self._run(command)
+            results.append(CommandResult(command, exit_code,
+                                         list(map(self.remove_newlines, out.splitlines())),
+                                         list(map(self.remove_newlines, err.splitlines()))))
+        failed = [r for r in results if r.exit_code is not None and not r.ok]
+        if raise_on_error and len(failed) > 0:
+            raise Exception(";".join("{} ({}): {}".format(r.command, r.exit_code, ";".join(r.stderr))
+                                     for r in failed))
+        return results
+
+    @contextmanager
+    def sftp_session(self):
+        yield _LocalSFTP(self)
+
+    def follow(self, remote_fpath, offset=0, max_read_size=None):
+        """
+        Same as SSHConnection.follow
+        """
+        return RemoteFileFollower(self, remote_fpath, offset=offset, max_read_size=max_read_size)
+
+    def open_remote(self, remote_fpath, *args, **kwargs):
+        """
+        Same as SSHConnection.open_remote; a plain local file object
+        """
+        return open(self.local_path(remote_fpath), "rb")
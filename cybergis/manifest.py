@@ -0,0 +1,603 @@
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import shlex
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .transfer import ParallelSFTPTransfer
+from .utils import get_logger, get_cache_dir
+
+logger = get_logger()
+
+
+def file_sha1(fpath, chunk_size=1024 * 1024):
+    h = hashlib.sha1()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def local_manifest(folder_path, previous=None, hash_files=True, workers=4):
+    """
+    Describe every file under a local folder
+    :param folder_path: full path to local folder
+    :param previous: older manifest of the same content; hashes are reused when size and mtime match
+    :param hash_files: compute sha1 of each file
+    :param workers: threads used for hashing
+    :return: {relative path: {"size": int, "mtime": float, "sha1": str}}
+    """
+    previous = previous or {}
+    manifest = {}
+    for root, dirs, files in os.walk(folder_path, followlinks=True):
+        for f in files:
+            fpath = os.path.join(root, f)
+            st = os.stat(fpath)
+            rel_path = os.path.relpath(fpath, folder_path)
+            manifest[rel_path] = {"size": st.st_size, "mtime": st.st_mtime, "sha1": None}
+
+    if hash_files:
+        to_hash = []
+        for rel_path, entry in manifest.items():
+            old = previous.get(rel_path)
+            if old is not None and old.get("sha1") and old["size"] == entry["size"] \
+                    and old.get("mtime") == entry["mtime"]:
+                entry["sha1"] = old["sha1"]
+            else:
+                to_hash.append(rel_path)
+        # hashlib releases the GIL on large buffers
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            hashes = executor.map(lambda r: file_sha1(os.path.join(folder_path, r)), to_hash)
+            for rel_path, sha1 in zip(to_hash, hashes):
+                manifest[rel_path]["sha1"] = sha1
+        logger.debug("Local manifest of {}: {} files, {} hashed".format(folder_path, len(manifest), len(to_hash)))
+    return manifest
+
+
+def local_dirs(folder_path):
+    """
+    :param folder_path: full path to local folder
+    :return: sorted paths of the folders under folder_path, relative to it (empty folders included)
+    """
+    out = []
+    for root, dirs, files in os.walk(folder_path, followlinks=True):
+        out.extend(os.path.relpath(os.path.join(root, d), folder_path) for d in dirs)
+    return sorted(out)
+
+
+def remote_sha1(connection, folder_path, rel_paths):
+    """
+    Hash some files of a remote folder on the server
+    :param connection: logged-in SSHConnection
+    :param folder_path: full path to remote folder
+    :param rel_paths: file paths relative to folder_path
+    :return: {relative path: sha1}; files that could not be read are left out
+    """
+    rel_paths = list(rel_paths)
+    if len(rel_paths) == 0:
+        return {}
+    agent = connection.get_agent()
+    if agent is not None:
+        hashes = agent.hash([os.path.join(folder_path, r) for r in rel_paths])
+        return {r: hashes[os.path.join(folder_path, r)] for r in rel_paths
+                if hashes.get(os.path.join(folder_path, r)) is not None}
+    connection.touch()
+    channel = connection.open_channel("cd {} && xargs -0 -r sha1sum".format(shlex.quote(folder_path)))
+    try:
+        channel.sendall("\0".join(rel_paths).encode("utf-8"))
+        channel.shutdown_write()
+        out, err, exit_status = connection.drain_channel(channel)
+    finally:
+        connection.close_channel(channel)
+    hashes = {}
+    for line in out.splitlines():
+        sha1, _, rel_path = line.partition("  ")
+        hashes[rel_path] = sha1
+    return hashes
+
+
+def remote_manifest(connection, folder_path, hash_files=False):
+    """
+    Describe every file under a remote folder; sizes and mtimes come from one
+    'find' call (or one request to the connection's remote agent) and hashes,
+    if asked for, are computed on the server
+    :param connection: logged-in SSHConnection
+    :param folder_path: full path to remote folder
+    :param hash_files: compute sha1 of each file on remote
+    :return: {relative path: {"size": int, "mtime": float, "sha1": str}}; empty if folder does not exist
+    """
+    agent = connection.get_agent()
+    if agent is not None:
+        return agent.manifest(folder_path, hash_files=hash_files)
+    quoted = shlex.quote(folder_path)
+    manifest = {}
+    # streamed: output folders can hold hundreds of thousands of files
+    for line in connection.iter_command("cd {} && find -L . -type f -printf '%P\\t%s\\t%T@\\n'".format(quoted)):
+        rel_path, size, mtime = line.rsplit("\t", 2)
+        manifest[rel_path] = {"size": int(size), "mtime": float(mtime), "sha1": None}
+    if hash_files and len(manifest) > 0:
+        out = connection.run_command("cd {} && find -L . -type f -print0 | xargs -0 -r sha1sum".format(quoted),
+                                     line_delimiter=None)
+        for line in out or []:
+            sha1, rel_path = line.split("  ", 1)
+            rel_path = rel_path[2:] if rel_path.startswith("./") else rel_path
+            if rel_path in manifest:
+                manifest[rel_path]["sha1"] = sha1
+    return manifest
+
+
+class ManifestCache(object):
+    """
+    On-disk cache of what was last uploaded to a remote folder, one json file per (server, remote path)
+    Each record also names the local folder it was uploaded from, the only folder whose hashes it may stand in for
+    """
+    max_entries_per_server = 200
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir if cache_dir is not None else get_cache_dir("manifests")
+
+    def _path(self, server, remote_path):
+        key = hashlib.sha1("{}:{}".format(server, remote_path.rstrip("/")).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "{}.json".format(key))
+
+    def load(self, server, remote_path):
+        fpath = self._path(server, remote_path)
+        if not os.path.isfile(fpath):
+            return None
+        try:
+            with open(fpath) as f:
+                return json.load(f)["files"]
+        except (ValueError, KeyError, OSError) as ex:
+            logger.warning("Ignoring broken manifest cache {}: {}".format(fpath, ex))
+            return None
+
+    def save(self, server, remote_path, manifest, local_path=None):
+        record = {"server": server,
+                  "remote_path": remote_path.rstrip("/"),
+                  "local_path": os.path.abspath(local_path) if local_path is not None else None,
+                  "created": time.time(),
+                  "files": manifest}
+        fpath = self._path(server, remote_path)
+        tmp_fpath = fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_fpath, fpath)
+        self._prune(server)
+
+    def remove(self, server, remote_path):
+        fpath = self._path(server, remote_path)
+        if os.path.isfile(fpath):
+            os.remove(fpath)
+
+    def records(self, server):
+        # newest first
+        out = []
+        for fpath in glob.glob(os.path.join(self.cache_dir, "*.json")):
+            try:
+                with open(fpath) as f:
+                    record = json.load(f)
+            except (ValueError, OSError):
+                continue
+            if record.get("server") == server:
+                out.append(record)
+        out.sort(key=lambda r: -r.get("created", 0))
+        return out
+
+    def local_hashes(self, server, local_path):
+        """
+        Manifest of the latest upload from a local folder, to reuse its hashes (see local_manifest)
+        Uploads of other folders are never used: their files can share relative paths, sizes
+        and mtimes with different content (eg: two copies of a testcase, one of them edited)
+        :param local_path: full path to local folder
+        :return: cached manifest, None if nothing was uploaded from local_path
+        """
+        local_path = os.path.abspath(local_path)
+        for record in self.records(server):
+            if record.get("local_path") == local_path:
+                return record["files"]
+        return None
+
+    def _prune(self, server):
+        for record in self.records(server)[self.max_entries_per_server:]:
+            self.remove(server, record["remote_path"])
+
+    def best_seed(self, server, manifest, exclude=None):
+        """
+        Find the cached remote folder sharing the most bytes with a local manifest
+        :return: (remote_path, cached manifest) or (None, None)
+        """
+        best, best_bytes = (None, None), 0
+        for record in self.records(server):
+            if record["remote_path"] == exclude:
+                continue
+            files = record["files"]
+            shared = sum(e["size"] for r, e in manifest.items()
+                         if r in files and files[r].get("sha1") == e["sha1"])
+            if shared > best_bytes:
+                best, best_bytes = (record["remote_path"], files), shared
+        return best
+
+
+class DeltaSync(object):
+    """
+    rsync-style folder upload: only files whose content changed since the last
+    upload cross the wire. What was uploaded is cached locally per remote path;
+    a brand-new remote path (every job gets its own folder) is seeded server-side
+    from the cached remote folder sharing the most content with the local one.
+    Seeded files are hashed on the server, since the earlier job may have changed them
+    in place. Every local folder is created on remote, empty ones included.
+    """
+
+    def __init__(self, connection, cache=None, workers=None, verify_hashes=False, delete=False):
+        """
+        :param connection: logged-in SSHConnection
+        :param cache: ManifestCache; default(None): ManifestCache()
+        :param workers: SFTP channels used to upload changed files; default(None): connection.transfer_workers
+        :param verify_hashes: hash files on remote instead of trusting cached hashes and remote sizes
+        :param delete: remove remote files that no longer exist locally
+        """
+        self.connection = connection
+        self.cache = cache if cache is not None else ManifestCache()
+        self.workers = workers if workers is not None else connection.transfer_workers
+        self.verify_hashes = verify_hashes
+        self.delete = delete
+
+    def upload_folder(self, local_folder_path, remote_folder_path):
+        """
+        local /A/B/C --> remote_folder_path/C
+        :param local_folder_path: full path to local folder
+        :param remote_folder_path: full path to remote parent folder
+        :return: dict of transfer statistics
+        """
+        start = time.time()
+        server = self.connection.server
+        remote_root = os.path.join(remote_folder_path, os.path.basename(local_folder_path))
+
+        baseline = self.cache.load(server, remote_root)
+        local = local_manifest(local_folder_path, previous=self.cache.local_hashes(server, local_folder_path))
+        seeded_from = None
+        if baseline is None:
+            seed_path, seed_files = self.cache.best_seed(server, local, exclude=remote_root)
+            if seed_path is not None:
+                baseline = self._seed(seed_path, seed_files, local, remote_root)
+                seeded_from = seed_path
+
+        remote = remote_manifest(self.connection, remote_root, hash_files=self.verify_hashes or baseline is None)
+        changed = []
+        for rel_path, entry in local.items():
+            r = remote.get(rel_path)
+            if r is None or r["size"] != entry["size"]:
+                changed.append(rel_path)
+            elif r["sha1"] is not None:
+                if r["sha1"] != entry["sha1"]:
+                    changed.append(rel_path)
+            elif baseline is None or baseline.get(rel_path, {}).get("sha1") != entry["sha1"]:
+                changed.append(rel_path)
+
+        transfer = ParallelSFTPTransfer(self.connection, self.workers)
+        # empty folders have no files to bring them along (eg: a model's output folder)
+        transfer.make_remote_dirs([remote_root] + [os.path.join(remote_root, d) for d in local_dirs(local_folder_path)])
+        if len(changed) > 0:
+            transfer.upload_files([(os.path.join(local_folder_path, r), os.path.join(remote_root, r))
+                                   for r in changed])
+
+        removed = [r for r in remote if r not in local] if self.delete else []
+        if len(removed) > 0:
+            self._remote_rm([os.path.join(remote_root, r) for r in removed])
+
+        self.cache.save(server, remote_root, local, local_path=local_folder_path)
+        uploaded_bytes = sum(local[r]["size"] for r in changed)
+        stats = {"files": len(local),
+                 "uploaded_files": len(changed),
+                 "uploaded_bytes": uploaded_bytes,
+                 "skipped_bytes": sum(e["size"] for e in local.values()) - uploaded_bytes,
+                 "removed_files": len(removed),
+                 "seeded_from": seeded_from,
+                 "seconds": time.time() - start}
+        logger.info("Delta upload {} to {}: {} of {} files, {:.1f} MB sent, {:.1f} MB skipped".format(
+            local_folder_path, remote_root, len(changed), len(local),
+            uploaded_bytes / 1e6, stats["skipped_bytes"] / 1e6))
+        return stats
+
+    def _seed(self, seed_path, seed_files, local, remote_root):
+        """
+        Copy unchanged files from an earlier upload into remote_root on the server
+        :return: manifest of the files that were seeded, with the sha1s of the copies
+        """
+        shared = sorted(r for r, e in local.items()
+                        if r in seed_files and seed_files[r].get("sha1") == e["sha1"])
+        logger.info("Seeding {} with {} unchanged files from {}".format(remote_root, len(shared), seed_path))
+        cmd = "mkdir -p {dst} && cd {src} && tar -c --null -T - -f - | tar -x -C {dst} -f -".format(
+            src=shlex.quote(seed_path), dst=shlex.quote(remote_root))
+        channel = self.connection.open_channel(cmd)
+        try:
+            channel.sendall("\0".join(shared).encode("utf-8"))
+            channel.shutdown_write()
+            exit_status = channel.recv_exit_status()
+        finally:
+            self.connection.close_channel(channel)
+        if exit_status != 0:
+            # seed folder purged or modified; whatever is missing gets uploaded
+            logger.warning("Seeding from {} incomplete (exit {})".format(seed_path, exit_status))
+            self.cache.remove(self.connection.server, seed_path)
+        # the cached hashes describe what was uploaded, not what the earlier job left there
+        hashes = remote_sha1(self.connection, remote_root, shared)
+        return {r: dict(seed_files[r], sha1=hashes.get(r)) for r in shared}
+
+    def _remote_rm(self, remote_paths, batch_size=200):
+        for i in range(0, len(remote_paths), batch_size):
+            batch = remote_paths[i:i + batch_size]
+            self.connection.run_command("rm -f {}".format(" ".join(shlex.quote(p) for p in batch)))
+
+
+def select_files(manifest, include=None, exclude=None, max_file_size=None, max_total_size=None,
+                 newest_first=False, limit=None):
+    """
+    Pick files out of a manifest
+    Glob patterns are matched against paths relative to the manifest root with
+    fnmatch, where '*' also matches '/': "*.nc" selects .nc files at any depth,
+    "regress_data/*" everything under regress_data.
+    :param manifest: {relative path: {"size": int, "mtime": float, ...}}, eg: from remote_manifest
+    :param include: glob or list of globs; default(None): every file
+    :param exclude: glob or list of globs removed from the selection
+    :param max_file_size: skip files larger than this many bytes
+    :param max_total_size: stop at the first file (in selection order) that would take the total past this many bytes
+    :param newest_first: order by mtime, newest first (applied before max_total_size/limit); default: by path
+    :param limit: keep at most this many files, applied after the size filters
+    :return: list of relative paths
+    """
+    include = [include] if isinstance(include, str) else include
+    exclude = [exclude] if isinstance(exclude, str) else (exclude or [])
+    selected = []
+    for rel_path, entry in manifest.items():
+        if include is not None and not any(fnmatch.fnmatch(rel_path, p) for p in include):
+            continue
+        if any(fnmatch.fnmatch(rel_path, p) for p in exclude):
+            continue
+        if max_file_size is not None and entry["size"] > max_file_size:
+            continue
+        selected.append(rel_path)
+    if newest_first:
+        selected.sort(key=lambda r: (-manifest[r]["mtime"], r))
+    else:
+        selected.sort()
+    if max_total_size is not None:
+        total = 0
+        capped = []
+        for rel_path in selected:
+            if total + manifest[rel_path]["size"] > max_total_size:
+                break
+            total += manifest[rel_path]["size"]
+            capped.append(rel_path)
+        selected = capped
+    if limit is not None:
+        selected = selected[:limit]
+    return selected
+
+
+class SelectiveDownload(object):
+    """
+    Download only the files of a remote folder that match include/exclude globs
+    and size limits. One 'find' on the server lists paths, sizes and mtimes, so
+    the expected transfer size is known (and logged) before anything is fetched;
+    the chosen files then come down over parallel SFTP channels.
+    """
+
+    def __init__(self, connection, workers=None):
+        """
+        :param connection: logged-in SSHConnection
+        :param workers: SFTP channels; default(None): connection.transfer_workers
+        """
+        self.connection = connection
+        self.workers = workers if workers is not None else connection.transfer_workers
+
+    def plan(self, remote_folder_path, **filters):
+        """
+        :param remote_folder_path: full path to remote folder
+        :param filters: see select_files
+        :return: dict with the remote manifest, selected relative paths and their total size
+        """
+        manifest = remote_manifest(self.connection, remote_folder_path)
+        if len(manifest) == 0:
+            # raises if the folder does not exist
+            with self.connection.sftp_session() as sftp:
+                sftp.stat(remote_folder_path)
+        selected = select_files(manifest, **filters)
+        plan = {"remote_folder_path": remote_folder_path,
+                "manifest": manifest,
+                "files": selected,
+                "total_files": len(manifest),
+                "total_bytes": sum(e["size"] for e in manifest.values()),
+                "selected_bytes": sum(manifest[r]["size"] for r in selected)}
+        logger.info("Selected {} of {} files in {}: {:.1f} MB of {:.1f} MB".format(
+            len(selected), plan["total_files"], remote_folder_path,
+            plan["selected_bytes"] / 1e6, plan["total_bytes"] / 1e6))
+        return plan
+
+    def download_folder(self, remote_folder_path, local_folder_path, dry_run=False, **filters):
+        """
+        remote /A/B/C --> local_folder_path/C, selected files only
+        :param remote_folder_path: full path to remote folder
+        :param local_folder_path: full path to local parent folder
+        :param dry_run: only plan, download nothing
+        :param filters: see select_files
+        :return: plan dict (see plan) with "downloaded_bytes" and "seconds" added
+        """
+        start = time.time()
+        plan = self.plan(remote_folder_path, **filters)
+        plan["downloaded_bytes"] = 0
+        if not dry_run and len(plan["files"]) > 0:
+            local_root = os.path.join(local_folder_path, os.path.basename(remote_folder_path))
+            transfer = ParallelSFTPTransfer(self.connection, self.workers)
+            plan["downloaded_bytes"] = transfer.download_files(
+                [(os.path.join(remote_folder_path, r), os.path.join(local_root, r)) for r in plan["files"]],
+                [plan["manifest"][r]["size"] for r in plan["files"]])
+        plan["seconds"] = time.time() - start
+        return plan
+
+
+def _run_remote_script(connection, script):
+    """
+    Feed a shell script to 'sh -s' on one exec channel
+    :return: (exit status, stdout lines, stderr text)
+    """
+    connection.touch()
+    channel = connection.open_channel("sh -s")
+    try:
+        channel.sendall(script.encode("utf-8"))
+        channel.shutdown_write()
+        out, err, exit_status = connection.drain_channel(channel)
+    finally:
+        connection.close_channel(channel)
+    out = out.splitlines()
+    return exit_status, out, err
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of input files on HPC scratch, shared by all jobs of a backend
+    Each distinct file is uploaded once as <store>/<sha1[:2]>/<sha1>[.x] (read-only,
+    '.x' for executables) and job folders get hard links to it. Files smaller than
+    link_min_size are copied out of the store instead of linked, so jobs can still
+    edit small config files in place without touching the shared copy.
+    Every upload records the blobs its job folder uses in <store>/.refs, so prune
+    keeps blobs that symlinked (or copied) job folders still need.
+    """
+    refs_folder_name = ".refs"
+
+    def __init__(self, connection, store_path, link_mode="hardlink", link_min_size=1024 * 1024,
+                 cache=None, workers=None):
+        """
+        :param connection: logged-in SSHConnection
+        :param store_path: full path to blob store folder on remote (eg: KeelingSBatchScript.remote_blob_store_folder_path)
+        :param link_mode: "hardlink" (falls back to copy across file systems), "symlink" or "copy"
+                          symlinks only resolve in singularity if the store is also bound into the container
+        :param link_min_size: files smaller than this are copied out of the store
+        :param cache: ManifestCache used to reuse local hashes; default(None): ManifestCache()
+        :param workers: SFTP channels used to upload missing blobs; default(None): connection.transfer_workers
+        """
+        if link_mode not in ("hardlink", "symlink", "copy"):
+            raise Exception("Unknown link_mode {}".format(link_mode))
+        self.connection = connection
+        self.store_path = store_path
+        self.link_mode = link_mode
+        self.link_min_size = link_min_size
+        self.cache = cache if cache is not None else ManifestCache()
+        self.workers = workers if workers is not None else connection.transfer_workers
+
+    @staticmethod
+    def blob_name(sha1, executable=False):
+        return os.path.join(sha1[:2], sha1 + (".x" if executable else ""))
+
+    def missing_blobs(self, blob_names):
+        """
+        :param blob_names: blob paths relative to the store
+        :return: set of blob names not yet in the store
+        """
+        lines = ["[ -e {} ] || echo {}".format(shlex.quote(os.path.join(self.store_path, b)), shlex.quote(b))
+                 for b in blob_names]
+        exit_status, out, err = _run_remote_script(self.connection, "\n".join(lines) + "\n")
+        if exit_status != 0:
+            raise Exception("Checking blob store {} failed: {}".format(self.store_path, err))
+        return set(out)
+
+    def upload_folder(self, local_folder_path, remote_folder_path):
+        """
+        local /A/B/C --> remote_folder_path/C, with file contents served from the blob store
+        :param local_folder_path: full path to local folder
+        :param remote_folder_path: full path to remote parent folder
+        :return: dict of transfer statistics
+        """
+        start = time.time()
+        server = self.connection.server
+        remote_root = os.path.join(remote_folder_path, os.path.basename(local_folder_path))
+        local = local_manifest(local_folder_path, previous=self.cache.local_hashes(server, local_folder_path))
+
+        blobs = {}
+        for rel_path, entry in local.items():
+            executable = os.access(os.path.join(local_folder_path, rel_path), os.X_OK)
+            blobs[rel_path] = self.blob_name(entry["sha1"], executable)
+        missing = self.missing_blobs(sorted(set(blobs.values())))
+
+        # upload missing blobs under temporary names; published by an atomic mv below
+        uploads = {}
+        for rel_path, blob in sorted(blobs.items()):
+            if blob in missing and blob not in uploads:
+                uploads[blob] = (os.path.join(local_folder_path, rel_path),
+                                 os.path.join(self.store_path, "{}.part-{}".format(blob, uuid.uuid4().hex[:8])))
+        if len(uploads) > 0:
+            transfer = ParallelSFTPTransfer(self.connection, self.workers)
+            transfer.make_remote_dirs(sorted({os.path.dirname(p[1]) for p in uploads.values()}))
+            transfer.upload_files(list(uploads.values()))
+
+        q = shlex.quote
+        lines = ["fail=0"]
+        for blob, (_, tmp_path) in uploads.items():
+            lines.append("mv -f {tmp} {b} && chmod {m} {b} || fail=1".format(
+                tmp=q(tmp_path), b=q(os.path.join(self.store_path, blob)),
+                m="555" if blob.endswith(".x") else "444"))
+        # empty folders have no files to bring them along (eg: a model's output folder)
+        dirs = sorted({os.path.dirname(r) for r in local} | set(local_dirs(local_folder_path)) | {""})
+        lines.append("mkdir -p {} || exit 1".format(" ".join(q(os.path.join(remote_root, d)) for d in dirs)))
+        # references of this job folder: its path, then one blob per line
+        refs_folder_path = os.path.join(self.store_path, self.refs_folder_name)
+        refs_fpath = os.path.join(refs_folder_path, hashlib.sha1(remote_root.encode("utf-8")).hexdigest())
+        lines.append("mkdir -p {} && cat > {} <<'__CYBERGIS_REFS__' || fail=1".format(q(refs_folder_path),
+                                                                                 q(refs_fpath)))
+        lines.extend([remote_root] + sorted(set(blobs.values())) + ["__CYBERGIS_REFS__"])
+        for rel_path, blob in sorted(blobs.items()):
+            source = q(os.path.join(self.store_path, blob))
+            target = q(os.path.join(remote_root, rel_path))
+            copy = "{{ cp -f {s} {t} && chmod u+w {t}; }}".format(s=source, t=target)
+            if self.link_mode == "copy" or local[rel_path]["size"] < self.link_min_size:
+                lines.append("{} || fail=1".format(copy))
+            elif self.link_mode == "symlink":
+                lines.append("ln -sf {s} {t} || fail=1".format(s=source, t=target))
+            else:
+                lines.append("ln -f {s} {t} 2>/dev/null || {c} || fail=1".format(s=source, t=target, c=copy))
+        lines.append("exit $fail")
+        exit_status, out, err = _run_remote_script(self.connection, "\n".join(lines) + "\n")
+        if exit_status != 0:
+            raise Exception("Linking {} from blob store {} failed: {}".format(remote_root, self.store_path, err))
+        # lets later uploads of this folder reuse these hashes
+        self.cache.save(server, remote_root, local, local_path=local_folder_path)
+
+        uploaded_bytes = sum(os.path.getsize(p[0]) for p in uploads.values())
+        stats = {"files": len(local),
+                 "uploaded_blobs": len(uploads),
+                 "uploaded_bytes": uploaded_bytes,
+                 "deduplicated_bytes": sum(e["size"] for e in local.values()) - uploaded_bytes,
+                 "seconds": time.time() - start}
+        logger.info("Blob store upload {} to {}: {} new blobs, {:.1f} MB sent, {:.1f} MB deduplicated".format(
+            local_folder_path, remote_root, len(uploads), uploaded_bytes / 1e6, stats["deduplicated_bytes"] / 1e6))
+        return stats
+
+    def prune(self, days=30):
+        """
+        Remove blobs not touched for some days that no existing job folder uses:
+        not referenced by the .refs record of a job folder that still exists, and not hard linked
+        Records of job folders that were deleted are removed first.
+        :param days: minimum age in days
+        :return: number of blobs removed
+        """
+        script = """cd {store} || exit 1
+mkdir -p {refs}
+for f in {refs}/*; do
+    [ -f "$f" ] || continue
+    [ -d "$(head -n 1 "$f")" ] || rm -f "$f"
+done
+referenced=$(mktemp) && candidates=$(mktemp) || exit 1
+for f in {refs}/*; do [ -f "$f" ] && tail -n +2 "$f"; done | sort -u > "$referenced"
+find . -path ./{refs} -prune -o -type f -links 1 -mtime +{days} -print | sed 's|^[.]/||' | sort > "$candidates"
+comm -23 "$candidates" "$referenced" | while IFS= read -r blob; do rm -f "$blob" && echo "$blob"; done
+rm -f "$referenced" "$candidates"
+""".format(store=shlex.quote(self.store_path), refs=self.refs_folder_name, days=int(days))
+        exit_status, out, err = _run_remote_script(self.connection, script)
+        if exit_status != 0:
+            raise Exception("Pruning blob store {} failed: {}".format(self.store_path, err))
+        logger.info("Pruned {} blobs from {}".format(len(out), self.store_path))
+        return len(out)
@@ -0,0 +1,192 @@
+import threading
+import time
+import weakref
+
+from .utils import get_logger
+
+logger = get_logger()
+
+
+def sacct_state_to_status(state):
+    """
+    Map a Slurm job state as printed by sacct to the status used by jobs and supervisors
+    COMPLETED --> "C"; CANCELLED/FAILED/OUT_OF_MEMORY/TIMEOUT/REVOKED/NODE_FAIL/BOOT_FAIL/DEADLINE --> "ERROR";
+    others unchanged
+    """
+    if "COMPLETED" in state:
+        return "C"
+    for error_state in ("CANCELLED", "FAILED", "OUT_OF_MEMORY", "TIMEOUT", "REVOKED", "NODE_FAIL", "BOOT_FAIL",
+                        "DEADLINE"):
+        if error_state in state:
+            return "ERROR"
+    return state
+
+
+# compact state codes of squeue (Slurm) and qstat (PBS) --> sacct states
+SHORT_JOB_STATES = {
+    "PD": "PENDING", "CF": "PENDING", "RQ": "PENDING", "Q": "PENDING", "H": "PENDING", "W": "PENDING",
+    "R": "RUNNING", "CG": "RUNNING", "E": "RUNNING", "S": "SUSPENDED", "ST": "STOPPED",
+    "CD": "COMPLETED", "C": "COMPLETED", "F": "FAILED", "CA": "CANCELLED", "TO": "TIMEOUT",
+    "OOM": "OUT_OF_MEMORY", "NF": "NODE_FAIL", "BF": "BOOT_FAIL", "DL": "DEADLINE", "PR": "PREEMPTED",
+}
+
+
+def normalize_job_state(state):
+    """
+    Map a Slurm (sacct/squeue, long or compact) or PBS (qstat) job state to the status used by jobs
+    and supervisors: "C", "ERROR", or the sacct state (PENDING, RUNNING, ...)
+    eg: "CANCELLED by 1234" --> "ERROR", "PD" --> "PENDING", "CG" --> "RUNNING", "C" (PBS) --> "C"
+    """
+    words = state.strip().upper().split()
+    if len(words) == 0:
+        return "UNKNOWN"
+    state = words[0].rstrip("+")
+    state = SHORT_JOB_STATES.get(state, state)
+    if state == "COMPLETING":
+        state = "RUNNING"
+    return sacct_state_to_status(state)
+
+
+class JobStatusMonitor(object):
+    """
+    Status of every tracked job on one login node from a single sacct call per refresh:
+        monitor = get_job_status_monitor(connection)
+        monitor.status(remote_id)
+    Callers asking within refresh_seconds of the last query get the cached status, so
+    polling costs one command per host per refresh however many jobs and pollers there are.
+    Jobs reaching a final status are no longer queried.
+    """
+    # seconds statuses are served from cache before the next sacct call
+    refresh_seconds = 15
+    # a job sacct does not list yet reads as PENDING for this many seconds after it is tracked
+    # (slurmdbd lags behind sbatch), then as UNKNOWN once a successful query still does not list it
+    unknown_grace_seconds = 120
+    # job ids per sacct call
+    batch_size = 200
+    final_statuses = ("C", "ERROR")
+
+    def __init__(self, connection, refresh_seconds=None):
+        """
+        :param connection: logged-in connection to the login node
+        :param refresh_seconds: default(None): self.refresh_seconds
+        """
+        self.connection = connection
+        if refresh_seconds is not None:
+            self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # held for a whole query, so pollers finding the cache stale wait for one query instead of each running one
+        self._refresh_lock = threading.Lock()
+        # remote id --> {"status", "state", "tracked", "updated"}
+        self._jobs = {}
+        self.last_refresh = 0
+        self.queries = 0
+
+    def track(self, *remote_ids):
+        with self._lock:
+            for remote_id in remote_ids:
+                remote_id = str(remote_id)
+                if remote_id not in self._jobs:
+                    self._jobs[remote_id] = {"status": None, "state": None, "tracked": time.time(), "updated": None}
+
+    def untrack(self, *remote_ids):
+        with self._lock:
+            for remote_id in remote_ids:
+                self._jobs.pop(str(remote_id), None)
+
+    def _query(self, remote_ids):
+        """
+        :return: {remote id: sacct State}
+        """
+        agent = self.connection.get_agent()
+        if agent is not None:
+            return agent.sacct(remote_ids)
+        out = self.connection.run_command("sacct -j {} -X --parsable2 --noheader --format=JobID,State".format(
+            ",".join(remote_ids)), line_delimiter=None, raise_on_error=True, idempotent=True, priority="poll")
+        states = {}
+        for line in out or []:
+            if "|" in line:
+                job_id, state = line.split("|", 1)
+                states[job_id.strip()] = state
+        return states
+
+    def refresh(self, max_age=None):
+        """
+        Query the status of all tracked jobs that have not finished
+        A job sacct does not list is marked UNKNOWN only by a query that succeeded, once
+        unknown_grace_seconds passed; when a query fails the last known statuses are kept.
+        :param max_age: skip the query if the last one is younger than this many seconds; default(None): always query
+        """
+        with self._refresh_lock:
+            with self._lock:
+                if max_age is not None and time.time() - self.last_refresh < max_age:
+                    # another poller refreshed while this one waited
+                    return
+                remote_ids = [i for i, job in self._jobs.items() if job["status"] not in self.final_statuses]
+            for i in range(0, len(remote_ids), self.batch_size):
+                batch = remote_ids[i:i + self.batch_size]
+                try:
+                    states = self._query(batch)
+                except Exception as ex:
+                    # keep serving the last known statuses
+                    logger.warning("Job status query on {} failed: {}".format(self.connection.server, ex))
+                    continue
+                self.queries += 1
+                now = time.time()
+                with self._lock:
+                    for remote_id in batch:
+                        job = self._jobs.get(remote_id)
+                        if job is None:
+                            # untracked meanwhile
+                            continue
+                        if remote_id in states:
+                            status = normalize_job_state(states[remote_id])
+                            if status != job["status"]:
+                                logger.debug("Job {} status: {}".format(remote_id, status))
+                            job.update(status=status, state=states[remote_id], updated=now)
+                        elif job["status"] is None and now - job["tracked"] >= self.unknown_grace_seconds:
+                            logger.debug("Job {} is not known to sacct".format(remote_id))
+                            job.update(status="UNKNOWN", updated=now)
+            with self._lock:
+                self.last_refresh = time.time()
+
+    def _status(self, remote_id):
+        job = self._jobs.get(remote_id)
+        if job is None:
+            return "UNKNOWN"
+        # not listed yet, or no query succeeded since it was tracked
+        return job["status"] if job["status"] is not None else "PENDING"
+
+    def statuses(self, remote_ids, max_age=None):
+        """
+        :param remote_ids: job ids, tracked from now on
+        :param max_age: seconds a cached status may be old; default(None): self.refresh_seconds
+        :return: {remote id: "C", "ERROR", "PENDING", "RUNNING", ... or "UNKNOWN"}
+        """
+        remote_ids = [str(i) for i in remote_ids]
+        self.track(*remote_ids)
+        max_age = max_age if max_age is not None else self.refresh_seconds
+        with self._lock:
+            stale = any(self._jobs[i]["status"] not in self.final_statuses for i in remote_ids) \
+                    and time.time() - self.last_refresh >= max_age
+        if stale:
+            self.refresh(max_age=max_age)
+        with self._lock:
+            return {remote_id: self._status(remote_id) for remote_id in remote_ids}
+
+    def status(self, remote_id, max_age=None):
+        return self.statuses([remote_id], max_age=max_age)[str(remote_id)]
+
+
+_monitors = weakref.WeakKeyDictionary()
+_monitors_lock = threading.Lock()
+
+
+def get_job_status_monitor(connection):
+    """
+    :return: the JobStatusMonitor shared by all jobs using connection (the pool hands out one per login node and user)
+    """
+    with _monitors_lock:
+        monitor = _monitors.get(connection)
+        if monitor is None:
+            monitor = _monitors[connection] = JobStatusMonitor(connection)
+        return monitor
@@ -0,0 +1,205 @@
+import random
+import time
+
+from .monitor import normalize_job_state
+from .utils import get_logger
+
+logger = get_logger()
+
+
+def walltime_to_seconds(walltime):
+    """
+    :param walltime: Slurm time limit, eg: "02:00:00", "1-12:00:00", "30:00" or "45"
+    :return: seconds, None if walltime is empty
+    """
+    if not walltime:
+        return None
+    days, _, clock = str(walltime).rpartition("-")
+    parts = [int(p) for p in clock.split(":")]
+    if len(parts) == 1:
+        # minutes
+        seconds = parts[0] * 60
+    elif len(parts) == 2:
+        seconds = parts[0] * 60 + parts[1]
+    else:
+        seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return seconds + int(days or 0) * 86400
+
+
+class JobWaiter(object):
+    """
+    Waits for a submitted job to reach a final status, polling with state-aware backoff:
+    polls back off from pending_min_seconds to pending_max_seconds while the job is queued,
+    and from running_min_seconds to running_max_seconds while it runs, but never past the end
+    of its walltime and every near_end_seconds during the last near_end_fraction of it.
+    Every interval gets +/- jitter so many waiters do not poll in lockstep.
+    UNKNOWN (accounting does not list the job) is re-checked with recheck_func. By default it is
+    not final and the wait raises after max_unknown_polls UNKNOWN polls in a row; with
+    unknown_is_done=True a job neither accounting nor the recheck knows is taken as finished
+    (it aged out of sacct and squeue), the way the old fixed polling loops treated UNKNOWN.
+        status = JobWaiter(job.job_status, walltime_seconds=7200, on_status=print).wait()
+    """
+    pending_min_seconds = 10
+    pending_max_seconds = 300
+    running_min_seconds = 15
+    running_max_seconds = 120
+    near_end_seconds = 10
+    near_end_fraction = 0.1
+    # interval growth factor per poll without a status change
+    backoff = 1.5
+    jitter = 0.1
+    running_statuses = ("RUNNING",)
+    done_statuses = ("C",)
+    error_statuses = ("ERROR",)
+    unknown_statuses = ("UNKNOWN",)
+    max_unknown_polls = 10
+    # take UNKNOWN as done instead of raising
+    unknown_is_done = False
+
+    def __init__(self, status_func, walltime_seconds=None, on_status=None, on_poll=None, timeout=None,
+                 recheck_func=None, **kwargs):
+        """
+        :param status_func: function() returning the job status ("PENDING", "RUNNING", "C", "ERROR", ...)
+        :param walltime_seconds: job time limit, used to poll faster near the expected end; default(None): unknown
+        :param on_status: callback(status) called whenever the status changes
+        :param on_poll: callback(status, seconds until the next poll) called after every poll
+        :param timeout: raise if the job is not done after this many seconds; default(None): wait forever
+        :param recheck_func: function() asked for the status when status_func returns UNKNOWN (eg: squeue);
+                             default(None): poll status_func again
+        :param kwargs: override class attributes, eg: pending_max_seconds=600
+        """
+        self.status_func = status_func
+        self.walltime_seconds = walltime_seconds
+        self.on_status = on_status
+        self.on_poll = on_poll
+        self.timeout = timeout
+        self.recheck_func = recheck_func
+        for k, v in kwargs.items():
+            if not hasattr(self, k):
+                raise Exception("Unknown JobWaiter option: {}".format(k))
+            setattr(self, k, v)
+        self.polls = 0
+        # last polled status
+        self.status = None
+        self._start = None
+        self._status_since = None
+        self._polls_in_status = 0
+        self._unknown_polls = 0
+
+    @property
+    def final_statuses(self):
+        return self.done_statuses + self.error_statuses + (self.unknown_statuses if self.unknown_is_done else ())
+
+    def is_done(self, status):
+        """
+        :return: True if status is final and not an error, eg: to decide whether to download the output
+        """
+        return status in self.done_statuses or (self.unknown_is_done and status in self.unknown_statuses)
+
+    def next_interval(self, status, polls_in_status, seconds_in_status):
+        """
+        :param status: last polled status
+        :param polls_in_status: polls in a row that returned this status, 1 for the first
+        :param seconds_in_status: seconds since the status was first seen
+        :return: seconds to sleep before the next poll, before jitter
+        """
+        growth = self.backoff ** (polls_in_status - 1)
+        if status not in self.running_statuses:
+            return min(self.pending_min_seconds * growth, self.pending_max_seconds)
+        interval = min(self.running_min_seconds * growth, self.running_max_seconds)
+        if self.walltime_seconds:
+            remaining = self.walltime_seconds - seconds_in_status
+            if remaining <= self.walltime_seconds * self.near_end_fraction:
+                return self.near_end_seconds
+            # wake up when the near-end window starts
+            interval = min(interval, remaining - self.walltime_seconds * self.near_end_fraction)
+        return max(interval, self.near_end_seconds)
+
+    def poll(self):
+        """
+        Poll the status once
+        :return: seconds to sleep before the next poll (with jitter), None once the status is final (self.status)
+        """
+        now = time.time()
+        if self._start is None:
+            self._start = self._status_since = now
+        try:
+            new_status = self.status_func()
+            if new_status in self.unknown_statuses and self.recheck_func is not None:
+                new_status = self.recheck_func()
+        except Exception as ex:
+            logger.error("Got Error when Checking Job status: {}".format(ex))
+            new_status = self.status
+        self.polls += 1
+        self._unknown_polls = self._unknown_polls + 1 if new_status in self.unknown_statuses else 0
+        if not self.unknown_is_done and self._unknown_polls >= self.max_unknown_polls:
+            raise Exception("Job status still {} after {} polls".format(new_status, self._unknown_polls))
+        if new_status != self.status:
+            self.status, self._status_since, self._polls_in_status = new_status, time.time(), 0
+            if self.on_status is not None:
+                self.on_status(self.status)
+        self._polls_in_status += 1
+        if self.status in self.final_statuses:
+            return None
+        if self.timeout is not None and time.time() - self._start > self.timeout:
+            raise Exception("Job did not finish within {} seconds (last status {})".format(self.timeout, self.status))
+        interval = self.next_interval(self.status, self._polls_in_status, time.time() - self._status_since)
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.on_poll is not None:
+            self.on_poll(self.status, interval)
+        return interval
+
+    def wait(self):
+        """
+        :return: final status, one of done_statuses or error_statuses (or unknown_statuses with unknown_is_done)
+        """
+        while True:
+            interval = self.poll()
+            if interval is None:
+                return self.status
+            time.sleep(interval)
+
+
+def squeue_status(connection, remote_id):
+    """
+    Status of a job from squeue, which lists queued and running jobs even when accounting (sacct) lags or is down
+    :return: "PENDING", "RUNNING", ... or "UNKNOWN" if squeue does not list the job
+    """
+    out = connection.run_command("squeue -h -j {} -o %T".format(remote_id), line_delimiter=None,
+                                 idempotent=True, priority="poll")
+    if not out:
+        return "UNKNOWN"
+    return normalize_job_state(out[0])
+
+
+def wait_for_job(job, download=False, on_status=None, on_poll=None, timeout=None, **kwargs):
+    """
+    Wait for a submitted SlurmJob to finish, and download its output if it completed
+    UNKNOWN statuses are re-checked with squeue; the wait raises if the job stays unknown,
+    unless unknown_is_done=True: then the job is taken as completed and downloaded
+    :param job: submitted SlurmJob
+    :param download: call job.download() once the job is done
+    :param kwargs: JobWaiter options, eg: pending_max_seconds=600, unknown_is_done=True
+    :return: final status
+    """
+    def log_status(status):
+        logger.info("Job {} ({}) status: {}".format(job.local_id, job.remote_id, status))
+        if on_status is not None:
+            on_status(status)
+
+    sbatch_script = getattr(job, "sbatch_script", None)
+    walltime_seconds = walltime_to_seconds(getattr(sbatch_script, "walltime", None))
+    waiter = JobWaiter(job.job_status, walltime_seconds=walltime_seconds, on_status=log_status, on_poll=on_poll,
+                       timeout=timeout, recheck_func=lambda: squeue_status(job.connection, job.remote_id),
+                       **kwargs)
+    status = waiter.wait()
+    if waiter.is_done(status):
+        if status in waiter.unknown_statuses:
+            logger.warning("Job {} ({}) is no longer known to the scheduler, taking it as completed".format(
+                job.local_id, job.remote_id))
+        logger.info("Job completed: {}; {}".format(job.local_id, job.remote_id))
+        if download:
+            job.download()
+    else:
+        logger.error("Job status {}".format(status))
+    return status
@@ -0,0 +1,205 @@
+import atexit
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from .connection import SSHConnection
+from .utils import get_logger
+
+logger = get_logger()
+
+
+class _PoolEntry(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.last_checked = 0
+        # callers holding the connection through checkout/lease
+        self.leases = 0
+
+    @property
+    def idle_since(self):
+        return max(self.last_used, self.connection.last_activity)
+
+    @property
+    def in_use(self):
+        # leased, or an operation (transfer, command, ...) still has a channel or the SFTP session open
+        return self.leases > 0 or getattr(self.connection, "in_use", False)
+
+
+class SSHConnectionPool(object):
+    """
+    Process-wide pool of logged-in SSHConnection objects
+    One connection is kept per (server, user, auth) and shared by every job,
+    supervisor and UI asking for the same key (SSHConnection is safe to share
+    between threads). Dead connections are replaced on checkout and connections
+    unused for max_idle_seconds have their transport closed, unless they are in use:
+    leased with checkout/lease, or running an operation. An idle-closed connection
+    stays pooled and logs in again on its next operation, so callers may keep
+    what get_connection returned.
+        with get_connection_pool().lease(server, user_name, key_path=key_path) as con:
+            con.upload(...)
+    """
+    connection_class = SSHConnection
+
+    def __init__(self, max_idle_seconds=900, health_check_interval=30):
+        """
+        :param max_idle_seconds: log out connections idle for longer than this
+        :param health_check_interval: seconds between active probes of a pooled connection
+        """
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def make_key(server, user_name=None, user_pw=None, key_path=None):
+        auth = None
+        if key_path is not None:
+            auth = "key:{}".format(key_path)
+        elif user_pw is not None:
+            # never keep plain passwords in pool keys
+            auth = "pw:{}".format(hashlib.sha256(user_pw.encode("utf-8")).hexdigest())
+        return server, user_name, auth
+
+    def get_connection(self, server, user_name=None, user_pw=None, key_path=None, login=True, **kwargs):
+        """
+        Get a live connection for (server, user, auth), creating it on first use
+        :param server: login node hostname
+        :param user_name: remote user name
+        :param user_pw: password (used when key_path is None)
+        :param key_path: full path to private key
+        :param login: log in (or re-login) before returning, default(True)
+        :param kwargs: passed to the connection class when a new connection is created
+        :return: SSHConnection shared with other callers using the same key
+        """
+        key = self.make_key(server, user_name=user_name, user_pw=user_pw, key_path=key_path)
+        self.evict_idle(exclude=key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                con = self.connection_class(server,
+                                            user_name=user_name,
+                                            user_pw=user_pw,
+                                            key_path=key_path,
+                                            **kwargs)
+                entry = _PoolEntry(con)
+                self._entries[key] = entry
+                logger.debug("Connection pool: new connection to {} as {}".format(server, user_name))
+
+        with entry.lock:
+            con = entry.connection
+            if con.logged_in and not self._healthy(entry):
+                logger.warning("Connection pool: connection to {} as {} is dead, reconnecting".format(server,
+                                                                                                     user_name))
+                self._discard(con)
+            if login and not con.logged_in:
+                con.login()
+                entry.last_checked = time.time()
+            entry.last_used = time.time()
+        return con
+
+    def checkout(self, server, user_name=None, user_pw=None, key_path=None, **kwargs):
+        """
+        Same as get_connection, and keep the connection from idle eviction until checkin
+        :return: SSHConnection; give it back with checkin
+        """
+        con = self.get_connection(server, user_name=user_name, user_pw=user_pw, key_path=key_path, **kwargs)
+        key = self.make_key(server, user_name=user_name, user_pw=user_pw, key_path=key_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.connection is not con:
+                # evicted between get_connection and now; pool it again
+                entry = self._entries[key] = _PoolEntry(con)
+            entry.leases += 1
+        return con
+
+    def checkin(self, con):
+        """
+        Release a connection from checkout
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.connection is con:
+                    entry.leases = max(0, entry.leases - 1)
+                    entry.last_used = time.time()
+                    return
+
+    @contextmanager
+    def lease(self, server, user_name=None, user_pw=None, key_path=None, **kwargs):
+        """
+        checkout for the duration of a with block
+        """
+        con = self.checkout(server, user_name=user_name, user_pw=user_pw, key_path=key_path, **kwargs)
+        try:
+            yield con
+        finally:
+            self.checkin(con)
+
+    def _healthy(self, entry):
+        now = time.time()
+        probe = now - entry.last_checked > self.health_check_interval
+        alive = entry.connection.is_alive(probe=probe)
+        if alive and probe:
+            entry.last_checked = now
+        return alive
+
+    def _discard(self, con):
+        try:
+            con.logout()
+        except Exception as ex:
+            logger.debug("Connection pool: error closing connection to {}: {}".format(con.server, ex))
+
+    def evict_idle(self, exclude=None):
+        """
+        Close the transport of pooled connections idle for longer than max_idle_seconds; connections in use
+        are kept. Evicted connections stay in the pool and log in again when used.
+        :param exclude: pool key to keep regardless of idle time
+        :return: number of connections evicted
+        """
+        now = time.time()
+        with self._lock:
+            expired = [(k, e) for k, e in self._entries.items()
+                       if k != exclude and not e.in_use and now - e.idle_since > self.max_idle_seconds]
+        evicted = 0
+        for k, e in expired:
+            with e.lock:
+                # checked out or used since
+                if e.in_use or time.time() - e.idle_since <= self.max_idle_seconds:
+                    continue
+                if e.connection.logged_in:
+                    logger.info("Connection pool: closing idle connection to {} as {}".format(k[0], k[1]))
+                    try:
+                        e.connection.close_idle()
+                    except Exception as ex:
+                        logger.debug("Connection pool: error closing connection to {}: {}".format(k[0], ex))
+                    evicted += 1
+        return evicted
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for e in entries:
+            with e.lock:
+                if e.connection.logged_in:
+                    self._discard(e.connection)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = SSHConnectionPool()
+            atexit.register(_connection_pool.close_all)
+    return _connection_pool
@@ -0,0 +1,264 @@
+import functools
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from .utils import get_logger
+
+logger = get_logger()
+
+# lower is admitted first when operations queue for a busy login node
+PRIORITIES = {"submit": 0, "command": 1, "transfer": 2, "poll": 3}
+
+_context = threading.local()
+
+
+@contextmanager
+def rate_limit_user(user):
+    """
+    Account remote operations of this thread to a gateway user, for fairness between users sharing
+    one community account:
+        with rate_limit_user(hydroshare_user_name):
+            job.go()
+    """
+    previous = getattr(_context, "user", None)
+    _context.user = user
+    try:
+        yield
+    finally:
+        _context.user = previous
+
+
+def current_rate_limit_user():
+    return getattr(_context, "user", None)
+
+
+class TokenBucket(object):
+    """
+    Allows rate operations per second on average and bursts of up to burst operations
+    Not thread-safe: RateLimiter guards it
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        :return: 0 if a token was taken, else seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    """
+    Admission control for the remote operations of one login node, shared by every connection
+    to it in this process: at most max_concurrent operations and, on a budget of their own,
+    max_concurrent_transfers transfers run at once, and at most rate start per second (bursts
+    of burst). Long transfers therefore never hold the slots that submits and polls need.
+    Queued operations whose budget has room are admitted by priority (submit > command >
+    transfer > poll), then to the user with the fewest operations running, then first come
+    first served. Operations nested in an admitted one (the unzip of an upload, retries, ...)
+    run without queueing again.
+    """
+    # operations started per second on average; None: no rate limit
+    rate = 5.0
+    burst = 20
+    # operations other than transfers running at once
+    max_concurrent = 8
+    # uploads and downloads running at once
+    max_concurrent_transfers = 4
+    # log operations delayed longer than this many seconds
+    log_delay = 10
+
+    def __init__(self, server, rate=None, burst=None, max_concurrent=None, max_concurrent_transfers=None):
+        self.server = server
+        if rate is not None:
+            self.rate = rate
+        if burst is not None:
+            self.burst = burst
+        if max_concurrent is not None:
+            self.max_concurrent = max_concurrent
+        if max_concurrent_transfers is not None:
+            self.max_concurrent_transfers = max_concurrent_transfers
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+        self._waiting = []
+        self._in_flight = 0
+        self._transfers_in_flight = 0
+        self._user_in_flight = {}
+        self.metrics = {kind: {"calls": 0, "queued": 0, "delayed_seconds": 0.0, "max_delay": 0.0}
+                        for kind in PRIORITIES}
+
+    def configure(self, rate=None, burst=None, max_concurrent=None, max_concurrent_transfers=None):
+        """
+        Change the limits; rate=0 turns the rate limit off
+        """
+        with self._cond:
+            if rate is not None:
+                self.rate = rate
+            if burst is not None:
+                self.burst = burst
+            if max_concurrent is not None:
+                self.max_concurrent = max_concurrent
+            if max_concurrent_transfers is not None:
+                self.max_concurrent_transfers = max_concurrent_transfers
+            self._bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+            self._cond.notify_all()
+
+    def _has_room(self, kind):
+        if kind == "transfer":
+            return self._transfers_in_flight < self.max_concurrent_transfers
+        return self._in_flight < self.max_concurrent
+
+    def _next(self):
+        # waiters of a full budget do not hold up the others
+        admissible = [w for w in self._waiting if self._has_room(w[3])]
+        if len(admissible) == 0:
+            return None
+        return min(admissible, key=lambda w: (w[0], self._user_in_flight.get(w[2], 0), w[1]))
+
+    def acquire(self, kind="command", user=None):
+        """
+        Wait for a turn to start an operation; pair with release
+        :param kind: "submit", "command", "transfer" or "poll"
+        :param user: user the operation is accounted to
+        :return: seconds waited
+        """
+        waiter = (PRIORITIES[kind], next(self._seq), user, kind)
+        start = time.monotonic()
+        queued = False
+        with self._cond:
+            self._waiting.append(waiter)
+            try:
+                while True:
+                    wait = None
+                    if self._next() is waiter:
+                        wait = self._bucket.take() if self._bucket is not None else 0
+                        if wait == 0:
+                            break
+                    queued = True
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(waiter)
+            if kind == "transfer":
+                self._transfers_in_flight += 1
+            else:
+                self._in_flight += 1
+            self._user_in_flight[user] = self._user_in_flight.get(user, 0) + 1
+            delay = time.monotonic() - start
+            metrics = self.metrics[kind]
+            metrics["calls"] += 1
+            metrics["queued"] += 1 if queued else 0
+            metrics["delayed_seconds"] += delay
+            metrics["max_delay"] = max(metrics["max_delay"], delay)
+            # the next waiter may be admissible too
+            self._cond.notify_all()
+        if delay > self.log_delay:
+            logger.info("{} operation on {} for {} waited {:.1f}s for admission".format(kind, self.server,
+                                                                                   user, delay))
+        return delay
+
+    def release(self, user=None, kind="command"):
+        with self._cond:
+            if kind == "transfer":
+                self._transfers_in_flight -= 1
+            else:
+                self._in_flight -= 1
+            self._user_in_flight[user] -= 1
+            if self._user_in_flight[user] == 0:
+                del self._user_in_flight[user]
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, kind="command", user=None):
+        """
+        Run the block as one admitted operation; blocks nested in an admitted one in the same thread pass through
+        """
+        held = getattr(_context, "held", None)
+        if held is None:
+            held = _context.held = set()
+        if self.server in held:
+            yield
+            return
+        self.acquire(kind, user)
+        held.add(self.server)
+        try:
+            yield
+        finally:
+            held.discard(self.server)
+            self.release(user, kind)
+
+    def snapshot(self):
+        """
+        :return: {"in_flight", "transfers_in_flight", "waiting", "users",
+                  kind: {"calls", "queued", "delayed_seconds", "max_delay"}}
+        """
+        with self._cond:
+            out = {kind: dict(metrics) for kind, metrics in self.metrics.items()}
+            out.update(in_flight=self._in_flight, transfers_in_flight=self._transfers_in_flight,
+                       waiting=len(self._waiting), users=dict(self._user_in_flight))
+            return out
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(server, create=True):
+    """
+    :param create: create the RateLimiter with the default limits if the login node has none yet
+    :return: the RateLimiter of a login node, None if it has none and create is False
+    """
+    with _limiters_lock:
+        if server not in _limiters:
+            if not create:
+                return None
+            _limiters[server] = RateLimiter(server)
+        return _limiters[server]
+
+
+def configure_rate_limit(server, rate=None, burst=None, max_concurrent=None, max_concurrent_transfers=None):
+    """
+    Turn on admission control for a login node and set its limits; operations of connections to
+    other login nodes are not queued (see SSHConnection.rate_limiting), eg:
+        configure_rate_limit("keeling.earth.illinois.edu", rate=2, max_concurrent=4)
+    """
+    limiter = get_rate_limiter(server)
+    limiter.configure(rate=rate, burst=burst, max_concurrent=max_concurrent,
+                      max_concurrent_transfers=max_concurrent_transfers)
+    return limiter
+
+
+def rate_limit_snapshot():
+    """
+    :return: {server: RateLimiter.snapshot()}
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.server: limiter.snapshot() for limiter in limiters}
+
+
+def rate_limited(kind):
+    """
+    Decorator admitting every call of a connection method through connection.rate_limit;
+    a "priority" keyword argument of the call overrides kind
+    Not for generators: a suspended generator would hold its slot while the caller consumes it.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(connection, *args, **kwargs):
+            with connection.rate_limit(kwargs.get("priority") or kind):
+                return func(connection, *args, **kwargs)
+        return wrapper
+    return decorator
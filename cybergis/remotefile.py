@@ -0,0 +1,149 @@
+import io
+import threading
+from collections import OrderedDict
+
+from .utils import get_logger
+
+logger = get_logger()
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only, seekable file object backed by SFTP ranged reads
+    Reads are served from fixed-size blocks kept in an LRU cache; missing blocks
+    of one read are fetched together in a single pipelined request, so opening
+    one variable of a large netCDF/HDF5 file only moves the touched ranges.
+    Works wherever a binary file object is accepted, eg:
+        with job.open_remote_output("output/run_timestep.nc") as f:
+            ds = xarray.open_dataset(f, engine="h5netcdf")
+    The file holds its own SFTP channel (one of the connection's max_sessions) until closed.
+    """
+    block_size = 1024 * 1024
+    cache_blocks = 64
+
+    def __init__(self, connection, remote_fpath, block_size=None, cache_blocks=None):
+        """
+        :param connection: logged-in SSHConnection
+        :param remote_fpath: full path to remote file
+        :param block_size: bytes per cached block; default(None): self.block_size
+        :param cache_blocks: blocks kept in memory; default(None): self.cache_blocks
+        """
+        super().__init__()
+        self.connection = connection
+        self.remote_fpath = remote_fpath
+        if block_size is not None:
+            self.block_size = block_size
+        if cache_blocks is not None:
+            self.cache_blocks = cache_blocks
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._pos = 0
+        self.bytes_fetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        # set first: close() runs from __del__ even when opening failed
+        self._sftp = None
+        self._file = None
+        self._sftp = connection.open_sftp_channel()
+        try:
+            self._file = self._sftp.open(remote_fpath, "rb")
+            self.size = self._file.stat().st_size
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def name(self):
+        return self.remote_fpath
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("invalid whence ({})".format(whence))
+        if pos < 0:
+            raise ValueError("negative seek position {}".format(pos))
+        self._pos = pos
+        return pos
+
+    def _fetch(self, block_ids):
+        ranges = []
+        for i in block_ids:
+            start = i * self.block_size
+            ranges.append((start, min(self.block_size, self.size - start)))
+        self.connection.touch()
+        data = list(self._file.readv(ranges))
+        for i, chunk in zip(block_ids, data):
+            self._blocks[i] = chunk
+            self.bytes_fetched += len(chunk)
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def _read_range(self, start, length):
+        first = start // self.block_size
+        last = (start + length - 1) // self.block_size
+        block_ids = range(first, last + 1)
+        with self._lock:
+            if len(block_ids) > self.cache_blocks:
+                # larger than the cache: read straight through
+                self.misses += len(block_ids)
+                self.connection.touch()
+                self.bytes_fetched += length
+                return next(self._file.readv([(start, length)]))
+            missing = []
+            for i in block_ids:
+                if i in self._blocks:
+                    # mark as recently used so fetching the others cannot evict it
+                    self._blocks.move_to_end(i)
+                else:
+                    missing.append(i)
+            self.misses += len(missing)
+            self.hits += len(block_ids) - len(missing)
+            if len(missing) > 0:
+                self._fetch(missing)
+            parts = [self._blocks[i] for i in block_ids]
+        data = b"".join(parts)
+        offset = start - first * self.block_size
+        return data[offset:offset + length]
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        length = min(len(b), self.size - self._pos)
+        if length <= 0:
+            return 0
+        data = self._read_range(self._pos, length)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def readall(self):
+        return self.read(max(self.size - self._pos, 0))
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._file is not None:
+                    self._file.close()
+            finally:
+                if self._sftp is not None:
+                    self.connection.close_channel(self._sftp.get_channel())
+                self._file = self._sftp = None
+                self._blocks.clear()
+                logger.debug("Closed {}: {:.1f} MB fetched of {:.1f} MB, {} block hits, {} misses".format(
+                    self.remote_fpath, self.bytes_fetched / 1e6, self.size / 1e6, self.hits, self.misses))
+        super().close()
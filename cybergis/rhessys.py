@@ -214,12 +214,23 @@ class RHESSysKeelingJob(KeelingJob):
             _additional_parameter_dict=self.to_dict()
         )
 
-    def download(self):
-        self.connection.download(
-            os.path.join(self.remote_model_folder_path, "model/output"),
-            self.local_job_folder_path,
-            remote_is_folder=True,
-        )
+    def download(self, **filters):
+        """
+        :param filters: include/exclude/max_file_size/... (see SSHConnection.download_selected)
+                        to fetch only part of the output folder; default: whole folder
+        """
+        if len(filters) > 0:
+            self.connection.download_selected(
+                os.path.join(self.remote_model_folder_path, "model/output"),
+                self.local_job_folder_path,
+                **filters
+            )
+        else:
+            self.connection.download(
+                os.path.join(self.remote_model_folder_path, "model/output"),
+                self.local_job_folder_path,
+                remote_is_folder=True,
+            )
         self.connection.download(
             self.remote_slurm_out_file_path, self.local_job_folder_path
         )
@@ -1,11 +1,11 @@
 import os
-import time
 
 from .keeling import KeelingJob, KeelingSBatchScript
 from .comet import CometSBatchScript
 from .base import BaseScript
 from .utils import get_logger
-from .connection import SSHConnection
+from .pool import get_connection_pool
+from .polling import wait_for_job
 
 logger = get_logger()
 
@@ -465,12 +465,23 @@ class SummaKeelingJob(KeelingJob):
         camels_user_scripts.generate_script(local_folder_path=self.local_job_folder_path,
                                             _additional_parameter_dict=self.to_dict())
 
-    def download(self):
-        self.connection.download(
-            os.path.join(self.remote_model_folder_path, "output"),
-            self.local_job_folder_path,
-            remote_is_folder=True,
-        )
+    def download(self, **filters):
+        """
+        :param filters: include/exclude/max_file_size/... (see SSHConnection.download_selected)
+                        to fetch only part of the output folder; default: whole folder
+        """
+        if len(filters) > 0:
+            self.connection.download_selected(
+                os.path.join(self.remote_model_folder_path, "output"),
+                self.local_job_folder_path,
+                **filters
+            )
+        else:
+            self.connection.download(
+                os.path.join(self.remote_model_folder_path, "output"),
+                self.local_job_folder_path,
+                remote_is_folder=True,
+            )
         self.connection.download(
             self.remote_slurm_out_file_path, self.local_job_folder_path
         )
@@ -497,10 +508,10 @@ def SummaSubmission(workspace, mode_source_folder_path, nodes, wtime,
     if user is not None:
         user_name = user
 
-    con = SSHConnection(server_url,
-                        user_name=user_name,
-                        key_path=key,
-                        user_pw=passwd)
+    con = get_connection_pool().get_connection(server_url,
+                                               user_name=user_name,
+                                               key_path=key,
+                                               user_pw=passwd)
 
     summa_sbatch = SummaSBatchScriptClass(wtime, nodes)
 
@@ -511,17 +522,6 @@ def SummaSubmission(workspace, mode_source_folder_path, nodes, wtime,
                         file_manager_rel_path=file_manager_rel_path)
     job.go()
 
-    for i in range(600):
-        time.sleep(3)
-        status = job.job_status()
-        if status == "ERROR":
-            logger.info("Job status ERROR")
-            break
-        elif status == "C" or status == "UNKNOWN":
-            logger.info("Job completed: {}; {}".format(job.local_id, job.remote_id))
-            job.download()
-            break
-        else:
-            logger.info(status)
+    wait_for_job(job, download=True, unknown_is_done=True)
     logger.info("Done")
     return job.local_job_folder_path
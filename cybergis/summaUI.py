@@ -1,5 +1,4 @@
 import os
-import time
 
 import ipywidgets as widgets
 from IPython.display import display
@@ -13,6 +12,8 @@ from .keeling import *
 from .summa import *
 from .utils import *
 from .job import *
+from .pool import get_connection_pool
+from .polling import wait_for_job
 from .utils import get_logger
 
 logger = get_logger()
@@ -143,22 +144,26 @@ class HPCUI(summa_base, printnumber):
         if (self.model_name.lower() == "summa"):
             if (self.machine == "keeling"):
                 if (self.username == "cigi-gisolve"):
-                    self.keeling_con = SSHConnection("keeling.earth.illinois.edu",
-                                                     user_name="cigi-gisolve",
-                                                     key_path=self.private_key_path)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "keeling.earth.illinois.edu",
+                        user_name="cigi-gisolve",
+                        key_path=self.private_key_path)
                 else:
-                    self.keeling_con = SSHConnection("keeling.earth.illinois.edu",
-                                                     user_name=self.username,
-                                                     user_pw=self.user_pw)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "keeling.earth.illinois.edu",
+                        user_name=self.username,
+                        user_pw=self.user_pw)
             elif self.machine.lower() == "comet" or self.machine.lower() == "expanse":
                 if self.username == "cigi-gisolve":
-                    self.keeling_con = SSHConnection("login.expanse.sdsc.edu",
-                                                     user_name="cybergis",
-                                                     key_path=self.private_key_path)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "login.expanse.sdsc.edu",
+                        user_name="cybergis",
+                        key_path=self.private_key_path)
                 else:
-                    self.keeling_con = SSHConnection("login.expanse.sdsc.edu",
-                                                     user_name=self.username,
-                                                     user_pw=self.user_pw)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "login.expanse.sdsc.edu",
+                        user_name=self.username,
+                        user_pw=self.user_pw)
             # else:
             #    print("Not implemented yet")
 
@@ -181,18 +186,7 @@ class HPCUI(summa_base, printnumber):
             sjob.go()
             self.job_local_id = sjob.local_id
             self.job_remote_id = sjob.remote_id
-            for i in range(600):
-                time.sleep(3)
-                status = sjob.job_status()
-                if status == "ERROR":
-                    logger.error("Job status ERROR")
-                    break
-                elif status == "C":
-                    logger.info("Job completed: {}; {}".format(sjob.local_id, sjob.remote_id))
-                    sjob.download()
-                    break
-                else:
-                    logger.info(status)
+            wait_for_job(sjob, download=True)
             logger.info("Done")
         elif (self.machine.lower() == "comet"):
             summa_sbatch = SummaCometSBatchScript(str(int(self.wt)), self.node, self.jobname)
@@ -201,18 +195,7 @@ class HPCUI(summa_base, printnumber):
             sjob.go()
             self.job_local_id = sjob.local_id
             self.job_remote_id = sjob.remote_id
-            for i in range(600):
-                time.sleep(3)
-                status = sjob.job_status()
-                if status == "ERROR":
-                    logger.error("Job status ERROR")
-                    break
-                elif status == "UNKNOWN":
-                    logger.info("Job completed: {}; {}".format(sjob.local_id, sjob.remote_id))
-                    sjob.download()
-                    break
-                else:
-                    logger.info(status)
+            wait_for_job(sjob, download=True, unknown_is_done=True)
             logger.info("Done")
 
     def goprintnumber(self):
@@ -379,22 +362,26 @@ class HPCSUMMA(HPCUI):
         if (self.model_name.lower() == "summa"):
             if (self.machine == "keeling"):
                 if (self.username == "cigi-gisolve"):
-                    self.keeling_con = SSHConnection("keeling.earth.illinois.edu",
-                                                     user_name="cigi-gisolve",
-                                                     key_path=self.private_key_path)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "keeling.earth.illinois.edu",
+                        user_name="cigi-gisolve",
+                        key_path=self.private_key_path)
                 else:
-                    self.keeling_con = SSHConnection("keeling.earth.illinois.edu",
-                                                     user_name=self.username,
-                                                     user_pw=self.user_pw)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "keeling.earth.illinois.edu",
+                        user_name=self.username,
+                        user_pw=self.user_pw)
             elif self.machine.lower() == "comet" or self.machine.lower() == "expanse":
                 if self.username == "cigi-gisolve":
-                    self.keeling_con = SSHConnection("login.expanse.sdsc.edu",
-                                                     user_name="cybergis",
-                                                     key_path=self.private_key_path)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "login.expanse.sdsc.edu",
+                        user_name="cybergis",
+                        key_path=self.private_key_path)
                 else:
-                    self.keeling_con = SSHConnection("login.expanse.sdsc.edu",
-                                                     user_name=self.username,
-                                                     user_pw=self.user_pw)
+                    self.keeling_con = get_connection_pool().get_connection(
+                        "login.expanse.sdsc.edu",
+                        user_name=self.username,
+                        user_pw=self.user_pw)
 
         try:
             self.node = para_json['node']
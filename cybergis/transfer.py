@@ -0,0 +1,446 @@
+import hashlib
+import json
+import os
+import queue
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import paramiko
+
+from .instrumentation import get_instrumentation
+from .utils import get_logger, get_cache_dir
+
+logger = get_logger()
+
+
+def list_remote_files(connection, remote_folder_path, with_mtime=False):
+    """
+    List regular files under a remote folder with one 'find' call
+    :param connection: logged-in SSHConnection
+    :param remote_folder_path: full path to remote folder
+    :param with_mtime: also return modification times
+    :return: list of (path relative to remote_folder_path, size), or (path, size, mtime) with with_mtime
+    """
+    files = []
+    for line in connection.iter_command("find -L {} -type f -printf '%s\\t%T@\\t%P\\n'".format(
+            shlex.quote(remote_folder_path))):
+        size, mtime, rel_path = line.split("\t", 2)
+        files.append((rel_path, int(size), float(mtime)) if with_mtime else (rel_path, int(size)))
+    if len(files) == 0:
+        # raises if the folder does not exist
+        with connection.sftp_session() as sftp:
+            sftp.stat(remote_folder_path)
+    return files
+
+
+class ParallelSFTPTransfer(object):
+    """
+    Move many files concurrently over several SFTP channels opened on the
+    transport of one logged-in SSHConnection. Each file is moved on an SFTP
+    channel checked out of a small pool; paramiko pipelines writes (put) and
+    prefetches reads (get) on it. Fewer channels than workers are used when the
+    connection's max_sessions slots are taken by other callers.
+    """
+
+    def __init__(self, connection, workers=4, max_concurrent_prefetch_requests=None):
+        """
+        :param connection: logged-in SSHConnection
+        :param workers: number of SFTP channels/threads
+        :param max_concurrent_prefetch_requests: cap on outstanding read requests per file
+                                                 default(None): paramiko default
+        """
+        self.connection = connection
+        self.workers = max(1, int(workers))
+        self.max_concurrent_prefetch_requests = max_concurrent_prefetch_requests
+        # SFTP channels used by the last transfer: at most workers, files and free session slots
+        self.channels = 0
+
+    def _open_channels(self, count):
+        # wait for the first channel only; take extra ones while slots are free
+        channels = queue.Queue()
+        channels.put(self.connection.open_sftp_channel())
+        for i in range(count - 1):
+            try:
+                channels.put(self.connection.open_sftp_channel(timeout=0))
+            except Exception as ex:
+                logger.debug("Parallel transfer continues with {} channels: {}".format(i + 1, ex))
+                break
+        return channels
+
+    def _close_channels(self, channels):
+        while not channels.empty():
+            sftp = channels.get()
+            try:
+                self.connection.close_channel(sftp.get_channel())
+            except Exception:
+                pass
+
+    def _put(self, sftp, local_fpath, remote_fpath):
+        sftp.put(local_fpath, remote_fpath)
+        return os.path.getsize(local_fpath)
+
+    def _get(self, sftp, remote_fpath, local_fpath):
+        kwargs = {}
+        if self.max_concurrent_prefetch_requests is not None:
+            kwargs["max_concurrent_prefetch_requests"] = self.max_concurrent_prefetch_requests
+        sftp.get(remote_fpath, local_fpath, prefetch=True, **kwargs)
+        return os.path.getsize(local_fpath)
+
+    @staticmethod
+    def _with_channel(channels, func, src, dst):
+        sftp = channels.get()
+        try:
+            return func(sftp, src, dst)
+        finally:
+            channels.put(sftp)
+
+    def _run(self, func, pairs, sizes=None):
+        """
+        Run func(sftp, source, target) for all pairs on the worker pool, largest files first
+        :return: total bytes moved
+        """
+        if sizes is not None:
+            pairs = [p for _, p in sorted(zip(sizes, pairs), key=lambda x: -x[0])]
+        total = 0
+        self.channels = 0
+        if len(pairs) == 0:
+            return total
+        self.connection.touch()
+        channels = self._open_channels(min(self.workers, len(pairs)))
+        self.channels = channels.qsize()
+        get_instrumentation().set_channels(self.channels)
+        executor = ThreadPoolExecutor(max_workers=self.channels)
+        try:
+            futures = {executor.submit(self._with_channel, channels, func, src, dst): src for src, dst in pairs}
+            for future in as_completed(futures):
+                total += future.result()
+                logger.debug("Transferred {}".format(futures[future]))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._close_channels(channels)
+            self.connection.touch()
+        get_instrumentation().add_bytes(total)
+        return total
+
+    def _log_summary(self, action, count, total, start):
+        elapsed = max(time.time() - start, 1e-6)
+        logger.info("{} {} files ({:.1f} MB) in {:.1f}s with {} channels ({:.1f} MB/s)".format(
+            action, count, total / 1e6, elapsed, self.channels, total / 1e6 / elapsed))
+
+    def upload_files(self, pairs):
+        """
+        Upload (local_fpath, remote_fpath) pairs; remote parent folders must exist
+        :return: total bytes uploaded
+        """
+        sizes = [os.path.getsize(p[0]) for p in pairs]
+        return self._run(self._put, pairs, sizes)
+
+    def download_files(self, pairs, sizes=None):
+        """
+        Download (remote_fpath, local_fpath) pairs, creating local parent folders
+        :return: total bytes downloaded
+        """
+        for _, local_fpath in pairs:
+            os.makedirs(os.path.dirname(local_fpath), exist_ok=True)
+        return self._run(self._get, pairs, sizes)
+
+    def upload_folder(self, local_folder_path, remote_folder_path):
+        """
+        local /A/B/C --> remote_folder_path/C
+        :param local_folder_path: full path to local folder
+        :param remote_folder_path: full path to remote parent folder
+        :return: total bytes uploaded
+        """
+        start = time.time()
+        folder_name = os.path.basename(local_folder_path)
+        remote_root = os.path.join(remote_folder_path, folder_name)
+        remote_dirs = [remote_root]
+        pairs = []
+        for root, dirs, files in os.walk(local_folder_path, followlinks=True):
+            rel = os.path.relpath(root, local_folder_path)
+            remote_dir = remote_root if rel == "." else os.path.join(remote_root, rel)
+            remote_dirs.extend(os.path.join(remote_dir, d) for d in dirs)
+            pairs.extend((os.path.join(root, f), os.path.join(remote_dir, f)) for f in files)
+        self.make_remote_dirs(remote_dirs)
+        total = self.upload_files(pairs)
+        self._log_summary("Uploaded", len(pairs), total, start)
+        return total
+
+    def download_folder(self, remote_folder_path, local_folder_path):
+        """
+        remote /A/B/C --> local_folder_path/C
+        :param remote_folder_path: full path to remote folder
+        :param local_folder_path: full path to local parent folder
+        :return: total bytes downloaded
+        """
+        start = time.time()
+        local_root = os.path.join(local_folder_path, os.path.basename(remote_folder_path))
+        pairs = []
+        sizes = []
+        for rel_path, size in self.list_remote_files(remote_folder_path):
+            pairs.append((os.path.join(remote_folder_path, rel_path), os.path.join(local_root, rel_path)))
+            sizes.append(size)
+        os.makedirs(local_root, exist_ok=True)
+        total = self.download_files(pairs, sizes)
+        self._log_summary("Downloaded", len(pairs), total, start)
+        return total
+
+    def make_remote_dirs(self, remote_dirs, batch_size=200):
+        # one 'mkdir -p' per batch instead of one SFTP round trip per folder
+        remote_dirs = list(remote_dirs)
+        for i in range(0, len(remote_dirs), batch_size):
+            batch = remote_dirs[i:i + batch_size]
+            self.connection.run_command("mkdir -p {}".format(" ".join(shlex.quote(d) for d in batch)),
+                                        raise_on_error=True)
+
+    def list_remote_files(self, remote_folder_path):
+        return list_remote_files(self.connection, remote_folder_path)
+
+
+class ResumableTransfer(object):
+    """
+    Move large files in chunks whose offsets and sha1s are checkpointed to disk,
+    so a dropped SSH session resumes from the last verified chunk instead of from zero.
+    Download checkpoints live next to the partial file (<local>.part.json);
+    upload checkpoints live in get_cache_dir("transfers").
+    Files are moved on connection.sftp_session(), so transfers in several threads never share an SFTPClient.
+    Only connection failures are retried, after connection.reconnect(); file errors on either
+    side (ENOSPC, EACCES, ...) are raised. Folder transfers skip files whose size and mtime
+    already match, and transferred files keep the mtime of their source.
+    """
+    # errors that are not worth reconnecting for
+    fatal_errors = (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)
+    # errors of the SSH transport or SFTP channel itself
+    connection_errors = (paramiko.SSHException, EOFError)
+
+    def __init__(self, connection, chunk_size=8 * 1024 * 1024, max_retries=5, retry_wait=5, checkpoint_dir=None):
+        """
+        :param connection: SSHConnection; reconnected when the session drops
+        :param chunk_size: bytes per checkpointed chunk
+        :param max_retries: reconnect attempts per file
+        :param retry_wait: seconds to wait before the first reconnect, doubled every attempt
+        :param checkpoint_dir: folder for upload checkpoints; default(None): get_cache_dir("transfers")
+        """
+        self.connection = connection
+        self.chunk_size = int(chunk_size)
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.checkpoint_dir = checkpoint_dir if checkpoint_dir is not None else get_cache_dir("transfers")
+
+    @staticmethod
+    def _load_checkpoint(fpath):
+        try:
+            with open(fpath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_checkpoint(fpath, checkpoint):
+        tmp_fpath = fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_fpath, fpath)
+
+    def _is_connection_error(self, ex):
+        if isinstance(ex, self.fatal_errors):
+            return False
+        if isinstance(ex, self.connection_errors):
+            return True
+        # any other OSError (socket errors included) is only a connection failure if the connection is gone;
+        # local disk errors and remote file errors on a working connection are not retried
+        return not self.connection.is_alive(probe=True)
+
+    def _retrying(self, func, *args):
+        wait = self.retry_wait
+        for attempt in range(self.max_retries + 1):
+            try:
+                if not self.connection.logged_in:
+                    self.connection.login()
+                return func(*args)
+            except (OSError, EOFError, paramiko.SSHException) as ex:
+                if attempt == self.max_retries or not self._is_connection_error(ex):
+                    raise
+                get_instrumentation().add_retry()
+                logger.warning("Transfer interrupted ({}); reconnecting to {} in {}s".format(
+                    ex, self.connection.server, wait))
+                time.sleep(wait)
+                wait *= 2
+                # replaces only a dead transport; other users of a pooled connection keep theirs
+                try:
+                    self.connection.reconnect()
+                except Exception as rex:
+                    logger.warning("Reconnecting to {} failed: {}".format(self.connection.server, rex))
+
+    def _resume_offset(self, checkpoint, size, mtime, part_size, read_chunk):
+        """
+        Offset to resume from: the end of the last chunk whose sha1 still matches
+        :param read_chunk: function(offset, length) returning the bytes already transferred
+        """
+        if checkpoint is None or checkpoint.get("size") != size or checkpoint.get("mtime") != mtime \
+                or checkpoint.get("chunk_size") != self.chunk_size:
+            return 0, []
+        chunks = checkpoint.get("chunks", [])
+        # writes may have been acknowledged out of step with the checkpoint
+        chunks = chunks[:min(len(chunks), part_size // self.chunk_size + (1 if part_size == size else 0))]
+        while len(chunks) > 0:
+            offset = (len(chunks) - 1) * self.chunk_size
+            data = read_chunk(offset, min(self.chunk_size, size - offset))
+            if hashlib.sha1(data).hexdigest() == chunks[-1]:
+                break
+            chunks.pop()
+        return min(len(chunks) * self.chunk_size, size), chunks
+
+    def download_file(self, remote_fpath, local_fpath):
+        """
+        remote file --> local file, resuming from <local_fpath>.part if a matching checkpoint exists
+        :return: bytes transferred in this call
+        """
+        nbytes = self._retrying(self._download_file, remote_fpath, local_fpath)
+        get_instrumentation().add_bytes(nbytes)
+        return nbytes
+
+    def _download_file(self, remote_fpath, local_fpath):
+        part_fpath = local_fpath + ".part"
+        checkpoint_fpath = part_fpath + ".json"
+        with self.connection.sftp_session() as sftp:
+            st = sftp.stat(remote_fpath)
+        size, mtime = st.st_size, st.st_mtime
+        os.makedirs(os.path.dirname(local_fpath), exist_ok=True)
+        part_size = os.path.getsize(part_fpath) if os.path.isfile(part_fpath) else 0
+
+        def read_local(offset, length):
+            with open(part_fpath, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        offset, chunks = self._resume_offset(self._load_checkpoint(checkpoint_fpath),
+                                             size, mtime, part_size, read_local)
+        if offset > 0:
+            logger.info("Resuming download of {} at {:.1f}/{:.1f} MB".format(remote_fpath, offset / 1e6, size / 1e6))
+        checkpoint = {"remote_path": remote_fpath, "size": size, "mtime": mtime,
+                      "chunk_size": self.chunk_size, "chunks": chunks}
+        start_offset = offset
+        with open(part_fpath, "r+b" if offset > 0 else "wb") as local_f, \
+                self.connection.sftp_session() as sftp:
+            local_f.truncate(offset)
+            local_f.seek(offset)
+            with sftp.open(remote_fpath, "rb") as remote_f:
+                remote_f.seek(offset)
+                remote_f.prefetch(size)
+                while offset < size:
+                    data = remote_f.read(min(self.chunk_size, size - offset))
+                    if len(data) == 0:
+                        raise EOFError("Unexpected end of {} at {}".format(remote_fpath, offset))
+                    local_f.write(data)
+                    local_f.flush()
+                    offset += len(data)
+                    checkpoint["chunks"].append(hashlib.sha1(data).hexdigest())
+                    self._save_checkpoint(checkpoint_fpath, checkpoint)
+                    self.connection.touch()
+        os.replace(part_fpath, local_fpath)
+        os.utime(local_fpath, (mtime, mtime))
+        os.remove(checkpoint_fpath)
+        return size - start_offset
+
+    def _upload_checkpoint_fpath(self, remote_fpath):
+        key = hashlib.sha1("{}:{}".format(self.connection.server, remote_fpath).encode("utf-8")).hexdigest()
+        return os.path.join(self.checkpoint_dir, "{}.json".format(key))
+
+    def upload_file(self, local_fpath, remote_fpath):
+        """
+        local file --> remote file, resuming <remote_fpath>.part if a matching checkpoint exists
+        :return: bytes transferred in this call
+        """
+        nbytes = self._retrying(self._upload_file, local_fpath, remote_fpath)
+        get_instrumentation().add_bytes(nbytes)
+        return nbytes
+
+    def _upload_file(self, local_fpath, remote_fpath):
+        with self.connection.sftp_session() as sftp:
+            return self._upload_file_on(sftp, local_fpath, remote_fpath)
+
+    def _upload_file_on(self, sftp, local_fpath, remote_fpath):
+        part_fpath = remote_fpath + ".part"
+        checkpoint_fpath = self._upload_checkpoint_fpath(remote_fpath)
+        st = os.stat(local_fpath)
+        size, mtime = st.st_size, st.st_mtime
+        try:
+            part_size = sftp.stat(part_fpath).st_size
+        except FileNotFoundError:
+            part_size = 0
+
+        def read_remote(offset, length):
+            with sftp.open(part_fpath, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        offset, chunks = self._resume_offset(self._load_checkpoint(checkpoint_fpath),
+                                             size, mtime, part_size, read_remote)
+        if offset > 0:
+            logger.info("Resuming upload of {} at {:.1f}/{:.1f} MB".format(local_fpath, offset / 1e6, size / 1e6))
+        checkpoint = {"local_path": local_fpath, "remote_path": remote_fpath, "size": size, "mtime": mtime,
+                      "chunk_size": self.chunk_size, "chunks": chunks}
+        start_offset = offset
+        with open(local_fpath, "rb") as local_f:
+            local_f.seek(offset)
+            # a resumed .part is never longer than the file, so anything past offset gets overwritten
+            with sftp.open(part_fpath, "r+b" if offset > 0 else "wb") as remote_f:
+                remote_f.seek(offset)
+                remote_f.set_pipelined(True)
+                while offset < size:
+                    data = local_f.read(min(self.chunk_size, size - offset))
+                    remote_f.write(data)
+                    offset += len(data)
+                    checkpoint["chunks"].append(hashlib.sha1(data).hexdigest())
+                    self._save_checkpoint(checkpoint_fpath, checkpoint)
+                    self.connection.touch()
+        sftp.posix_rename(part_fpath, remote_fpath)
+        sftp.utime(remote_fpath, (st.st_atime, mtime))
+        os.remove(checkpoint_fpath)
+        return size - start_offset
+
+    @staticmethod
+    def _same_file(st, size, mtime):
+        # SFTP carries whole seconds
+        return st.st_size == size and int(st.st_mtime) == int(mtime)
+
+    def download_folder(self, remote_folder_path, local_folder_path):
+        """
+        remote /A/B/C --> local_folder_path/C; files already complete locally (same size and mtime) are skipped
+        :return: bytes transferred in this call
+        """
+        local_root = os.path.join(local_folder_path, os.path.basename(remote_folder_path))
+        files = self._retrying(list_remote_files, self.connection, remote_folder_path, True)
+        total = 0
+        for rel_path, size, mtime in files:
+            local_fpath = os.path.join(local_root, rel_path)
+            if os.path.isfile(local_fpath) and self._same_file(os.stat(local_fpath), size, mtime):
+                continue
+            total += self.download_file(os.path.join(remote_folder_path, rel_path), local_fpath)
+        return total
+
+    def upload_folder(self, local_folder_path, remote_folder_path):
+        """
+        local /A/B/C --> remote_folder_path/C; files already complete on remote (same size and mtime) are skipped
+        :return: bytes transferred in this call
+        """
+        remote_root = os.path.join(remote_folder_path, os.path.basename(local_folder_path))
+        self._retrying(self.connection.run_command, "mkdir -p {}".format(shlex.quote(remote_root)))
+        remote_files = {rel_path: (size, mtime) for rel_path, size, mtime in
+                        self._retrying(list_remote_files, self.connection, remote_root, True)}
+        total = 0
+        for root, dirs, files in os.walk(local_folder_path, followlinks=True):
+            rel = os.path.relpath(root, local_folder_path)
+            remote_dir = remote_root if rel == "." else os.path.join(remote_root, rel)
+            if len(dirs) > 0:
+                self._retrying(self.connection.run_command, "mkdir -p {}".format(
+                    " ".join(shlex.quote(os.path.join(remote_dir, d)) for d in dirs)))
+            for f in files:
+                local_fpath = os.path.join(root, f)
+                rel_path = os.path.normpath(os.path.join(rel, f))
+                if rel_path in remote_files and self._same_file(os.stat(local_fpath), *remote_files[rel_path]):
+                    continue
+                total += self.upload_file(local_fpath, os.path.join(remote_dir, f))
+        return total
@@ -1,6 +1,7 @@
 import os
 import tempfile
 import shutil
+import zipfile
 import logging
 
 logger = logging.getLogger("cybergis")
@@ -16,17 +17,32 @@ def get_logger():
     return logger
 
 
+def get_cache_dir(*sub_folders):
+    """
+    Local folder for cybergis caches, created on first use
+    default: ~/.cybergis/cache, override with env CYBERGIS_CACHE_DIR
+    :param sub_folders: optional sub folder names under the cache folder
+    :return: full path to cache folder
+    """
+    cache_dir = os.getenv("CYBERGIS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cybergis", "cache"))
+    cache_dir = os.path.join(cache_dir, *sub_folders)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
 class UtilsMixin(object):
 
     def remove_newlines(self, in_str):
         out_str = in_str.replace("\r", "").replace("\n", "")
         return out_str
 
-    def zip_local_folder(self, local_dir, output_dir=None):
+    def zip_local_folder(self, local_dir, output_dir=None, compression_policy=None):
         """
         Zip up a local folder /A/B/C, output zip filename: C.zip
         :param local_dir: Path to a local folder: /A/B/C
         :param output_dir: where to put C.zip in; default(None): put C.zip in a random temp folder
+        :param compression_policy: CompressionPolicy choosing stored/deflated and level per file;
+                                   default(None): deflate everything
         :return: full path to output zip file C.zip
         """
         if not os.path.isdir(local_dir):
@@ -37,8 +53,23 @@ class UtilsMixin(object):
             output_fprefix = os.path.join(tempfile.mkdtemp(), folder_name)
         else:
             output_fprefix = os.path.join(output_dir, folder_name)
-        shutil.make_archive(output_fprefix, "zip", parent_path, folder_name)
         zip_fpath = output_fprefix + ".zip"
+        if compression_policy is None:
+            shutil.make_archive(output_fprefix, "zip", parent_path, folder_name)
+        else:
+            with zipfile.ZipFile(zip_fpath, "w", allowZip64=True) as zf:
+                for root, dirs, files in os.walk(local_dir):
+                    for d in sorted(dirs):
+                        dpath = os.path.join(root, d)
+                        zf.write(dpath, os.path.relpath(dpath, parent_path))
+                    for f in sorted(files):
+                        fpath = os.path.join(root, f)
+                        level = compression_policy.level(compression_policy.classify(fpath))
+                        if level == 0:
+                            zf.write(fpath, os.path.relpath(fpath, parent_path), compress_type=zipfile.ZIP_STORED)
+                        else:
+                            zf.write(fpath, os.path.relpath(fpath, parent_path),
+                                     compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
         logger.debug("Zipping folder {} to {}".format(local_dir, zip_fpath))
         return zip_fpath
 
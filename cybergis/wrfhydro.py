@@ -1,11 +1,11 @@
 import os
-import time
 
 from .keeling import KeelingJob, KeelingSBatchScript
 from .comet import CometSBatchScript
 from .base import BaseScript
 from .utils import get_logger
-from .connection import SSHConnection
+from .pool import get_connection_pool
+from .polling import wait_for_job
 
 logger = get_logger()
 
@@ -309,10 +309,10 @@ def WRFHydroSubmission(workspace, mode_source_folder_path, nodes, wtime,
     if user is not None:
         user_name = user
 
-    con = SSHConnection(server_url,
-                        user_name=user_name,
-                        key_path=key,
-                        user_pw=passwd)
+    con = get_connection_pool().get_connection(server_url,
+                                               user_name=user_name,
+                                               key_path=key,
+                                               user_pw=passwd)
 
     wrfhydro_sbatch = WRFHydroSBatchScriptClass(wtime, nodes)
 
@@ -322,17 +322,6 @@ def WRFHydroSubmission(workspace, mode_source_folder_path, nodes, wtime,
                            con, wrfhydro_sbatch)
     job.go()
 
-    for i in range(600):
-        time.sleep(3)
-        status = job.job_status()
-        if status == "ERROR":
-            logger.info("Job status ERROR")
-            break
-        elif status == "C" or status == "UNKNOWN":
-            logger.info("Job completed: {}; {}".format(job.local_id, job.remote_id))
-            job.download()
-            break
-        else:
-            logger.info(status)
+    wait_for_job(job, download=True, unknown_is_done=True)
     logger.info("Done")
     return job.local_job_folder_path
@@ -0,0 +1,18 @@
+import pytest
+
+from benchmarks.sshserver import LocalSSHServer
+
+
+@pytest.fixture(scope="session")
+def ssh_server():
+    with LocalSSHServer() as server:
+        yield server
+
+
+@pytest.fixture
+def connection(ssh_server):
+    # remote paths are local paths on the test server
+    conn = ssh_server.connection()
+    conn.login()
+    yield conn
+    conn.logout()
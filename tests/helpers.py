@@ -0,0 +1,31 @@
+import os
+
+
+def make_tree(folder_path, files, dirs=()):
+    """
+    :param files: {relative path: bytes}
+    :param dirs: relative paths of (empty) folders
+    """
+    for rel_path, data in files.items():
+        fpath = os.path.join(folder_path, rel_path)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, "wb") as f:
+            f.write(data)
+    for rel_path in dirs:
+        os.makedirs(os.path.join(folder_path, rel_path), exist_ok=True)
+    return folder_path
+
+
+def read_tree(folder_path):
+    """
+    :return: ({relative path: bytes}, set of relative folder paths)
+    """
+    files, dirs = {}, set()
+    for root, dirnames, filenames in os.walk(folder_path):
+        rel = os.path.relpath(root, folder_path)
+        for d in dirnames:
+            dirs.add(os.path.normpath(os.path.join(rel, d)))
+        for f in filenames:
+            with open(os.path.join(root, f), "rb") as fp:
+                files[os.path.normpath(os.path.join(rel, f))] = fp.read()
+    return files, dirs
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import stat
+
+import pytest
+
+from cybergis.asyncconnection import AsyncSSHConnection
+from cybergis.monitor import get_job_status_monitor
+
+from .helpers import make_tree, read_tree
+
+FAKE_SACCT = """#!/bin/sh
+# sacct -j <ids> ...: one "id|state" line per job with a state file
+for i in $(echo "$2" | tr ',' ' '); do
+    [ -f "$FAKE_SACCT_DIR/$i" ] && echo "$i|$(cat "$FAKE_SACCT_DIR/$i")"
+done
+exit 0
+"""
+
+
+def run(ssh_server, coroutine_func, **kwargs):
+    async def main():
+        async with AsyncSSHConnection(ssh_server.host, connection=ssh_server.connection(**kwargs)) as conn:
+            return await coroutine_func(conn)
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def fake_sacct(tmp_path, monkeypatch):
+    # commands on the test server run with this process' environment
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    sacct = bin_path / "sacct"
+    sacct.write_text(FAKE_SACCT)
+    sacct.chmod(sacct.stat().st_mode | stat.S_IEXEC)
+    states = tmp_path / "states"
+    states.mkdir()
+    monkeypatch.setenv("PATH", "{}:{}".format(bin_path, os.environ["PATH"]))
+    monkeypatch.setenv("FAKE_SACCT_DIR", str(states))
+    return states
+
+
+def test_run_command(ssh_server):
+    async def check(conn):
+        assert await conn.run_command("echo one; echo two", line_delimiter=None) == ["one", "two"]
+        assert await conn.run_command("true") is None
+        out, err, exit_status = await conn.exec_command("echo out; echo err >&2; exit 3")
+        assert (out, err, exit_status) == ("out\n", "err\n", 3)
+        with pytest.raises(Exception, match="boom"):
+            await conn.run_command("echo boom >&2", raise_on_error=True)
+    run(ssh_server, check)
+
+
+def test_concurrent_commands_beyond_session_limit(ssh_server):
+    async def check(conn):
+        outs = await asyncio.gather(*[conn.run_command("sleep 0.2; echo {}".format(i)) for i in range(12)])
+        assert outs == [str(i) for i in range(12)]
+        assert not conn.connection.in_use
+    run(ssh_server, check, max_sessions=3)
+
+
+def test_transfers(ssh_server, tmp_path):
+    files = {"a.txt": b"a" * 100, "sub/b.bin": os.urandom(50000)}
+    local = make_tree(str(tmp_path / "local" / "model"), files)
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    back = tmp_path / "back"
+    back.mkdir()
+
+    async def check(conn):
+        await asyncio.gather(conn.upload(local, str(remote), remote_is_folder=True),
+                             conn.run_command("echo busy"))
+        await conn.download(str(remote / "model"), str(back), remote_is_folder=True)
+    run(ssh_server, check)
+    assert read_tree(str(back / "model"))[0] == files
+
+
+def test_job_statuses(ssh_server, fake_sacct):
+    (fake_sacct / "1").write_text("RUNNING")
+    (fake_sacct / "2").write_text("COMPLETED")
+
+    async def check(conn):
+        assert await conn.job_statuses([1, 2, 3]) == {"1": "RUNNING", "2": "C", "3": "UNKNOWN"}
+        assert await conn.job_status(2) == "C"
+    run(ssh_server, check)
+
+
+def test_wait_for_job(ssh_server, fake_sacct):
+    (fake_sacct / "7").write_text("PENDING")
+    seen = []
+
+    def on_status(remote_id, status):
+        seen.append(status)
+        if status == "PENDING":
+            (fake_sacct / "7").write_text("RUNNING")
+        elif status == "RUNNING":
+            (fake_sacct / "7").write_text("COMPLETED")
+
+    async def check(conn):
+        get_job_status_monitor(conn.connection).refresh_seconds = 0
+        return await conn.wait_for_job(7, on_status=on_status, timeout=30, pending_min_seconds=0.05,
+                                       running_min_seconds=0.05, near_end_seconds=0.05)
+    assert run(ssh_server, check) == "C"
+    assert seen == ["PENDING", "RUNNING", "C"]
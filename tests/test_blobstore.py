@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+
+from cybergis.manifest import BlobStore, ManifestCache
+
+from .helpers import make_tree, read_tree
+
+FILES = {"a.txt": b"a" * 100,
+         "sub/b.txt": b"b" * 5000,
+         "sub/deep/c.bin": os.urandom(20000)}
+DIRS = ["output", "sub/empty"]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    (tmp_path / "cache").mkdir()
+    return ManifestCache(cache_dir=str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def model(tmp_path):
+    return make_tree(str(tmp_path / "local" / "model"), FILES, DIRS)
+
+
+@pytest.mark.parametrize("link_mode", ["hardlink", "symlink", "copy"])
+def test_blob_upload_round_trip(connection, cache, model, tmp_path, link_mode):
+    store = BlobStore(connection, str(tmp_path / "store"), link_mode=link_mode, link_min_size=1024, cache=cache)
+    stats = store.upload_folder(model, str(tmp_path / "job1"))
+    assert stats["uploaded_blobs"] == len(FILES)
+    stats = store.upload_folder(model, str(tmp_path / "job2"))
+    assert stats["uploaded_blobs"] == 0
+    for job in ("job1", "job2"):
+        assert read_tree(str(tmp_path / job / "model")) == read_tree(model)
+    # small files are copies the job may edit
+    small = str(tmp_path / "job1" / "model" / "a.txt")
+    assert not os.path.islink(small) and os.access(small, os.W_OK)
+
+
+def _age_blobs(store_path, days):
+    past = time.time() - days * 86400
+    for root, dirs, files in os.walk(store_path):
+        for f in files:
+            os.utime(os.path.join(root, f), (past, past))
+
+
+def test_blob_prune_keeps_referenced_blobs(connection, cache, model, tmp_path):
+    store_path = str(tmp_path / "store")
+    store = BlobStore(connection, store_path, link_mode="symlink", link_min_size=0, cache=cache)
+    store.upload_folder(model, str(tmp_path / "job1"))
+    _age_blobs(store_path, 40)
+    # symlinked blobs have one link, but job1 still uses them
+    assert store.prune(days=30) == 0
+    assert read_tree(str(tmp_path / "job1" / "model"))[0] == FILES
+
+    os.system("rm -rf {}".format(tmp_path / "job1"))
+    assert store.prune(days=30) == len(FILES)
+    assert os.listdir(os.path.join(store_path, BlobStore.refs_folder_name)) == []
+
+
+def test_blob_upload_rehashes_other_source_folders(connection, cache, tmp_path):
+    # same relative paths, sizes and mtimes, different content
+    first = make_tree(str(tmp_path / "first" / "model"), {"a.txt": b"a" * 100})
+    second = make_tree(str(tmp_path / "second" / "model"), {"a.txt": b"b" * 100})
+    mtime = os.stat(os.path.join(first, "a.txt")).st_mtime
+    os.utime(os.path.join(second, "a.txt"), (mtime, mtime))
+
+    store = BlobStore(connection, str(tmp_path / "store"), cache=cache)
+    store.upload_folder(first, str(tmp_path / "job1"))
+    assert store.upload_folder(second, str(tmp_path / "job2"))["uploaded_blobs"] == 1
+    assert read_tree(str(tmp_path / "job2" / "model")) == read_tree(second)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def small_connection(ssh_server):
+    # the main SFTP session holds one of the three slots
+    conn = ssh_server.connection(max_sessions=3)
+    conn.login()
+    yield conn
+    conn.logout()
+
+
+def test_slot_limit(small_connection):
+    channels = [small_connection.open_channel("sleep 5") for _ in range(2)]
+    with pytest.raises(Exception, match="sessions to .* are in use"):
+        small_connection.open_channel("true", timeout=0.2)
+    small_connection.close_channel(channels.pop())
+    channels.append(small_connection.open_channel("true", timeout=1))
+    for channel in channels:
+        small_connection.close_channel(channel)
+    assert not small_connection.in_use
+
+
+def test_closing_twice_frees_one_slot(small_connection):
+    channel = small_connection.open_channel("true")
+    small_connection.close_channel(channel)
+    small_connection.close_channel(channel)
+    channels = [small_connection.open_channel("sleep 5") for _ in range(2)]
+    with pytest.raises(Exception):
+        small_connection.open_channel("true", timeout=0.2)
+    for channel in channels:
+        small_connection.close_channel(channel)
+
+
+def test_concurrent_commands_share_the_transport(small_connection):
+    results = {}
+
+    def run(i):
+        results[i] = small_connection.run_command("sleep 0.2; echo {}".format(i))
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(12)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert results == {i: str(i) for i in range(12)}
+    # two at a time
+    assert time.time() - start >= 6 * 0.2
+    assert not small_connection.in_use
+
+
+def test_sftp_sessions_in_several_threads(small_connection, tmp_path):
+    for i in range(6):
+        (tmp_path / "{}.txt".format(i)).write_text(str(i) * 1000)
+    sizes = {}
+
+    def stat(i):
+        with small_connection.sftp_session() as sftp:
+            sizes[i] = sftp.stat(str(tmp_path / "{}.txt".format(i))).st_size
+    threads = [threading.Thread(target=stat, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert sizes == dict.fromkeys(range(6), 1000)
@@ -0,0 +1,53 @@
+import os
+import zipfile
+
+import pytest
+
+
+def test_run_commands_results_in_order(connection):
+    results = connection.run_commands(["echo one; echo two", "echo err >&2; exit 3", "true"])
+    assert [r.exit_code for r in results] == [0, 3, 0]
+    assert results[0].stdout == ["one", "two"]
+    assert results[1].stderr == ["err"]
+    assert results[0].output() == "onetwo"
+    assert results[2].output() is None
+
+
+def test_run_commands_isolates_commands(connection, tmp_path):
+    results = connection.run_commands(["cd {}; export FOO=bar".format(tmp_path), "pwd; echo x${FOO}x"])
+    assert results[1].stdout[1] == "xx"
+    assert results[1].stdout[0] != str(tmp_path)
+
+
+def test_run_commands_stop_on_error(connection):
+    results = connection.run_commands(["exit 1", "echo never"], stop_on_error=True)
+    assert results[0].exit_code == 1
+    assert results[1].exit_code is None and not results[1].ok
+
+
+def test_run_commands_raise_on_error(connection):
+    with pytest.raises(Exception, match="false"):
+        connection.run_commands(["true", "false"], raise_on_error=True)
+
+
+@pytest.mark.skipif(os.system("which unzip > /dev/null") != 0, reason="needs unzip")
+def test_upload_unzip_removes_zip(connection, tmp_path):
+    zip_fpath = str(tmp_path / "data.zip")
+    with zipfile.ZipFile(zip_fpath, "w") as z:
+        z.writestr("data/a.txt", "a")
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    connection.upload(zip_fpath, str(remote), remote_is_folder=True, unzip=True)
+    assert (remote / "data" / "a.txt").read_text() == "a"
+    assert not (remote / "data.zip").exists()
+
+
+@pytest.mark.skipif(os.system("which unzip > /dev/null") != 0, reason="needs unzip")
+def test_upload_failed_unzip_removes_zip(connection, tmp_path):
+    zip_fpath = str(tmp_path / "broken.zip")
+    with open(zip_fpath, "wb") as f:
+        f.write(b"not a zip")
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    connection.upload(zip_fpath, str(remote), remote_is_folder=True, unzip=True)
+    assert os.listdir(str(remote)) == []
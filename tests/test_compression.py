@@ -0,0 +1,78 @@
+import os
+import zipfile
+
+import pytest
+
+from cybergis.compression import FAST, STORE, STRONG, CompressionPolicy
+from cybergis.utils import UtilsMixin
+
+from .helpers import make_tree
+
+BIG = 512 * 1024
+
+
+@pytest.fixture
+def files(tmp_path):
+    return make_tree(str(tmp_path / "model"), {"text.txt": b"0.123 4.567\n" * (BIG // 12),
+                                              "random.bin": os.urandom(BIG),
+                                              "small.txt": b"small",
+                                              "archive.nc.gz": b"x" * BIG})
+
+
+def test_classify(files):
+    policy = CompressionPolicy(network_mbps=1)
+    assert policy.classify(os.path.join(files, "archive.nc.gz")) == STORE
+    assert policy.classify(os.path.join(files, "random.bin")) == STORE
+    # too small to be worth sampling
+    assert policy.classify(os.path.join(files, "small.txt")) == FAST
+    assert policy.classify(os.path.join(files, "text.txt")) in (FAST, STRONG)
+
+
+def test_network_speed_decides(files):
+    text = os.path.join(files, "text.txt")
+    assert CompressionPolicy(network_mbps=1e9).classify(text) == STORE
+    assert CompressionPolicy(network_mbps=1e-3).classify(text) == STRONG
+
+
+def test_classify_folder(files, tmp_path):
+    assert CompressionPolicy(network_mbps=1e-3).classify_folder(files) in (FAST, STRONG)
+    text = make_tree(str(tmp_path / "text"), {"a.txt": b"0.123 4.567\n" * (BIG // 12)})
+    assert CompressionPolicy(network_mbps=1e-3).classify_folder(text) == STRONG
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    assert CompressionPolicy().classify_folder(str(empty)) == FAST
+    incompressible = make_tree(str(tmp_path / "random"), {"a.bin": os.urandom(BIG)})
+    assert CompressionPolicy(network_mbps=1e-3).classify_folder(incompressible) == STORE
+
+
+def test_network_throughput_estimate():
+    policy = CompressionPolicy(network_mbps=100)
+    # too small to tell
+    policy.update_network_throughput(1000, 1)
+    assert policy.network_mbps == 100
+    policy.update_network_throughput(10 * 1000 * 1000, 8)
+    assert 10 < policy.network_mbps < 100
+
+
+def test_report():
+    report = CompressionPolicy().report("test", 2000000, 500000, 2, 1)
+    assert report["ratio"] == 0.25
+    assert report["raw_mb_per_s"] == 1.0
+    assert report["wire_mb_per_s"] == 0.25
+
+
+def test_zip_args():
+    args = CompressionPolicy(network_mbps=1e9).zip_args()
+    assert args.startswith("-0 -n ")
+    assert ".gz" in args.split(" ")[2].split(":")
+
+
+def test_zip_local_folder_per_file(files, tmp_path):
+    zip_fpath = UtilsMixin().zip_local_folder(files, str(tmp_path),
+                                              compression_policy=CompressionPolicy(network_mbps=1e-3))
+    with zipfile.ZipFile(zip_fpath) as zf:
+        types = {i.filename: i.compress_type for i in zf.infolist()}
+        assert zf.read("model/text.txt") == open(os.path.join(files, "text.txt"), "rb").read()
+    assert types["model/archive.nc.gz"] == zipfile.ZIP_STORED
+    assert types["model/random.bin"] == zipfile.ZIP_STORED
+    assert types["model/text.txt"] == zipfile.ZIP_DEFLATED
@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+from cybergis.manifest import DeltaSync, ManifestCache
+
+from .helpers import make_tree, read_tree
+
+FILES = {"a.txt": b"a" * 100,
+         "sub/b.txt": b"b" * 5000,
+         "sub/deep/c.bin": os.urandom(20000)}
+DIRS = ["output", "sub/empty"]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    (tmp_path / "cache").mkdir()
+    return ManifestCache(cache_dir=str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def model(tmp_path):
+    return make_tree(str(tmp_path / "local" / "model"), FILES, DIRS)
+
+
+def test_delta_upload_round_trip(connection, cache, model, tmp_path):
+    remote = str(tmp_path / "remote")
+    stats = DeltaSync(connection, cache=cache).upload_folder(model, remote)
+    assert stats["uploaded_files"] == len(FILES)
+    assert read_tree(os.path.join(remote, "model")) == read_tree(model)
+
+
+def test_delta_upload_sends_only_changes(connection, cache, model, tmp_path):
+    remote = str(tmp_path / "remote")
+    delta = DeltaSync(connection, cache=cache)
+    delta.upload_folder(model, remote)
+    assert delta.upload_folder(model, remote)["uploaded_files"] == 0
+
+    with open(os.path.join(model, "sub", "b.txt"), "wb") as f:
+        f.write(b"B" * 5000)
+    stats = delta.upload_folder(model, remote)
+    assert stats["uploaded_files"] == 1
+    assert stats["uploaded_bytes"] == 5000
+    assert read_tree(os.path.join(remote, "model")) == read_tree(model)
+
+
+def test_delta_upload_seeds_new_folder(connection, cache, model, tmp_path):
+    delta = DeltaSync(connection, cache=cache)
+    first = str(tmp_path / "job1")
+    delta.upload_folder(model, first)
+    # the first job edits one of its inputs in place
+    with open(os.path.join(first, "model", "a.txt"), "wb") as f:
+        f.write(b"x" * 100)
+
+    second = str(tmp_path / "job2")
+    stats = delta.upload_folder(model, second)
+    assert stats["seeded_from"] == os.path.join(first, "model")
+    assert stats["uploaded_files"] == 1
+    assert read_tree(os.path.join(second, "model")) == read_tree(model)
+
+
+def test_delta_upload_rehashes_other_source_folders(connection, cache, tmp_path):
+    # same relative paths, sizes and mtimes, different content
+    first = make_tree(str(tmp_path / "first" / "model"), {"a.txt": b"a" * 100})
+    second = make_tree(str(tmp_path / "second" / "model"), {"a.txt": b"b" * 100})
+    mtime = os.stat(os.path.join(first, "a.txt")).st_mtime
+    os.utime(os.path.join(second, "a.txt"), (mtime, mtime))
+
+    delta = DeltaSync(connection, cache=cache)
+    delta.upload_folder(first, str(tmp_path / "job1"))
+    stats = delta.upload_folder(second, str(tmp_path / "job2"))
+    assert stats["uploaded_files"] == 1
+    assert read_tree(str(tmp_path / "job2" / "model")) == read_tree(second)
+
+
+def test_cache_local_hashes(cache, tmp_path):
+    cache.save("host", "/remote/job1/model", {"a.txt": {"size": 1, "mtime": 0, "sha1": "x"}},
+               local_path=str(tmp_path / "model"))
+    cache.save("host", "/remote/job2/model", {"a.txt": {"size": 1, "mtime": 0, "sha1": "y"}})
+    assert cache.local_hashes("host", str(tmp_path / "model"))["a.txt"]["sha1"] == "x"
+    assert cache.local_hashes("host", str(tmp_path / "other")) is None
+    assert cache.local_hashes("other-host", str(tmp_path / "model")) is None
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture(params=[False, True], ids=["sftp", "agent"])
+def follow_connection(ssh_server, request):
+    conn = ssh_server.connection(use_agent=request.param)
+    conn.login()
+    yield conn
+    conn.logout()
+
+
+def _append(fpath, data):
+    with open(fpath, "ab") as f:
+        f.write(data)
+
+
+def test_read_new(follow_connection, tmp_path):
+    fpath = str(tmp_path / "slurm-1.out")
+    follower = follow_connection.follow(fpath)
+    # not written yet: the job is still pending
+    assert follower.read_new() == b""
+    _append(fpath, b"first\n")
+    assert follower.read_new() == b"first\n"
+    assert follower.read_new() == b""
+    _append(fpath, b"second\n")
+    assert follower.read_new() == b"second\n"
+    assert follower.offset == 13
+
+
+def test_partial_lines_wait(follow_connection, tmp_path):
+    fpath = str(tmp_path / "slurm-1.out")
+    _append(fpath, b"one\r\ntw")
+    follower = follow_connection.follow(fpath)
+    assert follower.read_new_lines() == ["one"]
+    _append(fpath, b"o\nthree")
+    assert follower.read_new_lines() == ["two"]
+
+
+def test_offset_none_skips_existing_output(follow_connection, tmp_path):
+    fpath = str(tmp_path / "slurm-1.out")
+    _append(fpath, b"old\n")
+    follower = follow_connection.follow(fpath, offset=None)
+    _append(fpath, b"new\n")
+    assert follower.read_new_lines() == ["new"]
+
+
+def test_truncated_file_is_read_from_start(follow_connection, tmp_path):
+    fpath = str(tmp_path / "slurm-1.out")
+    _append(fpath, b"a long first version\n")
+    follower = follow_connection.follow(fpath)
+    follower.read_new()
+    with open(fpath, "wb") as f:
+        f.write(b"rewritten\n")
+    assert follower.read_new_lines() == ["rewritten"]
+
+
+def test_max_read_size(follow_connection, tmp_path):
+    fpath = str(tmp_path / "slurm-1.out")
+    _append(fpath, b"x" * 100)
+    follower = follow_connection.follow(fpath, max_read_size=40)
+    assert [len(follower.read_new()) for _ in range(4)] == [40, 40, 20, 0]
+
+
+def test_follow_until_stopped(follow_connection, tmp_path):
+    fpath = str(tmp_path / "slurm-1.out")
+    done = threading.Event()
+
+    def job():
+        for i in range(5):
+            _append(fpath, "line {}\n".format(i).encode())
+            done.wait(0.05)
+        _append(fpath, b"no newline")
+        done.set()
+
+    writer = threading.Thread(target=job)
+    writer.start()
+    lines = list(follow_connection.follow(fpath).follow(poll_seconds=0.02, stop=done.is_set))
+    writer.join()
+    assert lines == ["line {}".format(i) for i in range(5)] + ["no newline"]
@@ -0,0 +1,92 @@
+import getpass
+import os
+import stat
+import time
+
+import pytest
+
+from cybergis.hostinfo import HostMetadataCache, discover_host_metadata
+
+FAKE_SINFO = """#!/bin/sh
+printf 'normal*\\ndebug\\nnormal*\\n'
+"""
+
+
+@pytest.fixture
+def cache(tmp_path):
+    (tmp_path / "hosts").mkdir()
+    return HostMetadataCache(cache_dir=str(tmp_path / "hosts"))
+
+
+@pytest.fixture
+def fake_sinfo(tmp_path, monkeypatch):
+    # commands on the test server run with this process' environment
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    sinfo = bin_path / "sinfo"
+    sinfo.write_text(FAKE_SINFO)
+    sinfo.chmod(sinfo.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", "{}:{}".format(bin_path, os.environ["PATH"]))
+
+
+def test_cache(cache):
+    metadata = {"home": "/home/a", "discovered": time.time()}
+    assert cache.load("host", "a") is None
+    cache.save("host", "a", metadata)
+    assert cache.load("host", "a") == metadata
+    assert cache.load("host", "b") is None
+    assert cache.load("other", "a") is None
+    cache.remove("host", "a")
+    assert cache.load("host", "a") is None
+
+
+def test_cache_expires(cache):
+    cache.save("host", "a", {"home": "/home/a", "discovered": time.time() - 100})
+    assert cache.load("host", "a") is not None
+    cache.ttl = 50
+    assert cache.load("host", "a") is None
+
+
+def test_broken_cache_file_is_ignored(cache):
+    cache.save("host", "a", {"home": "/home/a", "discovered": time.time()})
+    with open(cache._path("host", "a"), "w") as f:
+        f.write("{")
+    assert cache.load("host", "a") is None
+
+
+def test_discover(connection, fake_sinfo):
+    metadata = discover_host_metadata(connection)
+    assert metadata["home"] == os.path.expanduser("~")
+    assert metadata["user"] == getpass.getuser()
+    assert metadata["partitions"] == ["debug", "normal"]
+    assert metadata["default_partition"] == "normal"
+    assert isinstance(metadata["module"], bool) and isinstance(metadata["scratch"], list)
+
+
+def test_login_uses_cached_metadata(ssh_server, cache):
+    first = ssh_server.connection(host_metadata_cache=cache)
+    first.login()
+    first.logout()
+    metadata = cache.load(first.server, first.user_name)
+    assert metadata["home"] == first.remote_user_home
+
+    # a fresh entry is used without asking the server
+    cache.save(first.server, first.user_name, dict(metadata, home="/cached/home"))
+    second = ssh_server.connection(host_metadata_cache=cache)
+    second.login()
+    try:
+        assert second.remote_user_home == "/cached/home"
+        assert second.refresh_host_metadata()["home"] == metadata["home"]
+        assert cache.load(first.server, first.user_name)["home"] == metadata["home"]
+    finally:
+        second.logout()
+
+
+def test_login_rediscovers_expired_metadata(ssh_server, cache):
+    conn = ssh_server.connection(host_metadata_cache=cache)
+    cache.save(conn.server, conn.user_name, {"home": "/cached/home", "user": "cached", "discovered": 0})
+    conn.login()
+    try:
+        assert conn.remote_user_home == os.path.expanduser("~")
+    finally:
+        conn.logout()
@@ -0,0 +1,80 @@
+import pytest
+
+from cybergis.instrumentation import Histogram, Instrumentation, get_instrumentation
+
+from .helpers import make_tree
+
+
+@pytest.fixture
+def events():
+    # events of the operations run by one test
+    out = []
+    get_instrumentation().subscribe(out.append)
+    yield out
+    get_instrumentation().unsubscribe(out.append)
+
+
+def test_histogram():
+    histogram = Histogram((1, 2, 5))
+    assert histogram.percentile(50) is None
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.percentile(40) == 1
+    assert histogram.percentile(50) == 2
+    assert histogram.percentile(100) == 10
+    snapshot = histogram.snapshot()
+    assert (snapshot["count"], snapshot["min"], snapshot["max"]) == (5, 0.5, 10)
+    assert snapshot["buckets"]["+Inf"] == 1
+
+
+def test_measure_nested_and_errors():
+    instrumentation = Instrumentation()
+    seen = []
+    instrumentation.subscribe(seen.append)
+    # a failing subscriber does not break the operation or other subscribers
+    instrumentation.subscribe(lambda event: 1 / 0)
+    with instrumentation.measure("upload", "host", target="/a") as outer:
+        instrumentation.add_bytes(100)
+        with instrumentation.measure("remote_unzip", "host"):
+            instrumentation.add_retry()
+        assert instrumentation.current() is outer
+        instrumentation.set_channels(4)
+    with pytest.raises(ValueError):
+        with instrumentation.measure("upload", "host"):
+            raise ValueError("dropped")
+    assert instrumentation.current() is None
+
+    assert [(e["operation"], e["ok"]) for e in seen] == [("remote_unzip", True), ("upload", True), ("upload", False)]
+    assert seen[0]["retries"] == 1 and seen[0]["bytes"] == 0
+    assert (seen[1]["bytes"], seen[1]["channels"], seen[1]["target"]) == (100, 4, "/a")
+    assert seen[2]["error"] == "dropped"
+    snapshot = instrumentation.snapshot()
+    assert (snapshot["host upload"]["count"], snapshot["host upload"]["errors"]) == (2, 1)
+    assert snapshot["host upload"]["bytes"] == 100
+    assert snapshot["host remote_unzip"]["retries"] == 1
+    instrumentation.reset()
+    assert instrumentation.snapshot() == {}
+
+
+def test_connection_operations(connection, events, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "model"), {"a.txt": b"a" * 5000, "b.txt": b"b" * 3000})
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    connection.folder_transfer_mode = "parallel"
+    connection.upload(local, str(remote), remote_is_folder=True)
+    connection.run_command("echo hello")
+    operations = {e["operation"]: e for e in events}
+    upload = operations["upload"]
+    assert upload["server"] == connection.server and upload["target"] == local
+    assert upload["bytes"] == 8000 and upload["channels"] == 2 and upload["ok"]
+    assert operations["run_command"]["target"] == "echo hello"
+
+
+def test_zip_upload_records_remote_unzip(connection, events, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "model"), {"a.txt": b"a" * 5000})
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    connection.upload(local, str(remote), remote_is_folder=True, mode="zip")
+    assert [e["operation"] for e in events if e["operation"] in ("remote_unzip", "upload")] == \
+        ["remote_unzip", "upload"]
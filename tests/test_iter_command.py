@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+
+def test_lines(connection):
+    assert list(connection.iter_command("printf 'one\\r\\ntwo\\nlast'")) == ["one", "two", "last"]
+    assert list(connection.iter_command("true")) == []
+
+
+def test_chunks(connection):
+    data = b"".join(connection.iter_command("head -c 300000 /dev/zero", lines=False, chunk_size=4096))
+    assert data == b"\0" * 300000
+
+
+def test_output_larger_than_buffer(connection):
+    total = 0
+    for line in connection.iter_command("seq 1 200000", buffer_size=16 * 1024):
+        total += int(line)
+    assert total == 200000 * 200001 // 2
+
+
+def test_closing_early_stops_the_command(connection):
+    start = time.time()
+    lines = connection.iter_command("yes", buffer_size=16 * 1024)
+    for i, line in enumerate(lines):
+        if i == 10:
+            break
+    lines.close()
+    assert time.time() - start < 10
+    assert not connection.in_use
+
+
+def test_exit_status(connection):
+    command = "echo out; echo bad >&2; exit 2"
+    assert list(connection.iter_command(command)) == ["out"]
+    seen = []
+    with pytest.raises(Exception, match="bad"):
+        for line in connection.iter_command(command, raise_on_error=True):
+            seen.append(line)
+    # output comes first, the error after it
+    assert seen == ["out"]
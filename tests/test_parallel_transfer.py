@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from cybergis.transfer import ParallelSFTPTransfer
+
+from .helpers import make_tree, read_tree
+
+FILES = {"a.txt": b"a" * 1000, "sub/b.bin": os.urandom(300000), "sub/deeper/c.txt": b"", "d.txt": b"d"}
+
+
+@pytest.fixture
+def small_connection(ssh_server):
+    # the main SFTP session holds one of the three slots, leaving two channels
+    conn = ssh_server.connection(max_sessions=3)
+    conn.login()
+    yield conn
+    conn.logout()
+
+
+def test_upload_folder(connection, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "data"), FILES, dirs=["empty"])
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    transfer = ParallelSFTPTransfer(connection, workers=3)
+    assert transfer.upload_folder(local, str(remote)) == sum(len(v) for v in FILES.values())
+    assert transfer.channels == 3
+    assert read_tree(str(remote / "data")) == read_tree(local)
+
+
+def test_download_folder(connection, tmp_path):
+    remote = make_tree(str(tmp_path / "remote" / "data"), FILES)
+    local = tmp_path / "local"
+    local.mkdir()
+    transfer = ParallelSFTPTransfer(connection, workers=3)
+    assert transfer.download_folder(remote, str(local)) == sum(len(v) for v in FILES.values())
+    assert read_tree(str(local / "data"))[0] == read_tree(remote)[0]
+
+
+def test_channels_capped_by_files(connection, tmp_path):
+    remote = make_tree(str(tmp_path / "remote" / "data"), {"a.txt": b"a", "b.txt": b"b"})
+    local = tmp_path / "local"
+    local.mkdir()
+    transfer = ParallelSFTPTransfer(connection, workers=8)
+    transfer.download_folder(remote, str(local))
+    assert transfer.channels == 2
+    assert not connection.in_use
+
+
+def test_channels_capped_by_max_sessions(small_connection, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "data"), FILES)
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    transfer = ParallelSFTPTransfer(small_connection, workers=8)
+    transfer.upload_folder(local, str(remote))
+    assert transfer.channels == 2
+    assert read_tree(str(remote / "data"))[0] == FILES
+    assert not small_connection.in_use
+
+
+def test_empty_folder(connection, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "data"), {}, dirs=["sub"])
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    transfer = ParallelSFTPTransfer(connection, workers=4)
+    assert transfer.upload_folder(local, str(remote)) == 0
+    assert transfer.channels == 0
+    assert os.path.isdir(str(remote / "data" / "sub"))
+
+
+def test_parallel_folder_transfer_mode(ssh_server, tmp_path):
+    conn = ssh_server.connection(folder_transfer_mode="parallel", transfer_workers=3)
+    conn.login()
+    try:
+        local = make_tree(str(tmp_path / "local" / "data"), FILES)
+        remote = tmp_path / "remote"
+        remote.mkdir()
+        conn.upload(local, str(remote), remote_is_folder=True)
+        assert read_tree(str(remote / "data"))[0] == FILES
+        back = tmp_path / "back"
+        back.mkdir()
+        conn.download(str(remote / "data"), str(back), remote_is_folder=True)
+        assert read_tree(str(back / "data"))[0] == FILES
+    finally:
+        conn.logout()
@@ -0,0 +1,126 @@
+import pytest
+
+from cybergis.polling import JobWaiter, wait_for_job, walltime_to_seconds
+
+# no sleeping between polls
+FAST = dict(pending_min_seconds=0, running_min_seconds=0, near_end_seconds=0)
+
+
+def sequence(*statuses):
+    """
+    :return: status function returning statuses in turn, then the last one forever
+    """
+    statuses = list(statuses)
+
+    def status_func():
+        return statuses.pop(0) if len(statuses) > 1 else statuses[0]
+    return status_func
+
+
+@pytest.mark.parametrize("final", ["C", "ERROR"])
+def test_wait_returns_final_status(final):
+    seen = []
+    waiter = JobWaiter(sequence("PENDING", "PENDING", "RUNNING", final), on_status=seen.append, **FAST)
+    assert waiter.wait() == final
+    assert seen == ["PENDING", "RUNNING", final]
+    assert waiter.polls == 4
+
+
+def test_status_errors_keep_polling():
+    statuses = sequence("RUNNING", "C")
+    calls = []
+
+    def status_func():
+        calls.append(1)
+        if len(calls) == 2:
+            raise Exception("sacct timed out")
+        return statuses()
+    assert JobWaiter(status_func, **FAST).wait() == "C"
+    assert len(calls) == 3
+
+
+def test_unknown_is_rechecked():
+    rechecks = []
+
+    def recheck():
+        rechecks.append(1)
+        return "RUNNING" if len(rechecks) < 3 else "C"
+    waiter = JobWaiter(sequence("UNKNOWN"), recheck_func=recheck, **FAST)
+    assert waiter.wait() == "C"
+    assert len(rechecks) == 3
+
+
+def test_unknown_gives_up():
+    waiter = JobWaiter(sequence("UNKNOWN"), max_unknown_polls=3, **FAST)
+    with pytest.raises(Exception, match="UNKNOWN after 3 polls"):
+        waiter.wait()
+    assert waiter.polls == 3
+
+
+def test_unknown_is_done():
+    waiter = JobWaiter(sequence("RUNNING", "UNKNOWN"), unknown_is_done=True, max_unknown_polls=1, **FAST)
+    assert waiter.wait() == "UNKNOWN"
+    assert waiter.is_done("UNKNOWN") and waiter.is_done("C") and not waiter.is_done("ERROR")
+
+
+class FakeJob(object):
+    local_id = "local"
+    remote_id = "1001"
+    connection = None
+
+    def __init__(self, *statuses):
+        self.job_status = sequence(*statuses)
+        self.downloads = 0
+
+    def download(self):
+        self.downloads += 1
+
+
+def test_wait_for_job_downloads_finished_jobs():
+    job = FakeJob("RUNNING", "C")
+    assert wait_for_job(job, download=True, **FAST) == "C"
+    assert job.downloads == 1
+
+    job = FakeJob("RUNNING", "ERROR")
+    assert wait_for_job(job, download=True, **FAST) == "ERROR"
+    assert job.downloads == 0
+
+
+def test_wait_for_job_unknown_policy(monkeypatch):
+    monkeypatch.setattr("cybergis.polling.squeue_status", lambda connection, remote_id: "UNKNOWN")
+    job = FakeJob("RUNNING", "UNKNOWN")
+    # aged out of sacct and squeue: finished, get the output
+    assert wait_for_job(job, download=True, unknown_is_done=True, **FAST) == "UNKNOWN"
+    assert job.downloads == 1
+
+    job = FakeJob("RUNNING", "UNKNOWN")
+    with pytest.raises(Exception, match="still UNKNOWN"):
+        wait_for_job(job, download=True, max_unknown_polls=2, **FAST)
+    assert job.downloads == 0
+
+
+def test_timeout():
+    waiter = JobWaiter(sequence("PENDING"), timeout=0, **FAST)
+    with pytest.raises(Exception, match="did not finish"):
+        waiter.wait()
+
+
+def test_unknown_option():
+    with pytest.raises(Exception, match="Unknown JobWaiter option"):
+        JobWaiter(sequence("C"), pending_seconds=5)
+
+
+def test_next_interval_backs_off_and_speeds_up_near_end():
+    waiter = JobWaiter(sequence("C"), walltime_seconds=3600)
+    assert waiter.next_interval("PENDING", 1, 0) == waiter.pending_min_seconds
+    assert waiter.next_interval("PENDING", 50, 0) == waiter.pending_max_seconds
+    assert waiter.next_interval("RUNNING", 50, 0) == waiter.running_max_seconds
+    # wakes up when the last 10% of the walltime starts, then polls every near_end_seconds
+    assert waiter.next_interval("RUNNING", 50, 3200) == 40
+    assert waiter.next_interval("RUNNING", 50, 3300) == waiter.near_end_seconds
+
+
+@pytest.mark.parametrize("walltime, seconds", [("02:00:00", 7200), ("1-12:00:00", 129600), ("30:00", 1800),
+                                               ("45", 2700), ("", None), (None, None)])
+def test_walltime_to_seconds(walltime, seconds):
+    assert walltime_to_seconds(walltime) == seconds
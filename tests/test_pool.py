@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from cybergis.pool import SSHConnectionPool
+
+
+@pytest.fixture
+def pool(ssh_server):
+    pool = SSHConnectionPool(max_idle_seconds=0.2)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def get(pool, ssh_server):
+    def get_connection(user_name="alice", **kwargs):
+        return pool.get_connection(ssh_server.host, user_name, user_pw="secret", port=ssh_server.port,
+                                   host_metadata_cache=False, **kwargs)
+    return get_connection
+
+
+def test_one_connection_per_key(pool, get):
+    alice = get("alice")
+    assert get("alice") is alice
+    assert get("bob") is not alice
+    assert len(pool) == 2
+    assert all("secret" not in str(key) for key in pool._entries)
+
+
+def test_evicted_connection_logs_in_again(pool, get):
+    alice = get("alice")
+    time.sleep(0.3)
+    get("bob")
+    assert not alice.logged_in
+    # callers keep what get_connection returned
+    assert alice.run_command("echo back") == "back"
+    assert get("alice") is alice
+
+
+def test_leased_connection_is_not_evicted(pool, get, ssh_server):
+    with pool.lease(ssh_server.host, "alice", user_pw="secret", port=ssh_server.port,
+                    host_metadata_cache=False) as alice:
+        time.sleep(0.3)
+        assert pool.evict_idle() == 0
+        assert alice.logged_in
+    time.sleep(0.3)
+    assert pool.evict_idle() == 1
+
+
+def test_busy_connection_is_not_evicted(pool, get):
+    alice = get("alice")
+    channel = alice.open_channel("sleep 5")
+    try:
+        time.sleep(0.3)
+        assert pool.evict_idle() == 0
+        assert alice.logged_in
+    finally:
+        alice.close_channel(channel)
+
+
+def test_dead_connection_is_replaced(pool, get):
+    alice = get("alice")
+    alice.client.get_transport().close()
+    assert get("alice").run_command("echo alive") == "alive"
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from cybergis import ratelimit
+from cybergis.ratelimit import RateLimiter, configure_rate_limit, get_rate_limiter, rate_limit_user
+
+
+def _acquire_in_thread(limiter, kind, order, user=None):
+    def run():
+        limiter.acquire(kind, user)
+        order.append((kind, user))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    # queued before the next one
+    time.sleep(0.05)
+    return thread
+
+
+def test_priority_order():
+    limiter = RateLimiter("node", rate=None, max_concurrent=1)
+    limiter.acquire("command")
+    order = []
+    threads = [_acquire_in_thread(limiter, kind, order) for kind in ("poll", "command", "submit")]
+    for _ in threads:
+        limiter.release(kind="command")
+        time.sleep(0.1)
+    assert [kind for kind, _ in order] == ["submit", "command", "poll"]
+
+
+def test_fewest_running_user_first():
+    limiter = RateLimiter("node", rate=None, max_concurrent=2)
+    limiter.acquire("command", "alice")
+    limiter.acquire("command", "alice")
+    order = []
+    _acquire_in_thread(limiter, "command", order, "alice")
+    _acquire_in_thread(limiter, "command", order, "bob")
+    limiter.release("alice")
+    time.sleep(0.1)
+    assert order == [("command", "bob")]
+
+
+def test_transfers_do_not_hold_up_other_operations():
+    limiter = RateLimiter("node", rate=None, max_concurrent=1, max_concurrent_transfers=1)
+    limiter.acquire("transfer")
+    order = []
+    waiting_transfer = _acquire_in_thread(limiter, "transfer", order)
+    # the queued transfer ranks before polls but its budget is full
+    limiter.acquire("poll")
+    limiter.release(kind="poll")
+    limiter.acquire("submit")
+    assert order == []
+    limiter.release(kind="transfer")
+    waiting_transfer.join(1)
+    assert order == [("transfer", None)]
+    assert limiter.snapshot()["transfers_in_flight"] == 1
+
+
+def test_rate():
+    limiter = RateLimiter("node", rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire("command")
+        limiter.release()
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+    assert limiter.snapshot()["command"]["queued"] >= 3
+
+
+def test_nested_slots_pass_through():
+    limiter = RateLimiter("node", rate=None, max_concurrent=1)
+    with limiter.slot("transfer"):
+        with limiter.slot("command"):
+            assert limiter.snapshot()["in_flight"] == 0
+        assert limiter.snapshot()["transfers_in_flight"] == 1
+    assert limiter.snapshot()["transfers_in_flight"] == 0
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_limiters", {})
+
+
+def test_connections_queue_only_on_configured_nodes(limiters, connection, tmp_path):
+    connection.run_command("true")
+    assert get_rate_limiter(connection.server, create=False) is None
+
+    configure_rate_limit(connection.server, max_concurrent=2)
+    with rate_limit_user("gateway-user"):
+        connection.run_command("true")
+        connection.upload(__file__, str(tmp_path), remote_is_folder=True)
+    snapshot = get_rate_limiter(connection.server).snapshot()
+    assert snapshot["command"]["calls"] == 1
+    assert snapshot["transfer"]["calls"] == 1
+    assert snapshot["in_flight"] == 0 and snapshot["users"] == {}
+
+
+def test_rate_limiting_off(limiters, connection):
+    configure_rate_limit(connection.server)
+    connection.rate_limiting = False
+    connection.run_command("true")
+    assert get_rate_limiter(connection.server).snapshot()["command"]["calls"] == 0
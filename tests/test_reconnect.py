@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+
+def _drop(conn):
+    # the login node or the network closes the session
+    conn.client.get_transport().close()
+
+
+def test_dropped_connection_is_detected(connection):
+    assert connection.is_alive(probe=True)
+    _drop(connection)
+    assert not connection.logged_in
+    assert not connection.is_alive()
+
+
+def test_next_operation_reconnects(connection):
+    _drop(connection)
+    assert connection.run_command("echo back") == "back"
+    assert connection.logged_in
+
+
+def test_reconnect_keeps_a_working_transport(connection):
+    transport = connection.client.get_transport()
+    connection.reconnect()
+    assert connection.client.get_transport() is transport
+
+
+def test_idempotent_call_is_retried(connection):
+    connection.reconnect_wait = 0
+    calls = []
+
+    def status():
+        calls.append(1)
+        if len(calls) == 1:
+            _drop(connection)
+            raise EOFError("connection dropped")
+        return connection.run_command("echo ok")
+    assert connection.call_idempotent(status) == "ok"
+    assert len(calls) == 2
+
+
+def test_genuine_errors_are_not_retried(connection):
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError("bad input")
+    with pytest.raises(ValueError):
+        connection.call_idempotent(fail)
+    assert len(calls) == 1
+
+
+def test_waiter_for_a_slot_survives_reconnect(ssh_server):
+    # the main SFTP session and one channel take both slots
+    conn = ssh_server.connection(max_sessions=2)
+    conn.login()
+    try:
+        channel = conn.open_channel("sleep 30")
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(conn.run_command("echo waited")))
+        waiter.start()
+        waiter.join(0.5)
+        assert waiter.is_alive()
+
+        _drop(conn)
+        conn.reconnect()
+        conn.close_channel(channel)
+        waiter.join(10)
+        assert results == ["waited"]
+        # every slot is free again: the SFTP session holds one, the other opens
+        conn.close_channel(conn.open_channel("true", timeout=1))
+    finally:
+        conn.logout()
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+from cybergis.manifest import remote_manifest
+
+from .helpers import make_tree
+
+
+@pytest.fixture
+def agent_connection(ssh_server):
+    conn = ssh_server.connection(use_agent=True)
+    conn.login()
+    yield conn
+    conn.logout()
+
+
+def test_ping(agent_connection):
+    info = agent_connection.get_agent().ping()
+    assert info["pid"] > 0 and info["python"]
+
+
+def test_large_responses_keep_framing(agent_connection, tmp_path):
+    # responses far larger than one channel read, with newlines inside the data
+    data = os.urandom(3 * 1024 * 1024) + b"\n\n"
+    fpath = str(tmp_path / "big.bin")
+    with open(fpath, "wb") as f:
+        f.write(data)
+    agent = agent_connection.get_agent()
+    assert agent.tail(fpath, max_bytes=len(data)) == (data, len(data))
+    assert agent.tail(fpath, offset=len(data) - 2) == (b"\n\n", len(data))
+    assert agent.stat(fpath)["size"] == len(data)
+
+
+def test_names_with_newlines_and_unicode(agent_connection, tmp_path):
+    names = ["line\nbreak.txt", "ünïcødé.txt", 'quote"s.txt']
+    for name in names:
+        with open(os.path.join(str(tmp_path), name), "w") as f:
+            f.write(name)
+    agent = agent_connection.get_agent()
+    assert sorted(agent.list(str(tmp_path))) == sorted(names)
+    manifest = agent.manifest(str(tmp_path), hash_files=True)
+    assert sorted(manifest) == sorted(names)
+    assert all(e["sha1"] is not None for e in manifest.values())
+
+
+def test_error_response_leaves_agent_usable(agent_connection, tmp_path):
+    agent = agent_connection.get_agent()
+    with pytest.raises(Exception, match="Remote agent list failed"):
+        agent.list(str(tmp_path / "missing"))
+    assert agent.stat(str(tmp_path / "missing")) is None
+    assert agent.alive
+
+
+def test_stale_response_is_dropped(agent_connection):
+    agent = agent_connection.get_agent()
+    # a request whose caller gave up before its response arrived
+    agent.channel.sendall((json.dumps({"jsonrpc": "2.0", "id": 0, "method": "ping", "params": {}}) + "\n").encode())
+    assert agent.ping()["pid"] > 0
+    assert agent.alive
+
+
+def test_mismatched_response_restarts_agent(agent_connection):
+    agent = agent_connection.get_agent()
+    pid = agent.ping()["pid"]
+    agent.channel.sendall((json.dumps({"jsonrpc": "2.0", "id": 10 ** 6, "method": "ping", "params": {}})
+                           + "\n").encode())
+    with pytest.raises(Exception, match="answered request"):
+        agent.ping()
+    assert not agent.alive
+    # the connection starts a new agent on next use
+    assert agent_connection.get_agent().ping()["pid"] != pid
+
+
+def test_answers_match_shell_commands(agent_connection, connection, tmp_path):
+    folder = make_tree(str(tmp_path / "output"), {"a.txt": b"a", "sub/b.txt": b"bb", ".hidden": b"h"}, dirs=["empty"])
+    assert remote_manifest(agent_connection, folder, hash_files=True) == \
+        remote_manifest(connection, folder, hash_files=True)
+    assert remote_manifest(agent_connection, str(tmp_path / "missing")) == {}
+    assert agent_connection.remote_ls(folder) == connection.remote_ls(folder) == ["a.txt", "empty", "sub"]
+    # globs go to the shell
+    assert agent_connection.remote_ls(os.path.join(folder, "*.txt")) == [os.path.join(folder, "a.txt")]
+    agent = agent_connection.get_agent()
+    assert agent.stat(str(tmp_path / "missing")) is None
+    assert agent.stat(folder)["is_dir"]
+    hashes = agent.hash([os.path.join(folder, "a.txt"), folder])
+    assert hashes[os.path.join(folder, "a.txt")] == "86f7e437faa5a7fce15d1ddcb9eaeaea377667b8"
+    assert hashes[folder] is None
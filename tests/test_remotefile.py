@@ -0,0 +1,80 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+DATA = os.urandom(10 * 1000 + 7)
+
+
+@pytest.fixture
+def remote_fpath(tmp_path):
+    fpath = str(tmp_path / "run_timestep.nc")
+    with open(fpath, "wb") as f:
+        f.write(DATA)
+    return fpath
+
+
+def test_random_access(connection, remote_fpath):
+    with connection.open_remote(remote_fpath, block_size=1000, cache_blocks=4) as f:
+        assert f.size == len(DATA)
+        assert f.read(10) == DATA[:10]
+        f.seek(5500)
+        assert f.read(2000) == DATA[5500:7500]
+        f.seek(-7, io.SEEK_END)
+        assert f.read() == DATA[-7:]
+        assert f.read(10) == b""
+        f.seek(0)
+        assert f.read() == DATA
+
+
+def test_only_touched_blocks_are_fetched(connection, remote_fpath):
+    with connection.open_remote(remote_fpath, block_size=1000, cache_blocks=4) as f:
+        f.seek(3100)
+        f.read(100)
+        assert f.bytes_fetched == 1000
+        f.seek(3900)
+        f.read(200)
+        # block 3 is cached, block 4 is new
+        assert (f.hits, f.misses, f.bytes_fetched) == (1, 2, 2000)
+
+
+def test_cache_eviction(connection, remote_fpath):
+    with connection.open_remote(remote_fpath, block_size=1000, cache_blocks=2) as f:
+        for start in (0, 1000, 2000, 0):
+            f.seek(start)
+            f.read(10)
+        # block 0 was evicted by block 2
+        assert f.misses == 4
+        # reads larger than the cache bypass it
+        f.seek(0)
+        assert f.read(5000) == DATA[:5000]
+
+
+def test_buffered_reader(connection, remote_fpath):
+    with io.BufferedReader(connection.open_remote(remote_fpath, block_size=1000)) as f:
+        assert f.read(3) == DATA[:3]
+        assert f.peek(1)[:1] == DATA[3:4]
+
+
+def test_file_consumers(connection, tmp_path):
+    zip_fpath = str(tmp_path / "output.zip")
+    with zipfile.ZipFile(zip_fpath, "w") as z:
+        z.writestr("a.txt", "a" * 1000)
+        z.writestr("b.txt", "b")
+    with connection.open_remote(zip_fpath, block_size=256) as f:
+        with zipfile.ZipFile(f) as z:
+            assert z.read("b.txt") == b"b"
+
+
+def test_close_frees_the_channel(connection, remote_fpath, tmp_path):
+    f = connection.open_remote(remote_fpath)
+    assert connection.in_use
+    f.close()
+    f.close()
+    assert not connection.in_use
+    with pytest.raises(ValueError):
+        f.read(1)
+    with pytest.raises(IOError):
+        connection.open_remote(str(tmp_path / "missing.nc"))
+    assert not connection.in_use
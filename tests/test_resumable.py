@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+from cybergis.transfer import ResumableTransfer
+
+from .helpers import make_tree, read_tree
+
+CHUNK = 64 * 1024
+DATA = os.urandom(10 * CHUNK + 123)
+
+
+class _Interrupt(object):
+    """
+    _save_checkpoint replacement raising EOFError (a dropped session) once after some chunks
+    """
+
+    def __init__(self, after_chunks):
+        self.after_chunks = after_chunks
+        self.calls = 0
+
+    def __call__(self, fpath, checkpoint):
+        ResumableTransfer._save_checkpoint(fpath, checkpoint)
+        self.calls += 1
+        if self.calls == self.after_chunks:
+            raise EOFError("connection dropped")
+
+
+@pytest.fixture
+def transfer(connection, tmp_path):
+    (tmp_path / "checkpoints").mkdir()
+    return ResumableTransfer(connection, chunk_size=CHUNK, retry_wait=0,
+                             checkpoint_dir=str(tmp_path / "checkpoints"))
+
+
+@pytest.fixture
+def source(tmp_path):
+    fpath = str(tmp_path / "source.bin")
+    with open(fpath, "wb") as f:
+        f.write(DATA)
+    return fpath
+
+
+def _read(fpath):
+    with open(fpath, "rb") as f:
+        return f.read()
+
+
+def test_download_restarts_from_checkpoint(transfer, source, tmp_path):
+    target = str(tmp_path / "download" / "target.bin")
+    transfer.max_retries = 0
+    transfer._save_checkpoint = _Interrupt(4)
+    with pytest.raises(EOFError):
+        transfer.download_file(source, target)
+    assert os.path.getsize(target + ".part") == 4 * CHUNK
+
+    # a new transfer (eg: after a restart) resumes from the checkpoint
+    del transfer._save_checkpoint
+    assert transfer.download_file(source, target) == len(DATA) - 4 * CHUNK
+    assert _read(target) == DATA
+    assert int(os.stat(target).st_mtime) == int(os.stat(source).st_mtime)
+    assert not os.path.exists(target + ".part") and not os.path.exists(target + ".part.json")
+
+
+def test_download_refetches_corrupt_chunks(transfer, source, tmp_path):
+    target = str(tmp_path / "target.bin")
+    transfer.max_retries = 0
+    transfer._save_checkpoint = _Interrupt(4)
+    with pytest.raises(EOFError):
+        transfer.download_file(source, target)
+    with open(target + ".part", "r+b") as f:
+        f.seek(3 * CHUNK + 10)
+        f.write(b"corrupt")
+
+    del transfer._save_checkpoint
+    assert transfer.download_file(source, target) == len(DATA) - 3 * CHUNK
+    assert _read(target) == DATA
+
+
+def test_upload_restarts_from_checkpoint(transfer, source, tmp_path):
+    target = str(tmp_path / "target.bin")
+    transfer.max_retries = 0
+    transfer._save_checkpoint = _Interrupt(3)
+    with pytest.raises(EOFError):
+        transfer.upload_file(source, target)
+    assert os.path.getsize(target + ".part") == 3 * CHUNK
+
+    del transfer._save_checkpoint
+    assert transfer.upload_file(source, target) == len(DATA) - 3 * CHUNK
+    assert _read(target) == DATA
+
+
+def test_upload_retries_dropped_session(transfer, source, tmp_path):
+    target = str(tmp_path / "target.bin")
+    transfer._save_checkpoint = _Interrupt(5)
+    # the retry sends only what the dropped attempt did not
+    assert transfer.upload_file(source, target) == len(DATA) - 5 * CHUNK
+    assert _read(target) == DATA
+
+
+def test_missing_file_is_not_retried(transfer, tmp_path):
+    transfer.max_retries = 3
+    with pytest.raises(FileNotFoundError):
+        transfer.download_file(str(tmp_path / "missing.bin"), str(tmp_path / "target.bin"))
+
+
+def test_folder_transfer_skips_complete_files(transfer, tmp_path):
+    files = {"a.txt": b"a" * 10, "sub/b.bin": DATA}
+    local = make_tree(str(tmp_path / "local" / "model"), files)
+    remote = str(tmp_path / "remote")
+    assert transfer.upload_folder(local, remote) == len(DATA) + 10
+    assert read_tree(os.path.join(remote, "model"))[0] == files
+    assert transfer.upload_folder(local, remote) == 0
+
+    download = str(tmp_path / "download")
+    assert transfer.download_folder(os.path.join(remote, "model"), download) == len(DATA) + 10
+    assert read_tree(os.path.join(download, "model"))[0] == files
+    assert transfer.download_folder(os.path.join(remote, "model"), download) == 0
+
+
+def test_connection_resumable_mode(connection, source, tmp_path, monkeypatch):
+    # upload checkpoints go to the cache folder
+    monkeypatch.setenv("CYBERGIS_CACHE_DIR", str(tmp_path / "cache"))
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    connection.upload(source, str(remote), remote_is_folder=True, mode="resumable")
+    assert _read(str(remote / "source.bin")) == DATA
+    download = tmp_path / "download"
+    download.mkdir()
+    connection.download(str(remote / "source.bin"), str(download), mode="resumable")
+    assert _read(str(download / "source.bin")) == DATA
+    assert not os.path.exists(str(download / "source.bin.part.json"))
@@ -0,0 +1,51 @@
+import os
+
+from cybergis.manifest import select_files
+
+from .helpers import make_tree, read_tree
+
+
+def manifest(**sizes):
+    # {name: size}, mtimes increase in argument order
+    return {name: {"size": size, "mtime": float(i)} for i, (name, size) in enumerate(sizes.items())}
+
+
+def test_select_include_exclude():
+    m = {"a.nc": {"size": 1, "mtime": 0}, "sub/b.nc": {"size": 1, "mtime": 0}, "sub/c.txt": {"size": 1, "mtime": 0}}
+    assert select_files(m, include="*.nc") == ["a.nc", "sub/b.nc"]
+    assert select_files(m, include="sub/*", exclude="*.txt") == ["sub/b.nc"]
+
+
+def test_select_max_total_size_stops_at_first_file_that_does_not_fit():
+    m = manifest(a=10, b=50, c=5)
+    # b does not fit, so c is not considered even though it would
+    assert select_files(m, max_total_size=30) == ["a"]
+    assert select_files(m, max_total_size=30, newest_first=True) == ["c"]
+
+
+def test_select_limit_after_size_filters():
+    m = manifest(a=100, b=1, c=1, d=1)
+    assert select_files(m, max_file_size=10, limit=2) == ["b", "c"]
+    assert select_files(m, max_total_size=2, newest_first=True, limit=5) == ["d", "c"]
+
+
+def test_download_selected(connection, tmp_path):
+    remote = make_tree(str(tmp_path / "remote" / "out"), {
+        "a.nc": b"a" * 10, "sub/b.nc": b"b" * 20, "sub/c.txt": b"c", "big.nc": b"x" * 1000})
+    local = tmp_path / "local"
+    local.mkdir()
+    plan = connection.download_selected(remote, str(local), include="*.nc", max_file_size=100)
+    assert sorted(plan["files"]) == ["a.nc", "sub/b.nc"]
+    assert plan["selected_bytes"] == plan["downloaded_bytes"] == 30
+    files, _ = read_tree(str(local / "out"))
+    assert files == {"a.nc": b"a" * 10, os.path.join("sub", "b.nc"): b"b" * 20}
+
+
+def test_download_selected_dry_run(connection, tmp_path):
+    remote = make_tree(str(tmp_path / "remote" / "out"), {"a.nc": b"a"})
+    local = tmp_path / "local"
+    local.mkdir()
+    plan = connection.download_selected(remote, str(local), dry_run=True)
+    assert plan["files"] == ["a.nc"]
+    assert plan["downloaded_bytes"] == 0
+    assert not (local / "out").exists()
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from cybergis.helloworld import HelloWorldKeelingJob, HelloWorldKeelingSBatchScript
+from cybergis.local import LocalConnection
+from cybergis.monitor import get_job_status_monitor
+from cybergis.polling import wait_for_job
+
+from .helpers import make_tree, read_tree
+
+FAST = dict(pending_min_seconds=0.1, running_min_seconds=0.1, near_end_seconds=0.1)
+
+
+def test_staged_submission(tmp_path):
+    connection = LocalConnection(root_folder_path=str(tmp_path / "hpc"), run_jobs=True)
+    get_job_status_monitor(connection).refresh_seconds = 0.1
+    uploads = []
+    upload = connection.upload
+
+    def recording_upload(local_fpath, *args, **kwargs):
+        uploads.append(os.path.basename(local_fpath))
+        return upload(local_fpath, *args, **kwargs)
+    connection.upload = recording_upload
+    (tmp_path / "workspace").mkdir()
+    model = make_tree(str(tmp_path / "model"), {"in.txt": b"hello\n", "input/a.txt": b"a"}, ["output"])
+    job = HelloWorldKeelingJob(str(tmp_path / "workspace"), model, connection, HelloWorldKeelingSBatchScript(1, 1),
+                               staged_submission=True)
+    job.stage_poll_seconds = 1
+    job.go()
+    # scripts go up once, before submission; the staged upload only sends the model folder
+    assert sorted(uploads) == ["helloworld.py", "helloworld.sbatch", "model"]
+    assert wait_for_job(job, **FAST) == "C"
+    files, dirs = read_tree(connection.local_path(job.remote_model_folder_path))
+    assert files["input/a.txt"] == b"a" and "output" in dirs
+
+
+def test_failed_staged_upload_cancels_the_job(tmp_path):
+    connection = LocalConnection(root_folder_path=str(tmp_path / "hpc"), run_jobs=True)
+    get_job_status_monitor(connection).refresh_seconds = 0.1
+    upload = connection.upload
+
+    def failing_upload(local_fpath, *args, **kwargs):
+        if os.path.isdir(local_fpath):
+            raise IOError("connection dropped")
+        return upload(local_fpath, *args, **kwargs)
+    connection.upload = failing_upload
+    (tmp_path / "workspace").mkdir()
+    model = make_tree(str(tmp_path / "model"), {"in.txt": b"hello\n"})
+    job = HelloWorldKeelingJob(str(tmp_path / "workspace"), model, connection, HelloWorldKeelingSBatchScript(1, 1),
+                               staged_submission=True)
+    job.stage_poll_seconds = 1
+    with pytest.raises(IOError):
+        job.go()
+    assert job.remote_id is not None
+    assert os.path.exists(connection.local_path(job.remote_stage_failed_file_path))
+    assert not os.path.exists(connection.local_path(job.remote_stage_ready_file_path))
+    assert wait_for_job(job, **FAST) == "ERROR"
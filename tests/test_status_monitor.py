@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from cybergis.monitor import JobStatusMonitor, normalize_job_state
+
+
+class FakeSacct(object):
+    """
+    Connection answering sacct from a dict of job id --> sacct State
+    """
+    server = "fake"
+
+    def __init__(self, states=None, delay=0):
+        self.states = dict(states or {})
+        self.delay = delay
+        self.error = None
+        self.queries = []
+
+    def get_agent(self):
+        return None
+
+    def run_command(self, command, **kwargs):
+        job_ids = command.split()[2].split(",")
+        self.queries.append(job_ids)
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return ["{}|{}".format(i, self.states[i]) for i in job_ids if i in self.states]
+
+
+def test_statuses_are_cached_for_refresh_seconds():
+    connection = FakeSacct({"1": "RUNNING", "2": "PENDING"})
+    monitor = JobStatusMonitor(connection, refresh_seconds=60)
+    assert monitor.statuses([1, 2]) == {"1": "RUNNING", "2": "PENDING"}
+    connection.states["1"] = "COMPLETED"
+    assert monitor.status(1) == "RUNNING"
+    assert len(connection.queries) == 1
+
+    # a stale cache is refreshed
+    assert monitor.status(1, max_age=0) == "C"
+    assert len(connection.queries) == 2
+
+
+def test_concurrent_pollers_share_one_query():
+    connection = FakeSacct({str(i): "RUNNING" for i in range(10)}, delay=0.2)
+    monitor = JobStatusMonitor(connection, refresh_seconds=60)
+    monitor.track(*range(10))
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.update({i: monitor.status(i)})) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == dict.fromkeys(range(10), "RUNNING")
+    assert len(connection.queries) == 1
+    assert sorted(connection.queries[0], key=int) == [str(i) for i in range(10)]
+
+
+def test_failed_query_keeps_last_statuses():
+    connection = FakeSacct({"1": "RUNNING"})
+    monitor = JobStatusMonitor(connection, refresh_seconds=0)
+    monitor.unknown_grace_seconds = 0
+    monitor.track(2)
+    assert monitor.statuses([1]) == {"1": "RUNNING"}
+    connection.error = Exception("slurmdbd down")
+    # neither reverts a known job nor marks an unlisted one UNKNOWN
+    assert monitor.statuses([1, 2]) == {"1": "RUNNING", "2": "UNKNOWN"}
+    assert monitor.queries == 1
+
+
+def test_unlisted_job_is_pending_during_grace():
+    connection = FakeSacct()
+    monitor = JobStatusMonitor(connection, refresh_seconds=0)
+    monitor.unknown_grace_seconds = 60
+    assert monitor.status(5) == "PENDING"
+    monitor.unknown_grace_seconds = 0
+    assert monitor.status(5) == "UNKNOWN"
+    connection.states["5"] = "PENDING"
+    assert monitor.status(5) == "PENDING"
+
+
+def test_finished_jobs_are_not_queried():
+    connection = FakeSacct({"1": "COMPLETED", "2": "FAILED", "3": "RUNNING"})
+    monitor = JobStatusMonitor(connection, refresh_seconds=0)
+    assert monitor.statuses([1, 2, 3]) == {"1": "C", "2": "ERROR", "3": "RUNNING"}
+    monitor.refresh()
+    assert connection.queries[-1] == ["3"]
+
+
+@pytest.mark.parametrize("batch_size, queries", [(200, 1), (2, 3)])
+def test_refresh_batches(batch_size, queries):
+    connection = FakeSacct({str(i): "RUNNING" for i in range(5)})
+    monitor = JobStatusMonitor(connection, refresh_seconds=0)
+    monitor.batch_size = batch_size
+    monitor.track(*range(5))
+    monitor.refresh()
+    assert len(connection.queries) == queries
+
+
+@pytest.mark.parametrize("state, status", [("COMPLETED", "C"), ("CANCELLED by 1234", "ERROR"), ("FAILED", "ERROR"),
+                                           ("OUT_OF_MEMORY", "ERROR"), ("RUNNING", "RUNNING"), ("PD", "PENDING"),
+                                           ("CG", "RUNNING"), ("COMPLETING", "RUNNING"), ("TO", "ERROR"),
+                                           ("C", "C"), ("requeued+", "REQUEUED"), ("", "UNKNOWN")])
+def test_normalize_job_state(state, status):
+    assert normalize_job_state(state) == status
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from cybergis.compression import CompressionPolicy
+
+from .helpers import make_tree, read_tree
+
+FILES = {"a.txt": b"hello " * 1000, "sub/b.bin": os.urandom(200000), "sub/deeper/c.txt": b""}
+DIRS = ["output"]
+
+
+@pytest.fixture(params=[1e9, 1e-3], ids=["store", "gzip"])
+def stream_connection(ssh_server, request):
+    # a fast network stores, a slow one compresses
+    conn = ssh_server.connection(folder_transfer_mode="stream",
+                                 compression_policy=CompressionPolicy(network_mbps=request.param))
+    conn.login()
+    yield conn
+    conn.logout()
+
+
+def test_stream_upload(stream_connection, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "model"), FILES, DIRS)
+    os.symlink(os.path.join(local, "a.txt"), os.path.join(local, "link.txt"))
+    remote = tmp_path / "remote"
+    report = stream_connection.upload(local, str(remote), remote_is_folder=True)
+    files, dirs = read_tree(str(remote / "model"))
+    # symlinks are sent as the files they point to
+    assert files == dict(read_tree(local)[0], **{"link.txt": FILES["a.txt"]})
+    assert not os.path.islink(str(remote / "model" / "link.txt"))
+    assert "output" in dirs
+    assert report["raw_bytes"] >= sum(len(v) for v in FILES.values())
+    if report["level"] > 0:
+        assert report["sent_bytes"] < report["raw_bytes"]
+    # nothing is left behind locally
+    assert os.listdir(str(tmp_path / "local")) == ["model"]
+
+
+def test_stream_upload_failure_raises(stream_connection, tmp_path):
+    local = make_tree(str(tmp_path / "local" / "model"), FILES)
+    blocker = tmp_path / "remote"
+    blocker.write_bytes(b"not a folder")
+    with pytest.raises(Exception, match="Streaming upload"):
+        stream_connection.upload(local, str(blocker), remote_is_folder=True)
+    assert not stream_connection.in_use
+
+
+@pytest.mark.parametrize("extract_workers", [0, 2])
+def test_stream_download(stream_connection, tmp_path, extract_workers):
+    remote = make_tree(str(tmp_path / "remote" / "output"), FILES, DIRS)
+    os.chmod(os.path.join(remote, "a.txt"), 0o755)
+    local = tmp_path / "local"
+    local.mkdir()
+    report = stream_connection.download(remote, str(local), remote_is_folder=True, extract_workers=extract_workers)
+    assert read_tree(str(local / "output")) == read_tree(remote)
+    assert os.access(str(local / "output" / "a.txt"), os.X_OK)
+    assert report["raw_bytes"] == sum(len(v) for v in FILES.values())
+    # nothing is archived on remote
+    assert os.listdir(str(tmp_path / "remote")) == ["output"]
+
+
+def test_stream_download_missing_folder_raises(stream_connection, tmp_path):
+    local = tmp_path / "local"
+    local.mkdir()
+    with pytest.raises(Exception, match="Streaming download"):
+        stream_connection.download(str(tmp_path / "missing"), str(local), remote_is_folder=True)
+    assert not stream_connection.in_use